@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Atomic file replacement shared by every module that persists state under database/
+- write_atomic(): temp file in the same directory, fsync, rename, fsync the directory;
+  readers see the old file or the new one, never a partial write
+- write_json_atomic(): the same for a JSON document (UTF-8, non-ASCII kept)
+- file_signature(): size + mtime_ns, what caches compare to notice a file has changed
+- Imports nothing from backend/, so any module can use it without an import cycle
+"""
+
+import json
+import os
+import tempfile
+import time
+
+REPLACE_RETRIES = 10
+
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def write_atomic(path, data, durable=True):
+    """Replace `path` with `data` (bytes): temp file in the same directory, fsync, rename.
+
+    Readers in any process see the old file or the new one, never a partial write.
+    Windows refuses the rename while another process has the file open, so it is retried briefly.
+    durable=False skips the fsyncs (caches that are rebuilt if lost).
+    Returns the file_signature of what was written (the rename keeps it).
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        signature = file_signature(tmp)
+        for attempt in range(REPLACE_RETRIES):
+            try:
+                os.replace(tmp, path)
+                break
+            except PermissionError:
+                if attempt == REPLACE_RETRIES - 1:
+                    raise
+                time.sleep(0.05 * (attempt + 1))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    if durable and hasattr(os, 'O_DIRECTORY'):
+        # Make the rename itself durable (POSIX only)
+        dir_fd = os.open(directory, os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    return signature
+
+
+def write_json_atomic(path, data, **kwargs):
+    write_atomic(path, json.dumps(data, ensure_ascii=False, **kwargs).encode('utf-8'))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Boilerplate stripping stage for scanned email bodies
+- Known rules: the external-mail CAUTION banner (English / Chinese), separator lines, and
+  "tail" blocks (Teams join details, confidentiality disclaimers) that run to the end of the body
+- Learned rules: lines repeated across at least `min_share` of a scan's bodies
+- Only the leading and trailing runs of boilerplate are removed - lines between real content
+  and extractor labels (Inci. ID:, Cust. Name:, Description:, ...) are always kept
+- The cleaned body is what gets archived and extracted from; the original can be kept in
+  the cold archive (database/email_cold)
+- Configurable through database/boilerplate.json (any key of DEFAULT_CONFIG)
+
+Usage:
+    python backend/boilerplate.py report     # bytes saved and extraction speedup on the email log
+"""
+
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.email_archive import ARCHIVE_DIR, EmailArchive
+from backend.atomic_io import write_json_atomic
+
+CONFIG_FILE = os.path.join('database', 'boilerplate.json')
+LEARNED_FILE = os.path.join('database', 'boilerplate_learned.json')
+COLD_ARCHIVE_DIR = os.path.join('database', 'email_cold')
+# Where the cold archive lived before it moved out of the body archive's directory
+LEGACY_COLD_ARCHIVE_DIR = os.path.join(ARCHIVE_DIR, 'cold')
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    "keep_original": True,          # originals of changed bodies go to the cold archive
+    "line_rules": [
+        r"^CAUTION: This email originated from outside of the organi[sz]ation",
+        r"^警告：\s*這封電子郵件來自外來電郵",
+        r"^[*_=\-]{10,}$",
+    ],
+    "tail_rules": [                 # everything from the first matching line on is boilerplate
+        r"^Microsoft Teams (meeting|會議)",
+        r"^The information contained in this email may be confidential",
+        r"^本電郵所載數據可能屬機密",
+        r"^WARNING: INFORMATION INCLUDED ARE FOR INTENDED RECIPIENTS ONLY",
+    ],
+    "protected": r"^(Inci\. ID|Cust\. Name|Description|Number|Location|Short Description|申請編號|故障現象)\s*[:：]",
+    "learn": True,
+    "min_share": 0.3,               # a line in >= 30% of a scan's bodies is boilerplate ...
+    "min_emails": 20,               # ... once the scan has at least this many bodies
+    "max_learned": 500,
+}
+
+MIN_LEARNED_LINE = 4
+
+
+def load_config(path=CONFIG_FILE):
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    return config
+
+
+class BoilerplateStripper:
+    def __init__(self, config=None, learned_path=LEARNED_FILE):
+        self.config = config or load_config()
+        self.learned_path = learned_path
+        self._line_rules = [re.compile(r) for r in self.config['line_rules']]
+        self._tail_rules = [re.compile(r) for r in self.config['tail_rules']]
+        self._protected = re.compile(self.config['protected'], re.IGNORECASE)
+        try:
+            with open(learned_path, 'r', encoding='utf-8') as f:
+                self.learned = dict.fromkeys(json.load(f))   # oldest first
+        except (OSError, ValueError):
+            self.learned = {}
+
+    def learn(self, bodies):
+        """Add the lines repeated across this batch to the learned rules; returns how many are new"""
+        bodies = list(bodies)
+        if not self.config['learn'] or len(bodies) < self.config['min_emails']:
+            return 0
+        counts = {}
+        for body in bodies:
+            for line in {line.strip() for line in body.splitlines()}:
+                if len(line) >= MIN_LEARNED_LINE and not self._protected.match(line):
+                    counts[line] = counts.get(line, 0) + 1
+        threshold = self.config['min_share'] * len(bodies)
+        fresh = [line for line, n in counts.items() if n >= threshold and line not in self.learned]
+        self.learned.update(dict.fromkeys(fresh))
+        if len(self.learned) > self.config['max_learned']:
+            self.learned = dict.fromkeys(list(self.learned)[-self.config['max_learned']:])
+        return len(fresh)
+
+    def save_learned(self):
+        write_json_atomic(self.learned_path, list(self.learned), indent=2)
+
+    def _is_boilerplate(self, line):
+        line = line.strip()
+        if not line:
+            return True
+        if self._protected.match(line):
+            return False
+        return line in self.learned or any(r.search(line) for r in self._line_rules)
+
+    def clean(self, body):
+        lines = body.splitlines(keepends=True)
+        end = len(lines)
+        for i, line in enumerate(lines):
+            if any(r.search(line.strip()) for r in self._tail_rules):
+                end = i
+                break
+        start = 0
+        while start < end and self._is_boilerplate(lines[start]):
+            start += 1
+        while end > start and self._is_boilerplate(lines[end - 1]):
+            end -= 1
+        return ''.join(lines[start:end])
+
+
+def strip_emails(emails, stripper=None, cold_archive=None):
+    """Replace inline bodies with their cleaned version (in place).
+
+    Returns {"emails", "bytes_before", "bytes_after"}. With keep_original the
+    original of every changed body is put in the cold archive ('original_hash').
+    """
+    stripper = stripper or BoilerplateStripper()
+    inline = [e for e in emails if isinstance(e.get('body'), str)]
+    stats = {"emails": len(inline), "bytes_before": 0, "bytes_after": 0}
+    if not stripper.config['enabled'] or not inline:
+        return stats
+
+    if stripper.learn(e['body'] for e in inline):
+        stripper.save_learned()
+    changed = []
+    for email in inline:
+        original = email['body']
+        cleaned = stripper.clean(original)
+        stats['bytes_before'] += len(original.encode('utf-8'))
+        stats['bytes_after'] += len(cleaned.encode('utf-8'))
+        if cleaned != original:
+            changed.append((email, original))
+            email['body'] = cleaned
+
+    if changed and stripper.config['keep_original']:
+        cold_archive = cold_archive or EmailArchive(COLD_ARCHIVE_DIR)
+        for (email, _), digest in zip(changed, cold_archive.put_many([o for _, o in changed])):
+            email['original_hash'] = digest
+    return stats
+
+
+def move_cold_archive(root=''):
+    """Move a cold archive left inside the body archive to COLD_ARCHIVE_DIR; True if moved"""
+    legacy, target = os.path.join(root, LEGACY_COLD_ARCHIVE_DIR), os.path.join(root, COLD_ARCHIVE_DIR)
+    if not os.path.isdir(legacy) or os.path.exists(target):
+        return False
+    os.replace(legacy, target)
+    return True
+
+
+def report():
+    """Bytes saved and extraction time on original vs cleaned bodies of the logged emails"""
+    from backend.create_tickets import extract_cdc_data, extract_fw_data, extract_mx_data
+    from backend.email_log import EmailLog
+
+    archive, cold, stripper = EmailArchive(), EmailArchive(COLD_ARCHIVE_DIR), BoilerplateStripper()
+    log = EmailLog()
+    pairs = []
+    for email in log.records(range(len(log))):
+        if email.get('original_hash') in cold:
+            original, cleaned = cold.get(email['original_hash']), archive.get(email['body_hash'])
+        elif email.get('body_hash') in archive:
+            original = archive.get(email['body_hash'])
+            cleaned = stripper.clean(original)
+        else:
+            continue
+        pairs.append((original, cleaned))
+    if not pairs:
+        print("No archived bodies to report on")
+        return
+
+    extractors = (extract_cdc_data, extract_mx_data, extract_fw_data)
+
+    def run(bodies, rounds=20):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            results = [[extract({'body': body}) for extract in extractors] for body in bodies]
+        return time.perf_counter() - start, results
+
+    before = sum(len(o.encode('utf-8')) for o, _ in pairs)
+    after = sum(len(c.encode('utf-8')) for _, c in pairs)
+    t_original, r_original = run([o for o, _ in pairs])
+    t_cleaned, r_cleaned = run([c for _, c in pairs])
+    differ = sum(1 for a, b in zip(r_original, r_cleaned) if a != b)
+
+    print(f"Bodies: {len(pairs)}")
+    print(f"Bytes: {before:,} -> {after:,} (saved {before - after:,}, {(before - after) / before:.0%})")
+    print(f"Extraction: {t_original * 1000:.1f} ms -> {t_cleaned * 1000:.1f} ms ({t_original / t_cleaned:.2f}x)")
+    print(f"Extraction results that differ: {differ}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['report']:
+        report()
+    else:
+        print(__doc__.split('Usage:')[1].rstrip())
@@ -1,13 +1,13 @@
 #!/usr/bin/env python3
-import json
 import re
 import sys
 import io
-from datetime import datetime
+import os
 
-if sys.platform == "win32":
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.partitions import month_of
+from backend.ticket_index import stamp, ticket_ts
+from backend.ticket_events import BASE_FIELDS
 
 def contains(text: str, search: str) -> bool:
     return search.lower() in text.lower()
@@ -181,50 +181,46 @@ def extract_mx_data(email_data):
     
     return mx_data
 
-def format_date(date_str):
-    """Convert date string to YYYY-MM-DD HH:MM format"""
-    try:
-        # Handle different date formats
-        if 'T' in date_str and 'Z' in date_str:
-            dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-        elif '+' in date_str:
-            dt = datetime.fromisoformat(date_str)
-        else:
-            dt = datetime.fromisoformat(date_str)
-        
-        return dt.strftime('%Y-%m-%d %H:%M')
-    except:
-        try:
-            if ' ' in date_str:
-                date_part = date_str.split(' ')[0]
-                time_part = date_str.split(' ')[1].split('.')[0].split('+')[0]
-                return f"{date_part} {time_part[:5]}"
-        except:
-            pass
-        return date_str
+def load_existing_tickets(store, new_tickets):
+    """Load only the partitions the new tickets touch.
 
-def load_existing_tickets():
-    """Load existing ticket.json if it exists"""
-    try:
-        with open('database/ticket.json', 'r', encoding='utf-8') as f:
-            existing = json.load(f)
-            print(f"Loaded {len(existing)} existing tickets from ticket.json")
-            return existing
-    except FileNotFoundError:
-        print("No existing ticket.json found - will create new one")
-        return []
-    except Exception as e:
-        print(f"Error loading existing tickets: {e}")
-        return []
+    Returns (existing tickets, months loaded, new tickets that can be merged); tickets
+    that belong to a sealed (read-only) month are left out.
+    """
+    manifest = store.manifest()
+    mergeable = []
+    months = set()
+    for ticket in new_tickets:
+        touched = {month_of(ticket), manifest.get(ticket['ticket_number'], month_of(ticket))}
+        sealed = [m for m in touched if store.is_sealed(m)]
+        if sealed:
+            print(f"  Skipped: {ticket['ticket_number']} - month {sealed[0]} is sealed")
+            continue
+        months |= touched
+        mergeable.append(ticket)
+
+    existing = store.load(months)
+    print(f"Loaded {len(existing)} existing tickets from {len(months)} of {len(store.months())} monthly partitions")
+    return existing, months, mergeable
 
-def merge_tickets(existing_tickets, new_tickets):
-    """Merge new tickets with existing, preserving edits and avoiding duplicates"""
+def merge_tickets(existing_tickets, new_tickets, rollup=None, delta=None, duplicates=None):
+    """Merge new tickets with existing, preserving edits and avoiding duplicates.
+
+    If a TicketRollup is given it is updated in place for every added/changed ticket.
+    If a DuplicateIndex is given added/changed tickets are (re-)indexed in it.
+    If a `delta` dict is given it receives 'added' (new tickets) and 'updated'
+    ({ticket_number, changes, previous} per ticket whose base fields changed),
+    plus 'possible_duplicates' ({ticket_number: [[other, similarity]]}) for added tickets.
+    """
     
     # Create a dictionary of existing tickets by ticket_number
     existing_dict = {ticket['ticket_number']: ticket for ticket in existing_tickets}
     
     added_count = 0
     updated_count = 0
+    added = []
+    added_numbers = set()
+    updated = {}
     
     for new_ticket in new_tickets:
         ticket_num = new_ticket['ticket_number']
@@ -232,23 +228,30 @@ def merge_tickets(existing_tickets, new_tickets):
         if ticket_num in existing_dict:
             # Ticket already exists - UPDATE only the base fields if changed
             existing = existing_dict[ticket_num]
+            old_key = rollup.key_of(existing) if rollup else None
+            old_date = existing.get('date')
             
             # Update basic fields only if they changed (preserve user edits)
-            if new_ticket.get('shop') and new_ticket['shop'] != existing.get('shop'):
-                existing['shop'] = new_ticket['shop']
-                updated_count += 1
-            
-            if new_ticket.get('description') and new_ticket['description'] != existing.get('description'):
-                existing['description'] = new_ticket['description']
-                updated_count += 1
-            
-            if new_ticket.get('date') and new_ticket['date'] != existing.get('date'):
-                existing['date'] = new_ticket['date']
-                updated_count += 1
+            for field in BASE_FIELDS:
+                if new_ticket.get(field) and new_ticket[field] != existing.get(field):
+                    if ticket_num not in added_numbers:
+                        change = updated.setdefault(ticket_num, {"ticket_number": ticket_num, "changes": {}, "previous": {}})
+                        change['previous'].setdefault(field, existing.get(field))
+                        change['changes'][field] = new_ticket[field]
+                    existing[field] = new_ticket[field]
+                    updated_count += 1
+            # date_ts follows date (and is back-filled on tickets saved before it existed)
+            if existing.get('date') != old_date or 'date_ts' not in existing:
+                stamp(existing)
             
             # DO NOT update: problem, handled_by, status, resolve_time, ph_rm_os, solution, fu_action
             # These are user-edited fields that should be preserved!
             
+            if rollup:
+                rollup.update(old_key, existing)
+            if duplicates is not None:
+                duplicates.add(existing)
+            
         else:
             # NEW ticket - add with default values for editable fields
             new_ticket['problem'] = new_ticket.get('problem', '')
@@ -261,12 +264,18 @@ def merge_tickets(existing_tickets, new_tickets):
             
             existing_dict[ticket_num] = new_ticket
             added_count += 1
+            added.append(new_ticket)
+            added_numbers.add(ticket_num)
+            if rollup:
+                rollup.add(new_ticket)
+            if duplicates is not None:
+                duplicates.add(new_ticket)
     
     # Convert back to list
     merged_tickets = list(existing_dict.values())
     
     # Sort by date (newest first)
-    merged_tickets.sort(key=lambda x: x.get('date', ''), reverse=True)
+    merged_tickets.sort(key=lambda x: ticket_ts(x) or 0, reverse=True)
     
     print(f"\nMerge Summary:")
     print(f"  Existing tickets: {len(existing_tickets)}")
@@ -274,84 +283,34 @@ def merge_tickets(existing_tickets, new_tickets):
     print(f"  Tickets updated: {updated_count}")
     print(f"  Total tickets: {len(merged_tickets)}")
     
+    if delta is not None:
+        delta['added'] = added
+        delta['updated'] = list(updated.values())
+        if duplicates is not None:
+            # After the whole batch, so tickets from the same scan can match each other
+            possible = {t['ticket_number']: duplicates.similar(t['ticket_number']) for t in added}
+            delta['possible_duplicates'] = {num: [list(m) for m in matches] for num, matches in possible.items() if matches}
+    
     return merged_tickets
 
 def create_ticket_json():
-    """Process outlook_emails.json and create/update ticket.json with merged data"""
-    
-    # Load data
-    try:
-        with open('database/outlook_emails.json', 'r', encoding='utf-8') as f:
-            emails = json.load(f)
-    except FileNotFoundError:
-        print("ERROR: outlook_emails.json not found. Please run test_quick.py first.")
-        return
-    
+    """Process this scan's emails and create/update the ticket partitions with merged data.
+
+    The stages live in pipeline.py; a compact summary of what changed is written to scan_result.json.
+    """
+    from backend.pipeline import PipelineError, ScanPipeline
+    pipeline = ScanPipeline()
     try:
-        with open('database/email_filters.json', 'r', encoding='utf-8') as f:
-            filters = json.load(f)
-    except FileNotFoundError:
-        print("ERROR: email_filters.json not found.")
-        return
-    
-    # Load existing tickets
-    existing_tickets = load_existing_tickets()
-    
-    # Process new emails
-    new_tickets = []
-    processed_count = 0
-    
-    print("\nProcessing emails and extracting ticket data...")
-    
-    for email in emails:
-        # Apply filters to see if this email should be processed
-        actions = apply_filters(filters, email)
-        
-        if not actions:
-            continue
-        
-        processed_count += 1
-        ticket_data = {}
-        
-        # Extract data based on the action
-        if 'extract_cdc' in actions:
-            extracted = extract_cdc_data(email)
-            ticket_data.update(extracted)
-        elif 'send_mx_alert' in actions:
-            extracted = extract_mx_data(email)
-            ticket_data.update(extracted)
-        elif 'extract_fw' in actions:
-            extracted = extract_fw_data(email)
-            ticket_data.update(extracted)
-        
-        # Only add if we have ticket data
-        if ticket_data and 'ticket_number' in ticket_data:
-            # Format the date
-            ticket_data['date'] = format_date(email.get('date', ''))
-            
-            # Ensure all required fields are present
-            if 'shop' not in ticket_data:
-                ticket_data['shop'] = ''
-            if 'description' not in ticket_data:
-                ticket_data['description'] = ''
-            
-            new_tickets.append(ticket_data)
-            print(f"  Found: {ticket_data['ticket_number']} - {ticket_data['shop']}")
-    
-    print(f"\nExtracted {len(new_tickets)} tickets from {len(emails)} emails")
-    
-    # Merge with existing tickets
-    merged_tickets = merge_tickets(existing_tickets, new_tickets)
-    
-    # Save to ticket.json
-    with open('database/ticket.json', 'w', encoding='utf-8') as f:
-        json.dump(merged_tickets, f, indent=2, ensure_ascii=False)
+        result = pipeline.run()
+    except PipelineError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
     
-    print(f"\n[OK] Successfully saved to ticket.json")
+    print(f"\n[OK] Successfully saved {result['partitions_written']} monthly ticket partitions")
     
-    if merged_tickets:
+    if pipeline.merged:
         print(f"\nLatest 3 tickets:")
-        for i, ticket in enumerate(merged_tickets[:3]):
+        for i, ticket in enumerate(pipeline.merged[:3]):
             desc = ticket['description'][:40] + "..." if len(ticket['description']) > 40 else ticket['description']
             status = ticket.get('status', 'in progress')
             handler = ticket.get('handled_by', 'USE_MISSING')
@@ -359,4 +318,7 @@ def create_ticket_json():
             print(f"     Status: {status} | Handler: {handler} | {desc}")
 
 if __name__ == "__main__":
+    if sys.platform == "win32":
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
     create_ticket_json()
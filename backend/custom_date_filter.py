@@ -1,104 +1,113 @@
 #!/usr/bin/env python3
+"""
+Custom date range filter
+- Writes the tickets between two dates to target_ticket.json (or --output)
+- Dates: DD-MM-YYYY, YYYY-MM-DD or 'YYYY-MM-DD HH:MM'; a date-only end date covers the whole day
+- Reads only the monthly ticket partitions overlapping the range and bisects their date index
+
+Usage:
+    python backend/custom_date_filter.py 20-1-2026 22-1-2026
+    python backend/custom_date_filter.py --month 2026-01 --output database/january_2026_tickets.json
+    python backend/custom_date_filter.py --last-days 7
+"""
+import argparse
 import json
-from datetime import datetime
+import os
+import sys
+import time
+from datetime import date, timedelta
 
-def parse_date(date_str):
-    """Parse date string in various formats"""
-    try:
-        # Handle YYYY-MM-DD HH:MM format
-        if ' ' in date_str and ':' in date_str:
-            return datetime.strptime(date_str[:16], '%Y-%m-%d %H:%M')
-        # Handle YYYY-MM-DD format
-        elif '-' in date_str and len(date_str) == 10:
-            return datetime.strptime(date_str, '%Y-%m-%d')
-        # Handle DD-MM-YYYY format
-        elif date_str.count('-') == 2:
-            # Try DD-MM-YYYY format
-            parts = date_str.split('-')
-            if len(parts) == 3 and len(parts[2]) == 4:
-                return datetime.strptime(date_str, '%d-%m-%Y')
-        return None
-    except:
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.ticket_index import DateIndex, day_of, parse_bound
+from backend.ticket_rollup import brand_of
+from backend.ticket_store import ticket_partitions
+
+TARGET_FILE = os.path.join('database', 'target_ticket.json')
+
+
+def load_index(start=None, end=None):
+    """DateIndex over the partitions overlapping start..end (date objects), or None if there are no tickets"""
+    store = ticket_partitions()
+    if not store.months():
+        print("Error: no tickets found. Please run create_tickets.py first.")
         return None
+    return DateIndex(store.load_range(start, end))
+
 
-def filter_tickets_by_date_range(tickets, start_date_str, end_date_str):
-    """Filter tickets within date range"""
-    start_date = parse_date(start_date_str)
-    end_date = parse_date(end_date_str)
-    
-    if not start_date or not end_date:
-        print(f"Error: Invalid date format for {start_date_str} or {end_date_str}")
+def filter_tickets_by_date_range(index, start_date_str, end_date_str):
+    """Tickets within the date range (inclusive), oldest first"""
+    try:
+        start = parse_bound(start_date_str)
+        end = parse_bound(end_date_str, end=True)
+    except ValueError as e:
+        print(f"Error: {e}")
         return []
-    
-    # Set end_date to end of day if it's just a date
-    if parse_date(end_date_str) and end_date.hour == 0 and end_date.minute == 0:
-        end_date = end_date.replace(hour=23, minute=59)
-    
-    filtered_tickets = []
-    
+    return index.range(start, end)
+
+
+def month_range(month):
+    """'YYYY-MM' -> ('YYYY-MM-01', last day of the month)"""
+    first = date.fromisoformat(f"{month}-01")
+    last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return first.isoformat(), last.isoformat()
+
+
+def print_summary(tickets):
+    counts = {}
     for ticket in tickets:
-        ticket_date = parse_date(ticket['date'])
-        if ticket_date and start_date <= ticket_date <= end_date:
-            filtered_tickets.append(ticket)
-    
-    return filtered_tickets
+        brand = brand_of(ticket.get('shop'))
+        counts[brand] = counts.get(brand, 0) + 1
+    print("Summary: " + ", ".join(f"{brand}={n}" for brand, n in sorted(counts.items())))
+    print(f"Date range: {tickets[0]['date']} to {tickets[-1]['date']}")
+
+
+def set_custom_date_range(start_date, end_date, output=TARGET_FILE, index=None):
+    """Write the tickets from start_date to end_date to `output`"""
+    if index is None:
+        try:
+            index = load_index(day_of(parse_bound(start_date)), day_of(parse_bound(end_date, end=True)))
+        except ValueError as e:
+            print(f"Error: {e}")
+            return []
+    if index is None:
+        return []
 
-def set_custom_date_range(start_date, end_date):
-    """Set custom date range and create target_ticket.json"""
-    
-    try:
-        with open('database/ticket.json', 'r', encoding='utf-8') as f:
-            all_tickets = json.load(f)
-    except FileNotFoundError:
-        print("Error: ticket.json not found. Please run create_tickets.py first.")
-        return
-    
     print(f"Filtering tickets from {start_date} to {end_date}")
-    
-    filtered_tickets = filter_tickets_by_date_range(all_tickets, start_date, end_date)
-    
+    started = time.perf_counter()
+    filtered_tickets = filter_tickets_by_date_range(index, start_date, end_date)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
     if filtered_tickets:
-        with open('database/target_ticket.json', 'w', encoding='utf-8') as f:
+        with open(output, 'w', encoding='utf-8') as f:
             json.dump(filtered_tickets, f, indent=2, ensure_ascii=False)
-        
-        print(f"SUCCESS: Created target_ticket.json with {len(filtered_tickets)} tickets")
-        
-        # Show summary
-        cdc_count = len([t for t in filtered_tickets if t['shop'].startswith('cdc')])
-        ss_count = len([t for t in filtered_tickets if t['shop'].startswith('SS')])
-        mx_count = len([t for t in filtered_tickets if t['shop'].startswith('MX')])
-        
-        print(f"Summary: CDC={cdc_count}, SS={ss_count}, MX={mx_count}")
-        
-        # Show date range of filtered tickets
-        if filtered_tickets:
-            first_date = filtered_tickets[0]['date']
-            last_date = filtered_tickets[-1]['date']
-            print(f"Date range: {first_date} to {last_date}")
+        print(f"SUCCESS: Created {output} with {len(filtered_tickets)} of {len(index)} tickets ({elapsed_ms:.2f} ms)")
+        print_summary(filtered_tickets)
     else:
         print(f"No tickets found in date range {start_date} to {end_date}")
+    return filtered_tickets
+
 
-# Easy to use functions for common date ranges
-def filter_last_week():
-    """Filter tickets from last week"""
-    set_custom_date_range("22-1-2026", "28-1-2026")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Write the tickets inside a date range to a JSON file")
+    parser.add_argument('start', nargs='?', help="start date (DD-MM-YYYY or YYYY-MM-DD)")
+    parser.add_argument('end', nargs='?', help="end date, inclusive (defaults to start)")
+    parser.add_argument('--month', help="whole month, YYYY-MM")
+    parser.add_argument('--last-days', type=int, help="the last N days up to today")
+    parser.add_argument('--output', '-o', default=TARGET_FILE, help=f"output file (default {TARGET_FILE})")
+    args = parser.parse_args(argv)
 
-def filter_three_days():
-    """Filter tickets from 3 days"""
-    set_custom_date_range("20-1-2026", "22-1-2026")
+    if args.month:
+        args.start, args.end = month_range(args.month)
+    elif args.last_days:
+        today = date.today()
+        args.start, args.end = (today - timedelta(days=args.last_days - 1)).isoformat(), today.isoformat()
+    elif not args.start:
+        parser.error("give a start date, --month or --last-days")
+    args.end = args.end or args.start
+    return args
 
-def filter_january():
-    """Filter all January tickets"""
-    set_custom_date_range("1-1-2026", "31-1-2026")
 
 if __name__ == "__main__":
+    args = parse_args()
     print("=== Custom Date Range Filter ===")
-    print("Available functions:")
-    print("- filter_last_week()  # 22-1-2026 to 28-1-2026")
-    print("- filter_three_days() # 20-1-2026 to 22-1-2026") 
-    print("- filter_january()    # 1-1-2026 to 31-1-2026")
-    print("- set_custom_date_range('DD-MM-YYYY', 'DD-MM-YYYY') # Custom range")
-    
-    # Run example
-    print(f"\nRunning example: filter_three_days()")
-    filter_three_days()
\ No newline at end of file
+    set_custom_date_range(args.start, args.end, args.output)
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Content-addressed email body archive
+- Each distinct body is stored once in bodies.dat under its BLAKE2b content hash
+- Bodies are zlib-compressed with a preset dictionary trained on our own emails
+  (the CAUTION banner, Teams meeting footer and ticket templates repeat in almost every body)
+- bodies.idx is a compact binary offset index: hash -> (offset, length, raw length, dictionary)
+- retrain() writes a new generation (bodies-<n>.dat / .idx, fsynced) and then the one-line
+  `generation` marker; readers follow the marker, so they never pair an index with the
+  data file or dictionary of another generation, even after a crash mid-retrain
+- Email records (outlook_emails.json, database/emails/) carry 'body_hash' instead of 'body';
+  email_body() reads one body on demand
+
+Usage:
+    python backend/email_archive.py stats
+    python backend/email_archive.py show <hash prefix | subject text>
+    python backend/email_archive.py migrate     # move inline bodies out of the email partitions
+    python backend/email_archive.py retrain     # retrain the dictionary and repack every body
+"""
+
+import argparse
+import hashlib
+import os
+import struct
+import sys
+import zlib
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.atomic_io import file_signature, write_atomic
+
+ARCHIVE_DIR = os.path.join('database', 'email_archive')
+DATA_FILE = 'bodies.dat'
+INDEX_FILE = 'bodies.idx'
+GENERATION_FILE = 'generation'   # current generation number; missing = 0 (bodies.dat / bodies.idx)
+
+INDEX_MAGIC = b'EBX1'
+INDEX_RECORD = struct.Struct('>16sQIIH')   # digest, offset, stored length, raw length, dictionary id
+NO_DICTIONARY = 0
+
+DICTIONARY_SIZE = 32 * 1024    # zlib only looks back 32 KB
+TRAIN_MIN_BODIES = 20          # don't train a dictionary on fewer bodies than this
+MIN_LINE = 8                   # shorter lines are not worth a dictionary slot
+
+
+def body_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def train_dictionary(bodies, size=DICTIONARY_SIZE):
+    """Preset dictionary made of the lines shared by several bodies.
+
+    zlib finds matches near the end of the dictionary more cheaply, so the most
+    common lines are placed last.
+    """
+    counts = Counter()
+    for body in bodies:
+        counts.update({line for line in body.splitlines(keepends=True) if len(line.strip()) >= MIN_LINE})
+    shared = sorted((line for line, n in counts.items() if n > 1), key=lambda line: (-counts[line], line))
+
+    picked, total = [], 0
+    for line in shared:
+        encoded = line.encode('utf-8')
+        if total + len(encoded) > size:
+            continue
+        picked.append(encoded)
+        total += len(encoded)
+    return b''.join(reversed(picked))
+
+
+def generation_files(generation):
+    """(data file, index file) names of an archive generation"""
+    if generation == 0:
+        return DATA_FILE, INDEX_FILE
+    return f"bodies-{generation}.dat", f"bodies-{generation}.idx"
+
+
+class EmailArchive:
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self._index = None
+        self._index_signature = None
+        self._index_generation = 0
+        self._generation = None
+        self._generation_signature = None
+        self._dictionaries = {}
+
+    def _file(self, name):
+        return os.path.join(self.directory, name)
+
+    def _dictionary_path(self, dict_id):
+        return self._file(f"zdict-{dict_id}.bin")
+
+    def generation(self):
+        """Current generation number (cached until the marker changes)"""
+        signature = file_signature(self._file(GENERATION_FILE))
+        if self._generation is None or signature != self._generation_signature:
+            try:
+                with open(self._file(GENERATION_FILE), 'r', encoding='utf-8') as f:
+                    self._generation = int(f.read().strip() or 0)
+            except (FileNotFoundError, ValueError):
+                self._generation = 0
+            self._generation_signature = signature
+        return self._generation
+
+    def index(self):
+        """{hex hash: (offset, length, raw length, dictionary id)} (cached until the index changes)"""
+        generation = self.generation()
+        index_file = self._file(generation_files(generation)[1])
+        signature = (generation, file_signature(index_file))
+        if self._index is None or signature != self._index_signature:
+            index = {}
+            try:
+                with open(index_file, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = b''
+            if data[:len(INDEX_MAGIC)] == INDEX_MAGIC:
+                data = data[len(INDEX_MAGIC):]
+                # A torn trailing record (crash mid-append) is ignored
+                usable = len(data) - len(data) % INDEX_RECORD.size
+                for digest, offset, length, raw_length, dict_id in INDEX_RECORD.iter_unpack(data[:usable]):
+                    index[digest.hex()] = (offset, length, raw_length, dict_id)
+            self._index = index
+            self._index_signature = signature
+            self._index_generation = generation
+        return self._index
+
+    def __len__(self):
+        return len(self.index())
+
+    def __contains__(self, digest):
+        return digest in self.index()
+
+    def current_dictionary(self):
+        """Id of the newest trained dictionary (NO_DICTIONARY before the first training)"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return NO_DICTIONARY
+        ids = [int(n[6:-4]) for n in names if n.startswith('zdict-') and n.endswith('.bin') and n[6:-4].isdigit()]
+        return max(ids, default=NO_DICTIONARY)
+
+    def dictionary(self, dict_id):
+        if dict_id == NO_DICTIONARY:
+            return b''
+        if dict_id not in self._dictionaries:
+            with open(self._dictionary_path(dict_id), 'rb') as f:
+                self._dictionaries[dict_id] = f.read()
+        return self._dictionaries[dict_id]
+
+    def _add_dictionary(self, bodies):
+        zdict = train_dictionary(bodies)
+        if not zdict:
+            return NO_DICTIONARY
+        dict_id = self.current_dictionary() + 1
+        os.makedirs(self.directory, exist_ok=True)
+        write_atomic(self._dictionary_path(dict_id), zdict)
+        self._dictionaries[dict_id] = zdict
+        return dict_id
+
+    def _compress(self, raw, dict_id):
+        zdict = self.dictionary(dict_id)
+        compressor = zlib.compressobj(9, zdict=zdict) if zdict else zlib.compressobj(9)
+        return compressor.compress(raw) + compressor.flush()
+
+    def put_many(self, texts):
+        """Store every body not archived yet; returns their hashes in order"""
+        index = self.index()
+        digests = [body_hash(text) for text in texts]
+        fresh = {}
+        for digest, text in zip(digests, texts):
+            if digest not in index:
+                fresh.setdefault(digest, text)
+        if not fresh:
+            return digests
+
+        dict_id = self.current_dictionary()
+        if dict_id == NO_DICTIONARY and len(index) + len(fresh) >= TRAIN_MIN_BODIES:
+            # First training: archived bodies (stored without a dictionary) plus this batch
+            dict_id = self._add_dictionary([self.get(d) for d in index] + list(fresh.values()))
+
+        os.makedirs(self.directory, exist_ok=True)
+        data_file, index_file = generation_files(self._index_generation)
+        with open(self._file(data_file), 'ab') as data, open(self._file(index_file), 'ab') as idx:
+            if idx.tell() == 0:
+                idx.write(INDEX_MAGIC)
+            offset = data.seek(0, os.SEEK_END)
+            records = []
+            for digest, text in fresh.items():
+                raw = text.encode('utf-8')
+                stored = self._compress(raw, dict_id)
+                data.write(stored)
+                records.append(INDEX_RECORD.pack(bytes.fromhex(digest), offset, len(stored), len(raw), dict_id))
+                offset += len(stored)
+            # Bodies reach the disk before the index entries that point at them
+            data.flush()
+            os.fsync(data.fileno())
+            idx.write(b''.join(records))
+        return digests
+
+    def put(self, text):
+        return self.put_many([text])[0]
+
+    def get(self, digest):
+        """Body text for `digest`; KeyError if it is not archived"""
+        offset, length, _, dict_id = self.index()[digest]
+        with open(self._file(generation_files(self._index_generation)[0]), 'rb') as f:
+            f.seek(offset)
+            stored = f.read(length)
+        zdict = self.dictionary(dict_id)
+        decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+        return (decompressor.decompress(stored) + decompressor.flush()).decode('utf-8')
+
+    def retrain(self):
+        """Train a new dictionary on every archived body and repack the archive with it.
+
+        The repacked bodies and index go to a new generation's files (written durably); the
+        generation marker is written last, so a crash leaves the old generation in use.
+        """
+        index = self.index()
+        old_generation = self._index_generation
+        bodies = {digest: self.get(digest) for digest in index}
+        old_ids = {entry[3] for entry in index.values()}
+        dict_id = self._add_dictionary(bodies.values())
+
+        data, records, offset = [], [INDEX_MAGIC], 0
+        for digest, text in bodies.items():
+            raw = text.encode('utf-8')
+            stored = self._compress(raw, dict_id)
+            data.append(stored)
+            records.append(INDEX_RECORD.pack(bytes.fromhex(digest), offset, len(stored), len(raw), dict_id))
+            offset += len(stored)
+        generation = old_generation + 1
+        data_file, index_file = generation_files(generation)
+        write_atomic(self._file(data_file), b''.join(data))
+        write_atomic(self._file(index_file), b''.join(records))
+        write_atomic(self._file(GENERATION_FILE), str(generation).encode('ascii'))
+
+        # Only now is the old generation unreferenced (files of a retrain that crashed go too)
+        for name in os.listdir(self.directory):
+            if name.startswith('bodies') and name not in (data_file, index_file):
+                os.remove(self._file(name))
+        for old in old_ids - {dict_id, NO_DICTIONARY}:
+            os.remove(self._dictionary_path(old))
+            self._dictionaries.pop(old, None)
+        return dict_id
+
+    def stats(self):
+        index = self.index()
+        return {
+            "bodies": len(index),
+            "raw_bytes": sum(entry[2] for entry in index.values()),
+            "stored_bytes": sum(entry[1] for entry in index.values()),
+            "dictionary": self.current_dictionary()
+        }
+
+    def size(self):
+        """Bytes on disk (bodies, index and dictionaries)"""
+        try:
+            return sum(os.path.getsize(self._file(n)) for n in os.listdir(self.directory)
+                       if os.path.isfile(self._file(n)))
+        except FileNotFoundError:
+            return 0
+
+    def clear(self):
+        """Remove the archive's own files (directories inside it are left alone)"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if os.path.isfile(self._file(name)):
+                os.remove(self._file(name))
+        self._index = None
+        self._dictionaries = {}
+
+
+def store_bodies(emails, archive):
+    """Archive the inline bodies of `emails`; returns copies with 'body_hash' in place of 'body'"""
+    inline = [e for e in emails if 'body' in e]
+    digests = iter(archive.put_many([str(e['body']) for e in inline]))
+    stubs = []
+    for email in emails:
+        if 'body' in email:
+            email = {k: v for k, v in email.items() if k != 'body'}
+            email['body_hash'] = next(digests)
+        stubs.append(email)
+    return stubs
+
+
+def email_body(email, archive):
+    """The email's body - inline (older records) or read from the archive"""
+    if 'body' in email:
+        return email['body']
+    digest = email.get('body_hash')
+    if not digest:
+        return ''
+    try:
+        return archive.get(digest)
+    except KeyError:
+        print(f"Body {digest} missing from the email archive")
+        return ''
+
+
+def with_body(email, archive):
+    """Copy of `email` with its body filled in"""
+    return email if 'body' in email else dict(email, body=email_body(email, archive))
+
+
+def strip_partitions(store, archive, clean=None):
+    """Move inline bodies of the writable email partitions into the archive; returns how many moved.
+
+    `clean(records)` (e.g. boilerplate.strip_emails) may rewrite the inline bodies first.
+    """
+    moved = 0
+    for month in store.months():
+        if store.is_sealed(month):
+            continue
+        records = store.read(month)
+        count = sum(1 for r in records if 'body' in r)
+        if count:
+            if clean is not None:
+                clean(records)
+            store.write(store_bodies(records, archive), [month])
+            moved += count
+    return moved
+
+
+if __name__ == "__main__":
+    from backend.partitions import PartitionedStore, email_key
+
+    parser = argparse.ArgumentParser(description="Inspect and maintain the email body archive")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('stats', help="body count and compression")
+    show = sub.add_parser('show', help="print archived bodies")
+    show.add_argument('query', help="hash prefix or part of a subject")
+    sub.add_parser('migrate', help="move inline bodies out of the email partitions")
+    sub.add_parser('retrain', help="retrain the dictionary and repack every body")
+    args = parser.parse_args()
+
+    archive = EmailArchive()
+    emails = PartitionedStore(os.path.join('database', 'emails'), email_key,
+                              legacy_path=os.path.join('database', 'outlook_emails.json'))
+
+    if args.command == 'stats':
+        stats = archive.stats()
+        ratio = stats['stored_bytes'] / stats['raw_bytes'] if stats['raw_bytes'] else 0
+        print(f"Bodies: {stats['bodies']}")
+        print(f"Raw: {stats['raw_bytes']:,} bytes, stored: {stats['stored_bytes']:,} bytes ({ratio:.1%})")
+        print(f"Dictionary: zdict-{stats['dictionary']}.bin" if stats['dictionary'] else "Dictionary: none yet")
+    elif args.command == 'show':
+        query = args.query.lower()
+        matches = [d for d in archive.index() if d.startswith(query)]
+        if matches:
+            for digest in matches:
+                print(f"=== {digest} ===\n{archive.get(digest)}")
+        else:
+            for email in emails.load():
+                if query in str(email.get('subject', '')).lower():
+                    print(f"=== {email.get('date')} | {email.get('sender')} | {email.get('subject')} ===")
+                    print(email_body(email, archive))
+    elif args.command == 'migrate':
+        print(f"Moved {strip_partitions(emails, archive)} inline bodies into {archive.directory}")
+    elif args.command == 'retrain':
+        print(f"Repacked {len(archive)} bodies with dictionary zdict-{archive.retrain()}.bin")
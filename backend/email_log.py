@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Append-only log of every scanned email, read through mmap
+- emails.ndjson holds one email record per line (bodies live in the email archive, see email_archive.py)
+- emails.ndx is a fixed-size sidecar index: offset, length, received time, sender hash,
+  record hash and ticket number for every line
+- Lookups by position, ticket number, sender or time range slice only the lines they need
+  out of the mapped file, so worker processes share the page cache instead of parsing it
+- The scanners append what they keep and list its positions in scan_stats.json;
+  create_tickets.py reads just those records
+
+Usage:
+    python backend/email_log.py ticket HK540639
+    python backend/email_log.py range 2026-02-01 2026-02-07
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from bisect import bisect_left, bisect_right
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.email_archive import ARCHIVE_DIR
+from backend.partitions import email_key
+from backend.ticket_index import parse_bound, to_epoch
+from backend.atomic_io import file_signature
+
+LOG_FILE = 'emails.ndjson'
+LOG_INDEX_FILE = 'emails.ndx'
+
+LOG_INDEX_MAGIC = b'ELX1'
+# offset, length, received (epoch seconds, -1 unknown), sender hash, record hash, ticket number
+LOG_RECORD = struct.Struct('>QIq8s8s24s')
+TICKET_FIELD = 24
+NO_TIME = -1
+
+
+def _hash8(text):
+    return hashlib.blake2b(str(text or '').strip().lower().encode('utf-8'), digest_size=8).digest()
+
+
+def _received(email):
+    ts = to_epoch(str(email.get('date') or ''))
+    return NO_TIME if ts is None else ts
+
+
+def _ticket_field(number):
+    return str(number or '').encode('utf-8')[:TICKET_FIELD]
+
+
+class LogEntry:
+    __slots__ = ('position', 'offset', 'length', 'received', 'sender', 'key', 'ticket')
+
+    def __init__(self, position, offset, length, received, sender, key, ticket):
+        self.position = position
+        self.offset = offset
+        self.length = length
+        self.received = None if received == NO_TIME else received
+        self.sender = sender
+        self.key = key
+        self.ticket = ticket.rstrip(b'\0').decode('utf-8', errors='replace')
+
+
+class EmailLog:
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self._entries = None
+        self._signature = None
+        self._by_key = None
+        self._by_ticket = None
+        self._by_time = None
+        self._map = None
+        self._map_size = 0
+
+    def _file(self, name):
+        return os.path.join(self.directory, name)
+
+    def entries(self):
+        """Index entries in log order (cached until emails.ndx changes)"""
+        signature = file_signature(self._file(LOG_INDEX_FILE))
+        if self._entries is None or signature != self._signature:
+            try:
+                with open(self._file(LOG_INDEX_FILE), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = b''
+            entries = []
+            if data[:len(LOG_INDEX_MAGIC)] == LOG_INDEX_MAGIC:
+                data = data[len(LOG_INDEX_MAGIC):]
+                usable = len(data) - len(data) % LOG_RECORD.size
+                for position, fields in enumerate(LOG_RECORD.iter_unpack(data[:usable])):
+                    entries.append(LogEntry(position, *fields))
+            self._entries = entries
+            self._signature = signature
+            self._by_key = self._by_ticket = self._by_time = None
+        return self._entries
+
+    def __len__(self):
+        return len(self.entries())
+
+    def _mapped(self, end):
+        """The log file mapped read-only, remapped once it has grown past `end`"""
+        if self._map is None or self._map_size < end:
+            if self._map is not None:
+                self._map.close()
+            with open(self._file(LOG_FILE), 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._map_size = len(self._map)
+        return self._map
+
+    def _read(self, entry):
+        view = self._mapped(entry.offset + entry.length)
+        return json.loads(view[entry.offset:entry.offset + entry.length])
+
+    def record(self, position):
+        return self._read(self.entries()[position])
+
+    def records(self, positions):
+        entries = self.entries()
+        return [self._read(entries[p]) for p in positions]
+
+    def append(self, emails):
+        """Log emails not logged yet; returns the position of every email (new or already logged)"""
+        entries = self.entries()
+        if self._by_key is None:
+            self._by_key = {e.key: e.position for e in entries}
+        positions = []
+        lines, records = [], []
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._file(LOG_FILE), 'ab') as log, open(self._file(LOG_INDEX_FILE), 'ab') as idx:
+            offset = log.seek(0, os.SEEK_END)
+            next_position = len(entries)
+            for email in emails:
+                key = _hash8(email_key(email))
+                if key in self._by_key:
+                    positions.append(self._by_key[key])
+                    continue
+                line = json.dumps(email, ensure_ascii=False).encode('utf-8')
+                lines.append(line + b'\n')
+                records.append(LOG_RECORD.pack(offset, len(line), _received(email), _hash8(email.get('sender')),
+                                               key, _ticket_field(email.get('ticket_number'))))
+                self._by_key[key] = next_position
+                positions.append(next_position)
+                next_position += 1
+                offset += len(line) + 1
+            if records:
+                log.write(b''.join(lines))
+                # Lines reach the disk before the index entries that point at them
+                log.flush()
+                os.fsync(log.fileno())
+                if idx.tell() == 0:
+                    idx.write(LOG_INDEX_MAGIC)
+                idx.write(b''.join(records))
+        return positions
+
+    def set_ticket(self, position, number):
+        """Record the ticket number extracted from an already logged email"""
+        entry = self.entries()[position]
+        field = _ticket_field(number)
+        if entry.ticket.encode('utf-8') == field:
+            return
+        with open(self._file(LOG_INDEX_FILE), 'r+b') as idx:
+            idx.seek(len(LOG_INDEX_MAGIC) + position * LOG_RECORD.size + LOG_RECORD.size - TICKET_FIELD)
+            idx.write(field.ljust(TICKET_FIELD, b'\0'))
+        entry.ticket = field.decode('utf-8', errors='replace')
+        self._by_ticket = None
+
+    def find_ticket(self, number):
+        """Every logged email that produced ticket `number`, in log order"""
+        entries = self.entries()
+        if self._by_ticket is None:
+            self._by_ticket = {}
+            for entry in entries:
+                if entry.ticket:
+                    self._by_ticket.setdefault(entry.ticket, []).append(entry)
+        return [self._read(e) for e in self._by_ticket.get(number, [])]
+
+    def ticketed(self, since=None, skip=()):
+        """(ticket number, email) for every logged email that produced a ticket.
+
+        Only emails received since `since` (epoch seconds) if given; positions in `skip` are left out.
+        """
+        for entry in self.entries():
+            if not entry.ticket or entry.position in skip:
+                continue
+            if since is None or (entry.received is not None and entry.received >= since):
+                yield entry.ticket, self._read(entry)
+
+    def by_sender(self, sender):
+        wanted = _hash8(sender)
+        return [self._read(e) for e in self.entries() if e.sender == wanted]
+
+    def time_range(self, start=None, end=None):
+        """Emails received between start and end (epoch seconds, either optional), oldest first"""
+        entries = self.entries()
+        if self._by_time is None:
+            dated = sorted((e for e in entries if e.received is not None), key=lambda e: e.received)
+            self._by_time = ([e.received for e in dated], dated)
+        keys, dated = self._by_time
+        lo = 0 if start is None else bisect_left(keys, start)
+        hi = len(keys) if end is None else bisect_right(keys, end)
+        return [self._read(e) for e in dated[lo:hi]]
+
+    def size(self):
+        return sum(os.path.getsize(self._file(n)) for n in (LOG_FILE, LOG_INDEX_FILE)
+                   if os.path.exists(self._file(n)))
+
+    def clear(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        for name in (LOG_FILE, LOG_INDEX_FILE):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+        self._entries = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look up logged emails without loading the whole log")
+    sub = parser.add_subparsers(dest='command', required=True)
+    by_ticket = sub.add_parser('ticket', help="emails that produced a ticket number")
+    by_ticket.add_argument('number')
+    by_time = sub.add_parser('range', help="emails received between two dates")
+    by_time.add_argument('start')
+    by_time.add_argument('end')
+    args = parser.parse_args()
+
+    log = EmailLog()
+    if args.command == 'ticket':
+        emails = log.find_ticket(args.number)
+    else:
+        emails = log.time_range(parse_bound(args.start), parse_bound(args.end, end=True))
+    for email in emails:
+        print(f"{email.get('date')} | {email.get('sender')} | {email.get('subject')}")
+    print(f"{len(emails)} of {len(log)} logged emails")
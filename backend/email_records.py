@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Compact in-memory email records for loading large email histories
+- Repeated strings (senders, recipient names / addresses, filter actions, extracted shops) are interned
+- Recipients are shared __slots__ objects with the Outlook type code (1 To, 2 CC, 3 BCC):
+  the "iSupport" recipient is one object for every email that has it, and identical
+  recipient lists are one tuple
+- Bodies stay in the email archive; EmailRecord.get('body') reads one on demand
+- Records answer get() / [] / keys() like the dicts they replace, so filters and exports work unchanged
+"""
+
+import sys
+
+RECIPIENT_TO, RECIPIENT_CC, RECIPIENT_BCC = 1, 2, 3
+CORE_FIELDS = ('sender', 'date', 'subject', 'recipients', 'filter_actions', 'body_hash')
+INTERN_MAX = 64  # longer extracted values (descriptions) rarely repeat
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) and len(value) <= INTERN_MAX else value
+
+
+class Recipient:
+    __slots__ = ('name', 'email', 'type')
+
+    def __init__(self, name, email, type):
+        self.name = name
+        self.email = email
+        self.type = type
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def keys(self):
+        return self.__slots__
+
+    def to_dict(self):
+        return {"name": self.name, "email": self.email, "type": self.type}
+
+
+class EmailRecord:
+    __slots__ = ('sender', 'date', 'subject', 'recipients', 'filter_actions', 'body_hash', 'extra', '_body', '_archive')
+
+    def __init__(self, sender, date, subject, recipients, filter_actions, body_hash, extra, body, archive):
+        self.sender = sender
+        self.date = date
+        self.subject = subject
+        self.recipients = recipients
+        self.filter_actions = filter_actions
+        self.body_hash = body_hash
+        self.extra = extra          # extracted fields (ticket_number, shop, ...) or None
+        self._body = body           # inline body of records written before the email archive
+        self._archive = archive
+
+    def body(self):
+        if self._body is not None:
+            return self._body
+        if self.body_hash and self._archive is not None:
+            try:
+                return self._archive.get(self.body_hash)
+            except KeyError:
+                pass
+        return ''
+
+    def get(self, key, default=None):
+        if key in CORE_FIELDS:
+            value = getattr(self, key)
+            return default if value is None else value
+        if key == 'body':
+            return self.body()
+        return self.extra.get(key, default) if self.extra else default
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def keys(self):
+        keys = [k for k in CORE_FIELDS if getattr(self, k) is not None]
+        if self._body is not None:
+            keys.append('body')
+        return keys + list(self.extra or ())
+
+    def to_dict(self):
+        """The record as stored (bodies stay referenced by hash)"""
+        email = {k: getattr(self, k) for k in CORE_FIELDS if getattr(self, k) is not None}
+        email['recipients'] = [r.to_dict() for r in self.recipients]
+        email['filter_actions'] = list(self.filter_actions)
+        if self._body is not None:
+            email['body'] = self._body
+        email.update(self.extra or {})
+        return email
+
+
+class EmailCorpus:
+    def __init__(self, archive=None):
+        """`archive` (an EmailArchive) resolves body hashes on demand"""
+        self.archive = archive
+        self.records = []
+        self._recipients = {}   # (name, email, type) -> shared Recipient
+        self._lists = {}        # tuple of Recipients -> the same tuple
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def _recipient(self, r):
+        key = (r.get('name', ''), r.get('email', ''), int(r.get('type') or RECIPIENT_TO))
+        recipient = self._recipients.get(key)
+        if recipient is None:
+            recipient = self._recipients[key] = Recipient(*(_intern(v) for v in key))
+        return recipient
+
+    def add(self, email):
+        recipients = tuple(self._recipient(r) for r in email.get('recipients') or ())
+        recipients = self._lists.setdefault(recipients, recipients)
+        extra = {sys.intern(k): _intern(v) for k, v in email.items() if k not in CORE_FIELDS and k != 'body'}
+        record = EmailRecord(
+            _intern(email.get('sender')),
+            email.get('date'),
+            email.get('subject'),
+            recipients,
+            tuple(_intern(a) for a in email.get('filter_actions') or ()),
+            email.get('body_hash'),
+            extra or None,
+            email.get('body'),
+            self.archive,
+        )
+        self.records.append(record)
+        return record
+
+    def extend(self, emails):
+        for email in emails:
+            self.add(email)
+        return self
+
+
+def load_partitions(store, months=None, archive=None):
+    """EmailCorpus of the email partitions `months` (default: all), newest month first.
+
+    One partition's dicts are alive at a time - each is compacted before the next is read.
+    """
+    months = store.months() if months is None else sorted(months)
+    corpus = EmailCorpus(archive)
+    for month in reversed(months):
+        corpus.extend(store.read(month))
+    return corpus
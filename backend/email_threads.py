@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Email thread grouping for create_tickets.py
+- The scanners record Outlook's ConversationID, the Internet Message-ID and In-Reply-To
+  of every kept email (outlook_thread_fields)
+- thread_key() is the ConversationID, or the subject without RE: / FW: prefixes for
+  emails scanned before it was recorded
+- ThreadIndex maps threads, message ids and ticket numbers seen in subjects to the ticket
+  they produced. It is built in memory from the email log (emails that produced a ticket,
+  up to THREAD_WINDOW_DAYS before the scan) plus this scan's extractions
+- A follow-up (reply, "has been assigned to", worknotes added...) resolves to its ticket
+  without reading or extracting its body. Only an explicit reply, or a subject that names
+  the ticket, is trusted - anything else is extracted as before
+
+Usage:
+    python backend/email_threads.py      # how the logged emails group into threads
+"""
+
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# MAPI properties read through MailItem.PropertyAccessor
+PR_INTERNET_MESSAGE_ID = "http://schemas.microsoft.com/mapi/proptag/0x1035001F"
+PR_IN_REPLY_TO_ID = "http://schemas.microsoft.com/mapi/proptag/0x1042001F"
+
+THREAD_WINDOW_DAYS = 60
+
+REPLY_PREFIX = re.compile(r'^\s*(re|fw|fwd|aw|答复|回覆|回复|轉寄|转发)\s*[:：]\s*', re.IGNORECASE)
+# HK542726, BZ2602260003, TEMP-20260226101500 ...
+TICKET_TOKEN = re.compile(r'[A-Za-z]{2,}-?\d{5,}')
+
+
+def outlook_thread_fields(msg):
+    """Thread fields of an Outlook MailItem; properties the item doesn't carry are left out"""
+    fields = {}
+    try:
+        fields['conversation_id'] = str(msg.ConversationID)
+    except Exception:
+        pass
+    for field, prop in (('message_id', PR_INTERNET_MESSAGE_ID), ('in_reply_to', PR_IN_REPLY_TO_ID)):
+        try:
+            value = msg.PropertyAccessor.GetProperty(prop)
+        except Exception:
+            continue
+        if value:
+            fields[field] = str(value).strip()
+    return fields
+
+
+def normalize_subject(subject):
+    subject = str(subject or '')
+    while True:
+        stripped = REPLY_PREFIX.sub('', subject, count=1)
+        if stripped == subject:
+            break
+        subject = stripped
+    return ' '.join(subject.split()).lower()
+
+
+def thread_key(email):
+    if email.get('conversation_id'):
+        return f"conversation:{email['conversation_id']}"
+    subject = normalize_subject(email.get('subject'))
+    return f"subject:{subject}" if subject else None
+
+
+def subject_tickets(email):
+    return TICKET_TOKEN.findall(str(email.get('subject') or ''))
+
+
+class ThreadIndex:
+    def __init__(self):
+        self.by_thread = {}
+        self.by_message = {}
+        self.numbers = set()
+
+    @classmethod
+    def from_log(cls, log, scan=(), days=THREAD_WINDOW_DAYS):
+        """Index the logged emails that produced a ticket.
+
+        `scan` takes the log positions of the scan being processed: its emails are left out (they
+        are not follow-ups of themselves) and only emails received up to `days` before its oldest
+        one are read. days=0 reads the whole log.
+        """
+        index = cls()
+        scan = set(scan)
+        entries = log.entries()
+        received = [entries[p].received for p in scan if entries[p].received is not None]
+        since = min(received) - days * 86400 if days and received else None
+        for number, email in log.ticketed(since, scan):
+            index.add(email, number)
+        return index
+
+    def add(self, email, number):
+        key = thread_key(email)
+        if key:
+            self.by_thread[key] = number
+        if email.get('message_id'):
+            self.by_message[email['message_id']] = number
+        self.numbers.add(number)
+
+    def ticket_for(self, email):
+        """Ticket an email follows up on, or None if it has to be extracted"""
+        number = self.by_message.get(email.get('in_reply_to'))
+        if number:
+            return number
+        mentioned = subject_tickets(email)
+        number = self.by_thread.get(thread_key(email))
+        if number and number in mentioned:
+            return number
+        for token in mentioned:
+            if token in self.numbers:
+                return token
+        return None
+
+
+if __name__ == "__main__":
+    from collections import Counter
+    from backend.email_log import EmailLog
+
+    log = EmailLog()
+    index = ThreadIndex.from_log(log, days=0)
+    emails = log.records(range(len(log)))
+    threads = Counter(thread_key(e) for e in emails)
+    followups = sum(1 for e in emails if index.ticket_for(e))
+    print(f"{len(emails)} logged emails in {len(threads)} threads, {len(index.numbers)} tickets")
+    print(f"{followups} emails resolve to a ticket without extraction")
+    for key, count in threads.most_common(10):
+        print(f"  {count:4}  {key[:90]}")
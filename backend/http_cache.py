@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+HTTP caching helpers for server.py
+- gzip (and brotli, when the package is installed) content negotiation
+- Strong ETags from the body hash or the file mtime/size
+- If-None-Match / If-Modified-Since checks for 304 responses
+- Precompressed variant cache so the same bytes are only compressed once; only for
+  long-lived bodies (files, ticket.json) - one-off API bodies go through compress()
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent as-is (compression would not pay off)
+MIN_COMPRESS_SIZE = 512
+# Upper bound for all cached variants together
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'image/svg+xml', 'text/')
+
+_variants = OrderedDict()
+_variants_size = 0
+_variants_lock = threading.Lock()
+
+
+def is_compressible(content_type, size):
+    """Only text-like bodies above MIN_COMPRESS_SIZE are worth compressing"""
+    if size < MIN_COMPRESS_SIZE or not content_type:
+        return False
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def choose_encoding(accept_encoding):
+    """Pick 'br', 'gzip' or None from an Accept-Encoding header"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+
+    def ok(name):
+        return accepted.get(name, accepted.get('*', 0)) > 0
+
+    if brotli is not None and ok('br'):
+        return 'br'
+    if ok('gzip'):
+        return 'gzip'
+    return None
+
+
+def etag_for_bytes(body):
+    """Strong ETag derived from the body content"""
+    return '"' + hashlib.sha1(body).hexdigest()[:24] + '"'
+
+
+def etag_for_stat(st):
+    """Strong ETag derived from a file's mtime and size"""
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def variant_etag(etag, encoding):
+    """Each encoded representation gets its own strong ETag"""
+    if not encoding:
+        return etag
+    return etag[:-1] + '-' + encoding + '"'
+
+
+def _base_tag(tag):
+    tag = tag.strip()
+    if tag.startswith('W/'):
+        tag = tag[2:]
+    for encoding in ('-br"', '-gzip"'):
+        if tag.endswith(encoding):
+            return tag[:-len(encoding)] + '"'
+    return tag
+
+
+def is_not_modified(headers, etag, last_modified=None):
+    """True if the request's validators show the client copy is current"""
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 7232)
+        if if_none_match.strip() == '*':
+            return True
+        return any(_base_tag(tag) == etag for tag in if_none_match.split(','))
+
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+        return int(last_modified) <= int(since)
+    return False
+
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+def compress(body, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return body
+
+
+def get_variant(key, etag, encoding, load):
+    """Return the body for (key, etag, encoding), compressing at most once.
+
+    `load` is only called on a cache miss and must return the identity bytes.
+    """
+    global _variants_size
+    cache_key = (key, etag, encoding)
+    with _variants_lock:
+        cached = _variants.get(cache_key)
+        if cached is not None:
+            _variants.move_to_end(cache_key)
+            return cached
+
+    data = compress(load(), encoding)
+
+    if len(data) <= MAX_CACHE_BYTES // 4:
+        with _variants_lock:
+            if cache_key not in _variants:
+                _variants[cache_key] = data
+                _variants_size += len(data)
+            while _variants_size > MAX_CACHE_BYTES and _variants:
+                _, evicted = _variants.popitem(last=False)
+                _variants_size -= len(evicted)
+    return data
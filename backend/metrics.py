@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Request / stage metrics for server.py
+- Per-route request count, error count and latency histogram
+- Per-stage timers for scans, merges and file rewrites
+- Gauges collected at scrape time
+- Prometheus text format and a JSON view for adminsettings.html
+"""
+
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Latency bucket upper bounds in seconds (last bucket is +Inf)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+# Routes server.py handles; any other /api/ path is counted under 'other', so clients
+# can't grow the metrics table by requesting made-up paths
+ROUTES = frozenset((
+    '/run-scan', '/run-scan-all', '/update-ticket', '/add-ticket',
+    '/api/filters', '/api/filters/:id', '/api/stats', '/api/settings', '/api/rollup',
+    '/api/tickets/range', '/api/tickets/search', '/api/tickets/duplicates', '/api/tickets/history',
+    '/api/tickets/batch', '/api/export', '/api/metrics', '/api/scheduler', '/api/backups',
+    '/api/backup', '/api/scan', '/api/clear-tickets', '/api/clear-emails', '/api/whatsapp-import',
+))
+
+
+def route_label(path):
+    """Collapse a request path to a low-cardinality route name"""
+    path = _ID_SEGMENT.sub('/:id', path.split('?', 1)[0])
+    if path in ROUTES:
+        return path
+    if path.startswith('/api/'):
+        return 'other'
+    return 'static'
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside the matching bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "p50": round(self.quantile(0.50), 6),
+            "p90": round(self.quantile(0.90), 6),
+            "p99": round(self.quantile(0.99), 6)
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}   # (method, route) -> Histogram
+        self.errors = {}     # (method, route) -> count
+        self.stages = {}     # stage -> Histogram
+        self.gauge_providers = []
+        self.last_scan_success = None
+        self.started = time.time()
+
+    def observe_request(self, method, route, status, seconds):
+        key = (method, route)
+        with self._lock:
+            hist = self.requests.get(key)
+            if hist is None:
+                hist = self.requests[key] = Histogram()
+            hist.observe(seconds)
+            if status >= 500 or status == 0:
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = Histogram()
+            hist.observe(seconds)
+
+    @contextmanager
+    def time_stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start)
+
+    def mark_scan_success(self):
+        self.last_scan_success = time.time()
+
+    def add_gauges(self, provider):
+        """Register a callable returning {name: value}, evaluated at scrape time"""
+        self.gauge_providers.append(provider)
+
+    def gauges(self):
+        values = {"uptime_seconds": time.time() - self.started}
+        if self.last_scan_success is not None:
+            values["seconds_since_last_scan"] = time.time() - self.last_scan_success
+        for provider in self.gauge_providers:
+            try:
+                values.update(provider())
+            except Exception as e:
+                print(f"Metrics gauge error: {e}")
+        return values
+
+    def to_json(self):
+        with self._lock:
+            routes = [
+                dict(method=method, route=route, errors=self.errors.get((method, route), 0), **hist.summary())
+                for (method, route), hist in sorted(self.requests.items(), key=lambda kv: kv[0][::-1])
+            ]
+            stages = {stage: hist.summary() for stage, hist in sorted(self.stages.items())}
+        return {"routes": routes, "stages": stages, "gauges": self.gauges()}
+
+    def to_prometheus(self):
+        lines = [
+            "# HELP win32way_request_duration_seconds Request latency by route",
+            "# TYPE win32way_request_duration_seconds histogram"
+        ]
+        with self._lock:
+            requests = sorted(self.requests.items())
+            errors = dict(self.errors)
+            stages = sorted(self.stages.items())
+
+        for (method, route), hist in requests:
+            _histogram_lines(lines, "win32way_request_duration_seconds", f'method="{method}",route="{route}"', hist)
+
+        lines.append("# HELP win32way_request_errors_total Requests that failed with a 5xx or an exception")
+        lines.append("# TYPE win32way_request_errors_total counter")
+        for (method, route), _ in requests:
+            lines.append(f'win32way_request_errors_total{{method="{method}",route="{route}"}} {errors.get((method, route), 0)}')
+
+        lines.append("# HELP win32way_stage_duration_seconds Time spent in scan / merge / write stages")
+        lines.append("# TYPE win32way_stage_duration_seconds histogram")
+        for stage, hist in stages:
+            _histogram_lines(lines, "win32way_stage_duration_seconds", f'stage="{stage}"', hist)
+
+        for name, value in sorted(self.gauges().items()):
+            lines.append(f"# TYPE win32way_{name} gauge")
+            lines.append(f"win32way_{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(lines, name, labels, hist):
+    cumulative = 0
+    for bound, n in zip(BUCKETS, hist.counts):
+        cumulative += n
+        lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+    lines.append(f'{name}_sum{{{labels}}} {hist.total:.6f}')
+    lines.append(f'{name}_count{{{labels}}} {hist.count}')
+
+
+METRICS = Metrics()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Monthly partitioned JSON store for tickets and emails
+- Records live in <dir>/YYYY-MM.json by the month of their 'date' (undated.json otherwise)
+- manifest.json maps every record key to its month, so an edit loads and rewrites one partition
+- Only the partitions that changed are rewritten, each to a temp file that is fsync'd and renamed
+  over the old one (write_atomic), so readers in other processes never see a partial file
+- Closed months older than SEAL_AFTER_MONTHS are sealed: gzip-compressed (YYYY-MM.json.gz) and read-only
+- Range reads fan out over the partitions overlapping the range
+- Each partition has a binary cache in <dir>/.cache/ (marshal), written with every save and
+  validated against the partition's size/mtime, then its hash; a stale or unreadable cache
+  is rebuilt from the JSON on the next read
+- A legacy single-file store (ticket.json / outlook_emails.json) is split on first use
+"""
+
+import gzip
+import hashlib
+import json
+import marshal
+import os
+import struct
+from datetime import date
+
+from backend.ticket_index import ticket_ts
+from backend.atomic_io import file_signature, write_atomic, write_json_atomic
+from backend.ticket_rollup import parse_day
+
+SEAL_AFTER_MONTHS = 2  # the current month and the two before it stay writable
+UNDATED = 'undated'
+MANIFEST_FILE = 'manifest.json'
+
+CACHE_DIR = '.cache'
+CACHE_MAGIC = b'PCH1'
+# magic, marshal format, source size, source mtime_ns, source BLAKE2b
+CACHE_HEADER = struct.Struct('>4sBQq16s')
+
+
+class SealedPartitionError(Exception):
+    pass
+
+
+def month_of(record):
+    day = parse_day(record.get('date', ''))
+    return f"{day.year}-{day.month:02d}" if day else UNDATED
+
+
+def month_add(month, n):
+    year, mon = int(month[:4]), int(month[5:7])
+    total = year * 12 + (mon - 1) + n
+    return f"{total // 12}-{total % 12 + 1:02d}"
+
+
+def _source_hash(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def email_key(email):
+    return f"{email.get('date', '')}|{email.get('sender', '')}|{email.get('subject', '')}"
+
+
+class PartitionedStore:
+    def __init__(self, directory, key, legacy_path=None, retire_legacy=False, cache=True):
+        """`key(record)` identifies a record; `legacy_path` is the single file this store replaces.
+
+        With retire_legacy=True the legacy file is renamed to *.migrated once it has been split.
+        cache=False reads and writes the JSON partitions only.
+        """
+        self.directory = directory
+        self.key = key
+        self.legacy_path = legacy_path
+        self.retire_legacy = retire_legacy
+        self.cache = cache
+        self._manifest = None
+        self._manifest_signature = None
+        self._migrated = False
+
+    def _path(self, month, sealed=False):
+        return os.path.join(self.directory, f"{month}.json.gz" if sealed else f"{month}.json")
+
+    def _cache_path(self, month):
+        return os.path.join(self.directory, CACHE_DIR, f"{month}.marshal")
+
+    def _manifest_path(self):
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    def migrate(self):
+        """Split the legacy single file into partitions if no partitions exist yet"""
+        self._migrated = True
+        if not self.legacy_path or os.path.exists(self._manifest_path()):
+            return 0
+        try:
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        self.write(records, {month_of(r) for r in records})
+        if self.retire_legacy:
+            os.replace(self.legacy_path, self.legacy_path + '.migrated')
+        print(f"Partitioned {len(records)} records from {self.legacy_path} into {self.directory}")
+        return len(records)
+
+    def months(self):
+        """Months with a partition (active or sealed), oldest first"""
+        if not self._migrated:
+            self.migrate()
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        months = set()
+        for name in names:
+            if name.endswith('.json.gz'):
+                months.add(name[:-8])
+            elif name.endswith('.json') and name != MANIFEST_FILE:
+                months.add(name[:-5])
+        return sorted(months)
+
+    def months_between(self, start=None, end=None):
+        """Dated months overlapping start..end (date objects, either optional)"""
+        lo = f"{start.year}-{start.month:02d}" if start else None
+        hi = f"{end.year}-{end.month:02d}" if end else None
+        return [m for m in self.months()
+                if m != UNDATED and (lo is None or m >= lo) and (hi is None or m <= hi)]
+
+    def is_sealed(self, month):
+        return os.path.exists(self._path(month, sealed=True))
+
+    def partition_signature(self, month):
+        return file_signature(self._path(month, sealed=True)) or file_signature(self._path(month))
+
+    def read(self, month):
+        sealed = self.is_sealed(month)
+        path = self._path(month, sealed)
+        signature = file_signature(path)
+        if signature is None:
+            return []
+        cached_hash = None
+        if self.cache:
+            records, cached_hash = self._read_cache(month, signature)
+            if records is not None:
+                return records
+        try:
+            with open(path, 'rb') as f:
+                # The signature of exactly what is read (the file may have been replaced since the stat)
+                st = os.fstat(f.fileno())
+                signature = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        digest = _source_hash(data)
+        if self.cache and digest == cached_hash:
+            # Same content, new mtime (copied / restored) - re-stamp the cache instead of parsing
+            records, cached_hash = self._read_cache(month, None)
+            if records is not None and cached_hash == digest:
+                self._write_cache(month, signature, digest, records)
+                return records
+        records = json.loads(gzip.decompress(data) if sealed else data)
+        if self.cache:
+            self._write_cache(month, signature, digest, records)
+        return records
+
+    def _read_cache(self, month, signature):
+        """(records or None if the cache is not for `signature` (None: any), its source hash)"""
+        try:
+            with open(self._cache_path(month), 'rb') as f:
+                header = f.read(CACHE_HEADER.size)
+                magic, version, size, mtime_ns, digest = CACHE_HEADER.unpack(header)
+                if magic != CACHE_MAGIC or version != marshal.version:
+                    return None, None
+                if signature is not None and (size, mtime_ns) != (signature['size'], signature['mtime_ns']):
+                    return None, digest
+                return marshal.loads(f.read()), digest
+        except (OSError, ValueError, EOFError, TypeError, struct.error):
+            return None, None
+
+    def _write_cache(self, month, signature, digest, records):
+        if signature is None:
+            return
+        header = CACHE_HEADER.pack(CACHE_MAGIC, marshal.version, signature['size'], signature['mtime_ns'], digest)
+        try:
+            os.makedirs(os.path.join(self.directory, CACHE_DIR), exist_ok=True)
+            write_atomic(self._cache_path(month), header + marshal.dumps(records), durable=False)
+        except (OSError, ValueError):
+            pass    # the cache is optional - the next read parses the JSON again
+
+    def _drop_cache(self, month):
+        try:
+            os.remove(self._cache_path(month))
+        except OSError:
+            pass
+
+    def load(self, months=None):
+        """Records of `months` (default: every partition), newest month first"""
+        months = self.months() if months is None else sorted(months)
+        records = []
+        for month in reversed(months):
+            records.extend(self.read(month))
+        return records
+
+    def load_range(self, start=None, end=None):
+        """Records of the partitions overlapping start..end (callers filter exact days)"""
+        return self.load(self.months_between(start, end))
+
+    def manifest(self):
+        """{key: month} for every stored record (cached until manifest.json changes)"""
+        if not self._migrated:
+            self.migrate()
+        signature = file_signature(self._manifest_path())
+        if self._manifest is None or signature != self._manifest_signature:
+            try:
+                with open(self._manifest_path(), 'r', encoding='utf-8') as f:
+                    self._manifest = json.load(f)
+                self._manifest_signature = signature
+            except (OSError, ValueError):
+                # Missing or damaged - rebuild it from the partitions
+                manifest = {}
+                for month in self.months():
+                    for record in self.read(month):
+                        manifest[self.key(record)] = month
+                self._save_manifest(manifest)
+        return self._manifest
+
+    def _save_manifest(self, manifest):
+        os.makedirs(self.directory, exist_ok=True)
+        write_json_atomic(self._manifest_path(), manifest)
+        self._manifest = manifest
+        self._manifest_signature = file_signature(self._manifest_path())
+
+    def count(self):
+        return len(self.manifest())
+
+    def write(self, records, months):
+        """Rewrite the partitions of `months` from `records`.
+
+        `records` must hold every record of those months (read them, edit, write back);
+        a record dated outside `months` is rejected rather than overwriting a partition
+        that was never loaded.
+        """
+        months = set(months)
+        sealed = sorted(m for m in months if self.is_sealed(m))
+        if sealed:
+            raise SealedPartitionError(f"{', '.join(sealed)} sealed (read-only)")
+
+        grouped = {m: [] for m in months}
+        for record in records:
+            month = month_of(record)
+            if month not in grouped:
+                raise ValueError(f"Record {self.key(record)} belongs to {month}, which was not loaded")
+            grouped[month].append(record)
+
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = {k: m for k, m in self.manifest().items() if m not in months}
+        for month, rows in grouped.items():
+            path = self._path(month)
+            if rows:
+                rows.sort(key=lambda r: ticket_ts(r) or 0, reverse=True)
+                data = json.dumps(rows, indent=2, ensure_ascii=False).encode('utf-8')
+                written = write_atomic(path, data)
+                if self.cache:
+                    self._write_cache(month, written, _source_hash(data), rows)
+                for record in rows:
+                    manifest[self.key(record)] = month
+            else:
+                if os.path.exists(path):
+                    os.remove(path)
+                self._drop_cache(month)
+        self._save_manifest(manifest)
+
+    def append_new(self, records):
+        """Store records whose key is not stored yet; returns how many were added"""
+        manifest = self.manifest()
+        fresh = {}
+        for record in records:
+            key = self.key(record)
+            if key not in manifest and key not in fresh:
+                fresh[key] = record
+        months = {month_of(r) for r in fresh.values()}
+        sealed = {m for m in months if self.is_sealed(m)}
+        if sealed:
+            print(f"Skipping records for sealed months: {', '.join(sorted(sealed))}")
+        added = [r for r in fresh.values() if month_of(r) not in sealed]
+        if added:
+            months -= sealed
+            self.write(self.load(months) + added, months)
+        return len(added)
+
+    def seal(self, today=None, closed=None):
+        """gzip partitions older than SEAL_AFTER_MONTHS; `closed(records)` can veto a month"""
+        today = today or date.today()
+        cutoff = month_add(f"{today.year}-{today.month:02d}", -SEAL_AFTER_MONTHS)
+        sealed = []
+        for month in self.months():
+            if month == UNDATED or month >= cutoff or self.is_sealed(month):
+                continue
+            records = self.read(month)
+            if closed is not None and not closed(records):
+                continue
+            data = gzip.compress(json.dumps(records, ensure_ascii=False).encode('utf-8'))
+            written = write_atomic(self._path(month, sealed=True), data)
+            os.remove(self._path(month))
+            if self.cache:
+                self._write_cache(month, written, _source_hash(data), records)
+            sealed.append(month)
+        if sealed:
+            print(f"Sealed partitions: {', '.join(sealed)}")
+        return sealed
+
+    def clear(self):
+        """Remove every partition, sealed ones included"""
+        for month in self.months():
+            for path in (self._path(month), self._path(month, sealed=True)):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._drop_cache(month)
+        self._save_manifest({})
+
+    def signature(self):
+        """{month: [size, mtime_ns]} for the whole store - changes whenever any partition does"""
+        signature = {}
+        for month in self.months():
+            sig = self.partition_signature(month)
+            if sig:
+                signature[month] = [sig['size'], sig['mtime_ns']]
+        return signature
+
+    def size(self):
+        return sum(size for size, _ in self.signature().values())
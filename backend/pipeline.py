@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+In-process scan pipeline: source -> dedupe -> filter -> extract -> merge -> persist -> status
+- source, dedupe, filter and extract are generators over (email log position, email) pairs:
+  a scan's emails flow through them in memory, newest first. merge is the barrier - it needs
+  every extracted ticket to know which monthly partitions to load
+- Every stage is timed on its own (a generator stage's time excludes the stages feeding it);
+  the seconds end up in the result's "timings"
+- Emails come from the positions the scanner logged (scan_stats.json), from a list handed
+  to run() (tests, imports), or from outlook_emails.json written before the email log existed.
+  Files are checkpoints: scan_result.json is only written with checkpoint=True
+- server.py runs it in the server process with its own stores; create_tickets.py is the CLI
+
+Usage:
+    python backend/pipeline.py [--emails emails.json] [--no-checkpoint]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.boilerplate import strip_emails
+from backend.create_tickets import (
+    apply_filters, extract_cdc_data, extract_fw_data, extract_mx_data, load_existing_tickets, merge_tickets
+)
+from backend.email_archive import ARCHIVE_DIR, EmailArchive, store_bodies, strip_partitions, with_body
+from backend.email_log import EmailLog
+from backend.email_threads import ThreadIndex
+from backend.partitions import PartitionedStore, email_key
+from backend.ticket_duplicates import DUPLICATES_FILE, load_duplicates
+from backend.ticket_events import BASE_FIELDS, EVENTS_DIR, TicketEventLog
+from backend.ticket_index import stamp
+from backend.atomic_io import write_json_atomic
+from backend.ticket_rollup import ROLLUP_FILE, load_rollup
+from backend.ticket_status import apply_status_transitions
+from backend.ticket_store import TicketStore, ticket_partitions
+from backend.timestamps import to_epoch
+
+FILTERS_FILE = os.path.join('database', 'email_filters.json')
+EMAILS_FILE = os.path.join('database', 'outlook_emails.json')
+EMAIL_DIR = os.path.join('database', 'emails')
+SCAN_STATS_FILE = os.path.join('database', 'scan_stats.json')
+SCAN_RESULT_FILE = os.path.join('database', 'scan_result.json')
+
+
+class PipelineError(Exception):
+    pass
+
+
+def by_received(pair):
+    """Sort key for (log position, email) pairs: received time as UTC epoch seconds"""
+    return to_epoch(pair[1].get('date')) or 0
+
+
+def read_json(path, default=None):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+class StageTimer:
+    """Seconds per stage. A wrapped generator's time excludes its upstream stage's."""
+
+    def __init__(self):
+        self.inclusive = {}
+        self.upstream = {}
+
+    def wrap(self, stage, records, upstream=None):
+        self.upstream[stage] = upstream
+        self.inclusive.setdefault(stage, 0.0)
+        records = iter(records)
+        while True:
+            start = time.perf_counter()
+            try:
+                record = next(records)
+            except StopIteration:
+                return
+            finally:
+                self.inclusive[stage] += time.perf_counter() - start
+            yield record
+
+    @contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inclusive[stage] = self.inclusive.get(stage, 0.0) + time.perf_counter() - start
+
+    def timings(self):
+        return {stage: round(seconds - self.inclusive.get(self.upstream.get(stage), 0.0), 4)
+                for stage, seconds in self.inclusive.items()}
+
+
+class ScanPipeline:
+    def __init__(self, root='', tickets=None, log=None, archive=None, email_store=None, clean=strip_emails):
+        """Stores default to the files under `root`; the server passes the ones it already holds.
+
+        `clean(emails)` strips boilerplate from inline bodies (boilerplate.strip_emails).
+        """
+        path = lambda name: os.path.join(root, name)
+        self.filters_path = path(FILTERS_FILE)
+        self.emails_path = path(EMAILS_FILE)
+        self.stats_path = path(SCAN_STATS_FILE)
+        self.result_path = path(SCAN_RESULT_FILE)
+        self.archive = archive or EmailArchive(path(ARCHIVE_DIR))
+        self.log = log or EmailLog(path(ARCHIVE_DIR))
+        self.email_store = email_store or PartitionedStore(path(EMAIL_DIR), email_key, legacy_path=self.emails_path)
+        self.tickets = tickets or TicketStore(ticket_partitions(root), path(ROLLUP_FILE), path(DUPLICATES_FILE),
+                                              TicketEventLog(path(EVENTS_DIR)))
+        self.clean = clean
+        self.timer = StageTimer()
+        # Filled in as the stages run
+        self.scanned = []       # (email log position, email) after dedupe
+        self.followups = []     # (email log position, ticket number)
+        self.sources = []       # (email log position, extracted ticket)
+        self.matched = 0
+        self.merged = []
+
+    # === STAGES ===
+
+    def source(self, emails=None, scan_stats=None):
+        """(position, email) pairs of the scan, newest first; the emails are archived on the way in"""
+        positions = (scan_stats or {}).get('log_records')
+        if emails is None and positions is not None and all(p < len(self.log) for p in positions):
+            emails = self.log.records(positions)
+        else:
+            if emails is None:
+                # Scanner output written before the email log existed
+                emails = read_json(self.emails_path)
+                if emails is None:
+                    raise PipelineError("outlook_emails.json not found. Please run test_quick.py first.")
+            self.clean(emails)
+            emails = store_bodies(emails, self.archive)
+            positions = self.log.append(emails)
+
+        # Monthly email partitions; bodies are in the content-addressed archive and are
+        # read back only for emails that match a filter
+        archived = self.email_store.append_new(emails)
+        # Partitions written before the archive existed still hold their bodies inline
+        strip_partitions(self.email_store, self.archive, clean=self.clean)
+        print(f"Archived {archived} new emails ({len(self.archive)} distinct bodies)")
+        return sorted(zip(positions, emails), key=by_received, reverse=True)
+
+    def dedupe(self, records):
+        """The same email listed twice in a scan has one log position; it is processed once"""
+        seen = set()
+        for position, email in records:
+            if position in seen:
+                continue
+            seen.add(position)
+            self.scanned.append((position, email))
+            yield position, email
+
+    def filter(self, records, filters):
+        for position, email in records:
+            actions = apply_filters(filters, email)
+            if actions:
+                self.matched += 1
+                yield position, email, actions
+
+    def extract(self, records, threads, known):
+        """(position, ticket) for every email that yields a ticket.
+
+        Follow-ups of a thread that already produced a ticket are linked to it without
+        reading their body; newest first, so only the newest message of a new thread is extracted.
+        """
+        for position, email, actions in records:
+            number = threads.ticket_for(email)
+            if number in known:
+                self.log.set_ticket(position, number)
+                self.followups.append((position, number))
+                print(f"  Follow-up: {number} - {str(email.get('subject', ''))[:50]}")
+                continue
+
+            ticket_data = {}
+            email = with_body(email, self.archive)
+            if 'extract_cdc' in actions:
+                ticket_data.update(extract_cdc_data(email))
+            elif 'send_mx_alert' in actions:
+                ticket_data.update(extract_mx_data(email))
+            elif 'extract_fw' in actions:
+                ticket_data.update(extract_fw_data(email))
+
+            if ticket_data and 'ticket_number' in ticket_data:
+                self.log.set_ticket(position, ticket_data['ticket_number'])
+                # The email's date is normalised once, here: UTC epoch seconds plus the display string
+                ticket_data['date'] = email.get('date', '')
+                stamp(ticket_data)
+                ticket_data.setdefault('shop', '')
+                ticket_data.setdefault('description', '')
+                self.sources.append((position, ticket_data))
+                threads.add(email, ticket_data['ticket_number'])
+                known.add(ticket_data['ticket_number'])
+                print(f"  Found: {ticket_data['ticket_number']} - {ticket_data['shop']}")
+                yield position, ticket_data
+
+    def merge(self, new_tickets):
+        """Merge into the partitions the tickets touch; returns (months, delta, email events, rollup, duplicates)"""
+        store = self.tickets.partitions
+        events = self.tickets.events
+        imported = events.bootstrap(store.load)
+        if imported:
+            print(f"Started the ticket event log with {imported} existing tickets")
+        existing, months, new_tickets = load_existing_tickets(store, new_tickets)
+        # One "email" event per extracted ticket that is merged (fields taken before the merge adds defaults)
+        mergeable = {id(t) for t in new_tickets}
+        email_events = [{"type": "email", "ticket": t['ticket_number'], "email": position,
+                         "fields": {f: t.get(f, '') for f in BASE_FIELDS}}
+                        for position, t in self.sources if id(t) in mergeable]
+        email_events += [{"type": "email", "ticket": number, "email": position, "fields": {}, "followup": True}
+                         for position, number in self.followups]
+
+        # Rollup tables and the duplicate index are updated incrementally
+        rollup = load_rollup(store.signature(), self.tickets.rollup_path, store.load)
+        duplicates = load_duplicates(store.signature(), self.tickets.duplicates_path, store.load)
+        delta = {}
+        self.merged = merge_tickets(existing, new_tickets, rollup, delta, duplicates)
+        return months, delta, email_events, rollup, duplicates
+
+    def persist(self, months, email_events, rollup, duplicates):
+        """Log the events, then rewrite only the partitions that were loaded"""
+        store = self.tickets.partitions
+        self.tickets.events.append(email_events)
+        store.write(self.merged, months)
+        rollup.save(self.tickets.rollup_path, store.signature())
+        duplicates.save(self.tickets.duplicates_path, store.signature())
+
+    def status(self):
+        """Status changes announced by the scan's notification emails, oldest first"""
+        linked = {position: t['ticket_number'] for position, t in self.sources}
+        linked.update(self.followups)
+        stream = ((email, linked.get(position)) for position, email in reversed(self.scanned))
+        transitions = apply_status_transitions(self.tickets, stream)
+        for t in transitions:
+            print(f"  Status: {t['ticket_number']} {t['from']} -> {t['to']} ({t['event']})")
+        return transitions
+
+    # === RUN ===
+
+    def run(self, emails=None, checkpoint=True):
+        """Process one scan and return its result (also written to scan_result.json with checkpoint).
+
+        `emails` (a list of email dicts) replaces the scanner's output as the source.
+        """
+        timer = self.timer
+        with timer.stage('source'):
+            scan_stats = {} if emails is not None else read_json(self.stats_path, {})
+            records = self.source(emails, scan_stats)
+            filters = read_json(self.filters_path)
+            if filters is None:
+                raise PipelineError("email_filters.json not found.")
+        with timer.stage('extract'):
+            threads = ThreadIndex.from_log(self.log, [p for p, _ in records])
+            known = set(self.tickets.partitions.manifest())
+
+        print("\nProcessing emails and extracting ticket data...")
+        stream = timer.wrap('dedupe', self.dedupe(records))
+        stream = timer.wrap('filter', self.filter(stream, filters), 'dedupe')
+        stream = timer.wrap('extract', self.extract(stream, threads, known), 'filter')
+        new_tickets = [ticket for _, ticket in stream]
+        print(f"\nExtracted {len(new_tickets)} tickets from {len(self.scanned)} emails "
+              f"({len(self.followups)} follow-ups linked without extraction)")
+
+        with timer.stage('merge'):
+            months, delta, email_events, rollup, duplicates = self.merge(new_tickets)
+        with timer.stage('persist'):
+            self.persist(months, email_events, rollup, duplicates)
+        with timer.stage('status'):
+            transitions = self.status()
+
+        result = {
+            "emails_scanned": scan_stats.get('emails_scanned', len(self.scanned)),
+            "emails_kept": len(self.scanned),
+            "emails_matched": self.matched,
+            "emails_followed_up": len(self.followups),
+            "tickets_extracted": len(new_tickets),
+            "tickets_added": delta['added'],
+            "tickets_updated": delta['updated'],
+            "possible_duplicates": delta['possible_duplicates'],
+            "status_changes": [{k: t[k] for k in ('ticket_number', 'event', 'from', 'to')} for t in transitions],
+            "total_tickets": self.tickets.count(),
+            "partitions_written": len(months),
+            "scanner_stages": scan_stats.get('stages'),
+            "timings": timer.timings()
+        }
+        if checkpoint:
+            write_json_atomic(self.result_path, result, indent=2)
+        return result
+
+
+if __name__ == "__main__":
+    if sys.platform == "win32":
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+    parser = argparse.ArgumentParser(description="Run the scan pipeline in one process")
+    parser.add_argument('--emails', help="JSON list of emails to process instead of the last scan")
+    parser.add_argument('--no-checkpoint', action='store_true', help="don't write scan_result.json")
+    args = parser.parse_args()
+
+    emails = None
+    if args.emails:
+        with open(args.emails, 'r', encoding='utf-8') as f:
+            emails = json.load(f)
+    try:
+        result = ScanPipeline().run(emails, checkpoint=not args.no_checkpoint)
+    except PipelineError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    print(f"\n{len(result['tickets_added'])} added, {len(result['tickets_updated'])} updated, "
+          f"{len(result['status_changes'])} status changes")
+    for stage, seconds in result['timings'].items():
+        print(f"  {stage:8} {seconds:8.4f}s")
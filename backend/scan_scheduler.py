@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Server-side scan scheduler
+- Runs quick (incremental) scans every SETTINGS['refresh_interval'] seconds while auto_refresh is on
+- Adds random jitter to each interval
+- Only one scan runs at a time: timer runs are skipped while a scan is in progress,
+  manual requests for the same scan wait for it and share its result
+- settings_changed() wakes the scheduler so new settings apply immediately
+"""
+
+import random
+import threading
+import time
+
+QUICK_SCAN_SCRIPT = "backend/test.py"
+FULL_SCAN_SCRIPT = "backend/test_all.py"
+
+JITTER_FRACTION = 0.1  # +/- 10% of the interval
+MIN_INTERVAL_SECONDS = 10
+
+
+class ScanScheduler:
+    def __init__(self, run_scan, settings):
+        """`run_scan(script_name)` performs one scan and returns its result dict"""
+        self.run_scan = run_scan
+        self.settings = settings
+        self._wake = threading.Event()
+        self._done = threading.Condition()
+        self._thread = None
+        self.running_script = None
+        self.generation = 0
+        self.last_result = None
+        self.last_finished = None
+        self.next_run = None
+        self.runs = 0
+        self.skipped = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="scan-scheduler", daemon=True)
+            self._thread.start()
+
+    def settings_changed(self):
+        self._wake.set()
+
+    def run_now(self, script=QUICK_SCAN_SCRIPT, wait=True):
+        """Run `script` unless a scan is in progress.
+
+        With wait=False a busy scheduler returns None (the run is skipped). With
+        wait=True the caller waits; if the running scan is the same script its
+        result is returned instead of sweeping Outlook a second time.
+        """
+        with self._done:
+            while self.running_script is not None:
+                if not wait:
+                    self.skipped += 1
+                    return None
+                joined = self.running_script == script
+                generation = self.generation
+                while self.generation == generation:
+                    self._done.wait()
+                if joined:
+                    return self.last_result
+            self.running_script = script
+
+        result = {"status": "error", "message": f"{script} did not complete"}
+        try:
+            result = self.run_scan(script)
+        finally:
+            with self._done:
+                self.running_script = None
+                self.last_result = result
+                self.last_finished = time.time()
+                self.generation += 1
+                self.runs += 1
+                self._done.notify_all()
+        return result
+
+    def next_delay(self):
+        """Seconds until the next timed scan, or None while auto_refresh is off"""
+        if not self.settings.get('auto_refresh'):
+            return None
+        try:
+            interval = float(self.settings.get('refresh_interval') or 60)
+        except (TypeError, ValueError):
+            interval = 60.0
+        interval = max(MIN_INTERVAL_SECONDS, interval)
+        return interval * (1 + random.uniform(-JITTER_FRACTION, JITTER_FRACTION))
+
+    def _loop(self):
+        while True:
+            delay = self.next_delay()
+            self.next_run = time.time() + delay if delay is not None else None
+            # A settings change interrupts the wait and the delay is recomputed
+            if self._wake.wait(delay):
+                self._wake.clear()
+                continue
+            if self.run_now(QUICK_SCAN_SCRIPT, wait=False) is None:
+                print("Scheduled scan skipped - previous scan still running")
+
+    def status(self):
+        return {
+            "enabled": bool(self.settings.get('auto_refresh')),
+            "interval": self.settings.get('refresh_interval'),
+            "running": self.running_script,
+            "next_run": self.next_run,
+            "last_finished": self.last_finished,
+            "last_status": (self.last_result or {}).get('status'),
+            "runs": self.runs,
+            "skipped": self.skipped
+        }
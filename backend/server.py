@@ -4,8 +4,39 @@ import json
 import subprocess
 import os
 import sys
-import shutil
+import tempfile
+import time
+import functools
 from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.http_cache import (
+    choose_encoding, compress, etag_for_bytes, etag_for_stat, get_variant, http_date,
+    is_compressible, is_not_modified, variant_etag
+)
+from backend.ticket_duplicates import DEFAULT_WINDOW_HOURS, DUPLICATE_THRESHOLD, DUPLICATES_FILE
+from backend.ticket_index import parse_bound
+from backend.atomic_io import write_json_atomic
+from backend.ticket_rollup import DIMENSIONS, brand_of, parse_day, shop_key
+from backend.ticket_store import TicketStore, TicketStoreError, ticket_partitions
+from backend.partitions import PartitionedStore, email_key
+from backend.pipeline import ScanPipeline
+from backend.boilerplate import (
+    COLD_ARCHIVE_DIR, CONFIG_FILE, LEARNED_FILE, BoilerplateStripper, load_config, move_cold_archive, strip_emails
+)
+from backend.email_archive import ARCHIVE_DIR, EmailArchive, strip_partitions
+from backend.email_log import EmailLog
+from backend.email_records import load_partitions
+from backend.metrics import METRICS, route_label
+from backend.scan_scheduler import FULL_SCAN_SCRIPT, QUICK_SCAN_SCRIPT, ScanScheduler
+from backend.snapshots import BACKUP_DIR, SOURCE_DIR, SnapshotStore
+from backend.ticket_events import EVENTS_DIR, TicketEventLog
+from backend.ticket_export import (
+    EMAIL_HEADERS, EXPORT_FORMATS, EXPORT_VIEWS, TICKET_HEADERS, email_row, iter_csv_chunks,
+    iter_rows, write_xlsx
+)
+from backend.whatsapp_import import import_chat
 
 # Port number (must match the fetch URL in your dashboard.html)
 PORT = 8000
@@ -17,34 +48,316 @@ SETTINGS = {
     "default_status": "in progress",
     "default_handler": "USE_MISSING",
     "last_scan": None,
-    "auto_refresh_after_scan": False
+    "auto_refresh_after_scan": False,
+    "duplicate_window_hours": DEFAULT_WINDOW_HOURS
 }
 
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROLLUP_PATH = os.path.join(PROJECT_ROOT, "database", "ticket_rollup.json")
+DUPLICATES_PATH = os.path.join(PROJECT_ROOT, DUPLICATES_FILE)
+EMAILS_PATH = os.path.join(PROJECT_ROOT, "database", "outlook_emails.json")
+EMAIL_DIR = os.path.join(PROJECT_ROOT, "database", "emails")
+
+# Every ticket change as an event (the scan pipeline appends the email events of a scan)
+TICKET_EVENTS = TicketEventLog(os.path.join(PROJECT_ROOT, EVENTS_DIR))
+# Owns the monthly ticket partitions: every read-modify-write goes through its lock
+STORE = TicketStore(ticket_partitions(PROJECT_ROOT), ROLLUP_PATH, DUPLICATES_PATH, TICKET_EVENTS)
+
+# Every email ever scanned, by month (outlook_emails.json only holds the latest scan)
+EMAIL_STORE = PartitionedStore(EMAIL_DIR, email_key, legacy_path=EMAILS_PATH)
+# Email bodies, stored once per distinct content (records carry 'body_hash')
+EMAIL_ARCHIVE = EmailArchive(os.path.join(PROJECT_ROOT, ARCHIVE_DIR))
+# Append-only NDJSON log of the same emails with an offset index, for lookups by position / ticket / time
+EMAIL_LOG = EmailLog(os.path.join(PROJECT_ROOT, ARCHIVE_DIR))
+# Original bodies of emails whose boilerplate was stripped
+COLD_ARCHIVE = EmailArchive(os.path.join(PROJECT_ROOT, COLD_ARCHIVE_DIR))
+# Deduplicated snapshots of database/ (POST /api/backup)
+SNAPSHOTS = SnapshotStore(os.path.join(PROJECT_ROOT, BACKUP_DIR), os.path.join(PROJECT_ROOT, SOURCE_DIR))
+
+def strip_boilerplate(emails):
+    stripper = BoilerplateStripper(load_config(os.path.join(PROJECT_ROOT, CONFIG_FILE)),
+                                   os.path.join(PROJECT_ROOT, LEARNED_FILE))
+    return strip_emails(emails, stripper, COLD_ARCHIVE)
+
+def store_gauges():
+    return {
+        "ticket_count": STORE.count(),
+        "email_count": EMAIL_STORE.count(),
+        "ticket_file_bytes": STORE.partitions.size(),
+        "email_file_bytes": EMAIL_STORE.size(),
+        "email_archive_bytes": EMAIL_ARCHIVE.size(),
+        "email_log_bytes": EMAIL_LOG.size(),
+        "backup_bytes": SNAPSHOTS.size(),
+        "ticket_events_bytes": TICKET_EVENTS.size()
+    }
+
+METRICS.add_gauges(store_gauges)
+
+def timed(method):
+    """Record latency and status of a do_* handler under its route label"""
+    @functools.wraps(method)
+    def wrapper(self):
+        start = time.perf_counter()
+        self.response_status = 0
+        try:
+            return method(self)
+        finally:
+            METRICS.observe_request(self.command, route_label(self.path), self.response_status,
+                                    time.perf_counter() - start)
+    return wrapper
+
+def execute_scan(script_name):
+    """Run the scanner script, then the ticket pipeline in-process; returns the response dict"""
+    print(f"Received request to scan emails using {script_name}...")
+    try:
+        # Get project root directory
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        
+        # 1. Fetch from Outlook in a child process (COM apartment, timeout) -> email log + scan_stats.json
+        print(f"Running {script_name}...")
+        timeout = 300 if "test_all" in script_name else 180
+        script_path = os.path.join(project_root, script_name)
+        stage_start = time.perf_counter()
+        scan_result = subprocess.run(
+            [sys.executable, script_path], 
+            capture_output=True, 
+            timeout=timeout,
+            cwd=project_root  # Run from project root
+        )
+        fetch_seconds = time.perf_counter() - stage_start
+        METRICS.observe_stage('scan_fetch', fetch_seconds)
+        
+        # Handle output with proper encoding
+        stdout_text = scan_result.stdout.decode('utf-8', errors='replace') if scan_result.stdout else ""
+        stderr_text = scan_result.stderr.decode('utf-8', errors='replace') if scan_result.stderr else ""
+        
+        if stdout_text: print(f"{script_name} Output:", stdout_text)
+        if stderr_text: print(f"{script_name} Errors:", stderr_text)
+
+        if scan_result.returncode != 0:
+            raise Exception(f"{script_name} failed with code {scan_result.returncode}")
+
+        # 2. Run the ticket pipeline in this process, on the server's own stores
+        stage_start = time.perf_counter()
+        pipeline = ScanPipeline(PROJECT_ROOT, STORE, EMAIL_LOG, EMAIL_ARCHIVE, EMAIL_STORE, clean=strip_boilerplate)
+        # Hold the store for writing so dashboard edits can't interleave with the merge;
+        # snapshot readers keep getting the pre-scan tickets until it is done
+        with STORE.writing():
+            result = pipeline.run(checkpoint=False)
+            # Months that have closed since the last scan become read-only archives
+            STORE.seal()
+            EMAIL_STORE.seal()
+        merge_seconds = time.perf_counter() - stage_start
+        METRICS.observe_stage('ticket_merge', merge_seconds)
+        for stage, seconds in result['timings'].items():
+            METRICS.observe_stage(f'pipeline_{stage}', seconds)
+
+        SETTINGS['last_scan'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        METRICS.mark_scan_success()
+
+        # 3. Return the delta of this scan (not the whole ticket list)
+        result['timings']['scan_process'] = round(fetch_seconds, 4)
+        result['timings']['pipeline'] = round(merge_seconds, 4)
+        response = {
+            "status": "success", 
+            "message": (f"Scan complete using {script_name}: {len(result.get('tickets_added', []))} new, "
+                        f"{len(result.get('tickets_updated', []))} updated tickets, "
+                        f"{len(result.get('status_changes', []))} status changes"),
+            "result": result,
+            "source": "delta"
+        }
+
+    except Exception as e:
+        print(f"Server Error: {str(e)}")
+        response = {"status": "error", "message": str(e)}
+    
+    return response
+
+SCHEDULER = ScanScheduler(execute_scan, SETTINGS)
+METRICS.add_gauges(lambda: {"scan_running": int(SCHEDULER.running_script is not None)})
+
+class ThreadingServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    # A long scan no longer blocks every other request; ticket writes are serialised by STORE.lock
+    daemon_threads = True
+
 class Handler(http.server.SimpleHTTPRequestHandler):
+    response_status = 0
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+
+    @timed
     def do_GET(self):
         print(f"GET request: {self.path}")
-        # Handle special scan routes
-        if self.path == '/run-scan':
-            self.run_scan("backend/test.py")
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        # Handle special scan routes (?full=1 adds the whole ticket list to the response)
+        if url.path == '/run-scan':
+            self.run_scan(QUICK_SCAN_SCRIPT, full=query.get('full', ['0'])[0] == '1')
             return
-        elif self.path == '/run-scan-all':
-            self.run_scan("backend/test_all.py")
+        elif url.path == '/run-scan-all':
+            self.run_scan(FULL_SCAN_SCRIPT, full=query.get('full', ['0'])[0] == '1')
             return
         elif self.path.startswith('/api/'):
             print(f"API request: {self.path}")
-            if self.path == '/api/filters':
+            if url.path == '/api/filters':
                 self.handle_get_filters()
-            elif self.path == '/api/stats':
+            elif url.path == '/api/stats':
                 self.handle_get_stats()
-            elif self.path == '/api/settings':
+            elif url.path == '/api/settings':
                 self.handle_get_settings()
+            elif url.path == '/api/rollup':
+                self.handle_get_rollup(query)
+            elif url.path == '/api/tickets/range':
+                self.handle_get_ticket_range(query)
+            elif url.path == '/api/tickets/search':
+                self.handle_search_tickets(query)
+            elif url.path == '/api/tickets/duplicates':
+                self.handle_get_duplicates(query)
+            elif url.path == '/api/tickets/history':
+                self.handle_get_history(query)
+            elif url.path == '/api/export':
+                self.handle_export(query)
+            elif url.path == '/api/metrics':
+                self.handle_get_metrics(query)
+            elif url.path == '/api/scheduler':
+                self.send_json(SCHEDULER.status())
+            elif url.path == '/api/backups':
+                self.send_json({"snapshots": SNAPSHOTS.list(), "bytes": SNAPSHOTS.size()})
             else:
                 self.send_error(404, "API endpoint not found")
             return
         
+        # ticket.json is assembled from the monthly partitions
+        if url.path == '/database/ticket.json':
+            self.serve_ticket_json()
+            return
+        
         # For all other requests, serve files (html, json, etc.) normally
-        super().do_GET()
+        self.serve_static()
+
+    def serve_ticket_json(self):
+        """The full ticket list from the current snapshot - never waits for a ticket write or merge"""
+        snapshot = STORE.snapshot()
+        # ETag and body come from the same version, so a cached variant always matches its tag
+        etag = etag_for_bytes(json.dumps(snapshot.signature, sort_keys=True).encode('utf-8'))
+        last_modified = max((mtime_ns / 1e9 for _, mtime_ns in snapshot.signature.values()), default=None)
+        
+        self.send_body(None, 'application/json', etag=etag, last_modified=last_modified,
+                       cache_key='ticket.json', load=snapshot.body,
+                       size=sum(size for size, _ in snapshot.signature.values()))
+
+    def serve_static(self):
+        """Serve a file with ETag/Last-Modified validators and cached gzip/br variants"""
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            # Directories, redirects and 404s keep the stock behaviour
+            if self.command == 'HEAD':
+                super().do_HEAD()
+            else:
+                super().do_GET()
+            return
+
+        st = os.stat(path)
+
+        def load():
+            with open(path, 'rb') as f:
+                return f.read()
+
+        self.send_body(None, self.guess_type(path), etag=etag_for_stat(st),
+                       last_modified=st.st_mtime, cache_key=path, load=load, size=st.st_size)
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_body(body, 'application/json', status=status)
+
+    def send_body(self, body, content_type, status=200, etag=None, last_modified=None,
+                  cache_key=None, load=None, size=None):
+        """Send a response body, answering 304 or compressing it when the client allows"""
+        if etag is None:
+            etag = etag_for_bytes(body)
+        if load is None:
+            load = lambda: body
+        if size is None:
+            size = len(body)
+
+        if status == 200 and self.command in ('GET', 'HEAD') and is_not_modified(self.headers, etag, last_modified):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            return
+
+        encoding = None
+        if is_compressible(content_type, size):
+            encoding = choose_encoding(self.headers.get('Accept-Encoding'))
+
+        if cache_key is not None:
+            data = get_variant(cache_key, etag, encoding, load)
+        else:
+            # One-off (API) bodies would only push the file variants out of the cache
+            data = compress(load(), encoding)
 
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', variant_etag(etag, encoding))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if last_modified is not None:
+            self.send_header('Last-Modified', http_date(last_modified))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def send_chunked(self, chunks, content_type, filename=None):
+        """Stream an iterable of byte chunks with chunked transfer encoding"""
+        chunked = self.request_version != 'HTTP/1.0'
+        if chunked:
+            # Chunked encoding needs an HTTP/1.1 status line
+            self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        if filename:
+            self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        self.send_header('Connection', 'close')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if chunked:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            else:
+                self.wfile.write(chunk)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        self.close_connection = True
+
+    @timed
+    def do_HEAD(self):
+        # Same validators / encoding headers as GET; send_body leaves out the body
+        url = urlsplit(self.path)
+        if url.path in ('/run-scan', '/run-scan-all') or url.path.startswith('/api/'):
+            # API routes run handlers (scans, streamed exports) - GET only
+            self.send_response(405)
+            self.send_header('Allow', 'GET')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            return
+        if url.path == '/database/ticket.json':
+            self.serve_ticket_json()
+            return
+        self.serve_static()
+
+    @timed
     def do_OPTIONS(self):
         # Handle CORS preflight for browser security
         self.send_response(200)
@@ -53,113 +366,39 @@ class Handler(http.server.SimpleHTTPRequestHandler):
         self.send_header("Access-Control-Allow-Headers", "X-Requested-With, Content-type")
         self.end_headers()
 
+    @timed
     def do_POST(self):
         if self.path == '/update-ticket':
             content_length = int(self.headers['Content-Length'])
             post_data = self.rfile.read(content_length)
             updated_ticket = json.loads(post_data.decode('utf-8'))
             
-            # 1. Load existing ticket.json
-            project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            ticket_path = os.path.join(project_root, "database", "ticket.json")
+            # Find the ticket by id or ticket_number, update its editable fields and save
+            try:
+                with METRICS.time_stage('ticket_write'):
+                    STORE.update_ticket(updated_ticket)
+            except TicketStoreError as e:
+                # The ticket's month is sealed (read-only)
+                self.send_json({"status": "error", "message": str(e)}, status=409)
+                return
             
-            with open(ticket_path, 'r', encoding='utf-8') as f:
-                tickets = json.load(f)
-                
-            # 2. Find and update the specific ticket (by id or ticket_number)
-            ticket_id = updated_ticket.get('id') or updated_ticket.get('ticket_number')
-            for i, ticket in enumerate(tickets):
-                ticket_key = ticket.get('id') or ticket.get('ticket_number')
-                if ticket_key == ticket_id:
-                    # Update all editable fields
-                    if 'solution' in updated_ticket:
-                        tickets[i]['solution'] = updated_ticket['solution']
-                    if 'resolve_time' in updated_ticket:
-                        tickets[i]['resolve_time'] = updated_ticket['resolve_time']
-                    if 'ph_rm_os' in updated_ticket:
-                        tickets[i]['ph_rm_os'] = updated_ticket['ph_rm_os']
-                    if 'fu_action' in updated_ticket:
-                        tickets[i]['fu_action'] = updated_ticket['fu_action']
-                    if 'problem' in updated_ticket:
-                        tickets[i]['problem'] = updated_ticket['problem']
-                    if 'handled_by' in updated_ticket:
-                        tickets[i]['handled_by'] = updated_ticket['handled_by']
-                    if 'status' in updated_ticket:
-                        tickets[i]['status'] = updated_ticket['status']
-                    # Update ticket_number if it was empty before
-                    if 'ticket_number' in updated_ticket:
-                        tickets[i]['ticket_number'] = updated_ticket['ticket_number']
-                    break
-                    
-            # 3. Save back to file
-            with open(ticket_path, 'w', encoding='utf-8') as f:
-                json.dump(tickets, f, indent=2, ensure_ascii=False)
-                
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps({"status": "success"}).encode('utf-8'))
+            self.send_json({"status": "success"})
         elif self.path == '/add-ticket':
             content_length = int(self.headers['Content-Length'])
             post_data = self.rfile.read(content_length)
             new_ticket = json.loads(post_data.decode('utf-8'))
             
-            # 1. Load existing ticket.json
-            project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            ticket_path = os.path.join(project_root, "database", "ticket.json")
-            
-            with open(ticket_path, 'r', encoding='utf-8') as f:
-                tickets = json.load(f)
-                
-            # 2. Create new ticket with default values
-            ticket_number = new_ticket.get('ticket_number', '').strip()
-            # Ticket number is now optional (can be null/empty)
-            # Generate a unique ID if not provided
-            if not ticket_number:
-                import datetime
-                ticket_number = "TEMP-" + datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+            # Ticket number is optional - a TEMP-<timestamp> number is generated if empty
+            try:
+                with METRICS.time_stage('ticket_write'):
+                    created_ticket = STORE.add_ticket(new_ticket)
+            except TicketStoreError as e:
+                self.send_json({"status": "error", "message": str(e)}, status=400)
+                return
             
-            # Check if ticket already exists
-            for ticket in tickets:
-                if ticket['ticket_number'] == ticket_number:
-                    self.send_response(400)
-                    self.send_header('Content-type', 'application/json')
-                    self.send_header('Access-Control-Allow-Origin', '*')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({"status": "error", "message": f"Ticket {ticket_number} already exists"}).encode('utf-8'))
-                    return
-            
-            # Create new ticket object
-            import datetime
-            now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-            
-            created_ticket = {
-                "ticket_number": ticket_number,
-                "shop": new_ticket.get('shop', '').strip() or '',
-                "description": new_ticket.get('description', '').strip() or '',
-                "date": new_ticket.get('date', '').strip() or now,
-                "problem": new_ticket.get('problem', '').strip() or '',
-                "resolve_time": new_ticket.get('resolve_time', '').strip() or '',
-                "ph_rm_os": new_ticket.get('ph_rm_os', '').strip() or '',
-                "solution": new_ticket.get('solution', '').strip() or '',
-                "fu_action": new_ticket.get('fu_action', '').strip() or '',
-                "handled_by": new_ticket.get('handled_by', '').strip() or '',
-                "status": new_ticket.get('status', 'in progress').strip() or 'in progress'
-            }
-            
-            # 3. Add to tickets array
-            tickets.append(created_ticket)
-            
-            # 4. Save back to file
-            with open(ticket_path, 'w', encoding='utf-8') as f:
-                json.dump(tickets, f, indent=2, ensure_ascii=False)
-                
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps({"status": "success", "ticket": created_ticket}).encode('utf-8'))
+            self.send_json({"status": "success", "ticket": created_ticket})
+        elif self.path == '/api/tickets/batch':
+            self.handle_ticket_batch()
         
         # === API ENDPOINTS ===
         elif self.path == '/api/filters' and self.command == 'GET':
@@ -186,11 +425,40 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             self.handle_clear_tickets()
         elif self.path == '/api/clear-emails' and self.command == 'POST':
             self.handle_clear_emails()
+        elif urlsplit(self.path).path == '/api/whatsapp-import' and self.command == 'POST':
+            self.handle_whatsapp_import(parse_qs(urlsplit(self.path).query))
         else:
-            self.send_response(404)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"status": "error", "message": "Endpoint not found"}).encode('utf-8'))
+            self.send_json({"status": "error", "message": "Endpoint not found"}, status=404)
+
+    def handle_ticket_batch(self):
+        """Apply many ticket updates / creates with a single ticket.json rewrite.
+
+        Body: {"items": [{"op": "update"|"create", "ticket": {...}}, ...], "atomic": false}
+        """
+        content_length = int(self.headers['Content-Length'])
+        post_data = self.rfile.read(content_length)
+        data = json.loads(post_data.decode('utf-8'))
+        
+        items = data.get('items')
+        if not isinstance(items, list):
+            self.send_json({"status": "error", "message": "'items' must be a list"}, status=400)
+            return
+        
+        with METRICS.time_stage('ticket_write'):
+            persisted, results = STORE.batch(items, atomic=bool(data.get('atomic')))
+        
+        failed = sum(1 for r in results if r['status'] != 'success')
+        if not persisted:
+            status = "error"
+        else:
+            status = "success" if not failed else "partial"
+        self.send_json({
+            "status": status,
+            "persisted": persisted,
+            "succeeded": len(results) - failed,
+            "failed": failed,
+            "results": results
+        }, status=200 if persisted else 409)
 
     def handle_get_filters(self):
         project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -198,14 +466,9 @@ class Handler(http.server.SimpleHTTPRequestHandler):
         try:
             with open(filters_path, 'r', encoding='utf-8') as f:
                 filters = json.load(f)
-            self.send_response(200)
         except:
             filters = []
-            self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps(filters).encode('utf-8'))
+        self.send_json(filters)
 
     def handle_add_filter(self):
         content_length = int(self.headers['Content-Length'])
@@ -233,14 +496,9 @@ class Handler(http.server.SimpleHTTPRequestHandler):
         }
         filters.append(new_filter)
         
-        with open(filters_path, 'w', encoding='utf-8') as f:
-            json.dump(filters, f, indent=2, ensure_ascii=False)
+        write_json_atomic(filters_path, filters, indent=2)
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps({"status": "success", "filter": new_filter}).encode('utf-8'))
+        self.send_json({"status": "success", "filter": new_filter})
 
     def handle_update_filter(self, filter_id):
         content_length = int(self.headers['Content-Length'])
@@ -263,14 +521,9 @@ class Handler(http.server.SimpleHTTPRequestHandler):
                 break
         
         if updated:
-            with open(filters_path, 'w', encoding='utf-8') as f:
-                json.dump(filters, f, indent=2, ensure_ascii=False)
+            write_json_atomic(filters_path, filters, indent=2)
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps({"status": "success" if updated else "error"}).encode('utf-8'))
+        self.send_json({"status": "success" if updated else "error"})
 
     def handle_delete_filter(self, filter_id):
         project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -281,14 +534,9 @@ class Handler(http.server.SimpleHTTPRequestHandler):
         
         filters = [f for f in filters if f.get('id') != filter_id]
         
-        with open(filters_path, 'w', encoding='utf-8') as f:
-            json.dump(filters, f, indent=2, ensure_ascii=False)
+        write_json_atomic(filters_path, filters, indent=2)
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps({"status": "success"}).encode('utf-8'))
+        self.send_json({"status": "success"})
 
     def handle_scan(self):
         content_length = int(self.headers['Content-Length'])
@@ -296,47 +544,197 @@ class Handler(http.server.SimpleHTTPRequestHandler):
         data = json.loads(post_data.decode('utf-8'))
         mode = data.get('mode', 'quick')
         
-        script_name = "backend/test_all.py" if mode == 'full' else "backend/test.py"
-        self.run_scan(script_name)
+        script_name = FULL_SCAN_SCRIPT if mode == 'full' else QUICK_SCAN_SCRIPT
+        self.run_scan(script_name, full=bool(data.get('full')))
 
     def handle_get_stats(self):
-        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        stats = {
+            "ticket_count": STORE.count(),
+            "email_count": EMAIL_STORE.count(),
+            "last_scan": SETTINGS.get('last_scan'),
+            "server_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
         
-        ticket_path = os.path.join(project_root, "database", "ticket.json")
-        emails_path = os.path.join(project_root, "database", "outlook_emails.json")
+        self.send_json(stats)
+
+    def handle_get_rollup(self, query):
+        """Ticket counts per day/week/month x brand x shop x status for a date range"""
+        granularity = query.get('granularity', ['day'])[0]
+        start = parse_day(query.get('from', [''])[0])
+        end = parse_day(query.get('to', [''])[0])
+        brand = query.get('brand', [''])[0] or None
+        shop = query.get('shop', [''])[0] or None
+        group_by = query.get('group', [','.join(DIMENSIONS)])[0].split(',')
         
-        ticket_count = 0
-        email_count = 0
+        try:
+            buckets = STORE.rollup().query(granularity, start, end, brand, shop, group_by)
+        except ValueError as e:
+            self.send_json({"status": "error", "message": str(e)}, status=400)
+            return
         
-        if os.path.exists(ticket_path):
-            with open(ticket_path, 'r', encoding='utf-8') as f:
-                tickets = json.load(f)
-                ticket_count = len(tickets)
+        self.send_json({
+            "status": "success",
+            "granularity": granularity,
+            "from": start.isoformat() if start else None,
+            "to": end.isoformat() if end else None,
+            "total": sum(b['count'] for b in buckets),
+            "buckets": buckets
+        })
+
+    def handle_get_ticket_range(self, query):
+        """Tickets between ?from= and ?to= (dates or 'YYYY-MM-DD HH:MM'), newest first"""
+        try:
+            start = parse_bound(query.get('from', [''])[0])
+            end = parse_bound(query.get('to', [''])[0], end=True)
+            limit = int(query.get('limit', ['0'])[0] or 0)
+        except ValueError as e:
+            self.send_json({"status": "error", "message": str(e)}, status=400)
+            return
+        brand = (query.get('brand', [''])[0] or '').upper()
+        shop = query.get('shop', [''])[0]
+        status = query.get('status', [''])[0]
+        
+        tickets = STORE.date_range(start, end)
+        if brand and brand != 'ALL':
+            tickets = [t for t in tickets if brand_of(t.get('shop')) == brand]
+        if shop:
+            tickets = [t for t in tickets if shop_key(t.get('shop')) == shop_key(shop)]
+        if status:
+            tickets = [t for t in tickets if (t.get('status') or 'in progress') == status]
+        tickets = tickets[::-1]
+        total = len(tickets)
+        if limit > 0:
+            tickets = tickets[:limit]
+        
+        self.send_json({
+            "status": "success",
+            "from": query.get('from', [None])[0],
+            "to": query.get('to', [None])[0],
+            "total": total,
+            "tickets": tickets
+        })
+
+    def handle_search_tickets(self, query):
+        """Ranked full-text search: ?q=<text>[&limit=50][&ids=1] (limit=0 returns every match)"""
+        text = query.get('q', [''])[0]
+        try:
+            limit = int(query.get('limit', ['50'])[0] or 0)
+        except ValueError:
+            self.send_json({"status": "error", "message": "limit must be a number"}, status=400)
+            return
         
-        if os.path.exists(emails_path):
-            with open(emails_path, 'r', encoding='utf-8') as f:
-                emails = json.load(f)
-                email_count = len(emails)
+        start = time.perf_counter()
+        total, hits = STORE.search(text, limit)
+        took = time.perf_counter() - start
+        METRICS.observe_stage('ticket_search', took)
         
-        stats = {
-            "ticket_count": ticket_count,
-            "email_count": email_count,
-            "last_scan": SETTINGS.get('last_scan'),
-            "server_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
+        response = {"status": "success", "query": text, "total": total, "took_ms": round(took * 1000, 2)}
+        if query.get('ids', ['0'])[0] == '1':
+            # The dashboard only needs to know which of its tickets matched
+            response['ticket_numbers'] = [ticket.get('ticket_number') for _, ticket in hits]
+        else:
+            response['tickets'] = [dict(ticket, score=score) for score, ticket in hits]
+        self.send_json(response)
+
+    def handle_get_duplicates(self, query):
+        """Possible duplicates of ?ticket=<number>, or every duplicate group without it.
+
+        ?window= (hours, 0 = no limit, default from settings) and ?threshold= (0-1) tune the match.
+        """
+        try:
+            window = float(query.get('window', [''])[0] or SETTINGS.get('duplicate_window_hours', DEFAULT_WINDOW_HOURS))
+            threshold = float(query.get('threshold', [''])[0] or DUPLICATE_THRESHOLD)
+        except ValueError:
+            self.send_json({"status": "error", "message": "window and threshold must be numbers"}, status=400)
+            return
+        number = query.get('ticket', [''])[0]
+        
+        index = STORE.duplicates()
+        if number:
+            matches = index.similar(number, window, threshold)
+            tickets = STORE.get(n for n, _ in matches)
+            self.send_json({
+                "status": "success",
+                "ticket_number": number,
+                "duplicates": [dict(tickets[n], similarity=score) for n, score in matches if n in tickets]
+            })
+        else:
+            groups = index.groups(window, threshold)
+            self.send_json({"status": "success", "total": len(groups), "groups": groups})
+
+    def handle_get_history(self, query):
+        """Every logged event of ?ticket=<number>, oldest first (earlier numbers included after a rename)"""
+        number = query.get('ticket', [''])[0]
+        if not number:
+            self.send_json({"status": "error", "message": "ticket is required"}, status=400)
+            return
+        events = TICKET_EVENTS.history(number)
+        if not events:
+            self.send_json({"status": "error", "message": f"No events for ticket {number}"}, status=404)
+            return
+        self.send_json({"status": "success", "ticket_number": number, "events": events})
+
+    def handle_export(self, query):
+        """Stream tickets or emails as CSV / XLSX, filtered by date range, brand and dashboard view"""
+        fmt = query.get('format', ['csv'])[0].lower()
+        source = query.get('source', ['tickets'])[0]
+        start = parse_day(query.get('from', [''])[0])
+        end = parse_day(query.get('to', [''])[0])
+        brand = query.get('brand', [''])[0] or None
+        if brand and brand.lower() == 'all':
+            brand = None
+        view = query.get('view', [''])[0].lower()
+        if view == 'all':
+            view = ''
+        
+        if fmt not in EXPORT_FORMATS or source not in ('tickets', 'emails'):
+            self.send_json({"status": "error", "message": "format must be csv or xlsx, source tickets or emails"}, status=400)
+            return
+        if view and view not in EXPORT_VIEWS:
+            self.send_json({"status": "error", "message": "view must be all, cdc or mx"}, status=400)
+            return
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps(stats).encode('utf-8'))
+        if source == 'emails':
+            # Only the monthly partitions overlapping the range are read, into compact records
+            headers, to_row, title = EMAIL_HEADERS, email_row, 'Emails'
+            records = load_partitions(EMAIL_STORE, EMAIL_STORE.months_between(start, end), EMAIL_ARCHIVE)
+            rows = iter_rows(records, headers, start, end, brand, to_row, view)
+        elif start or end:
+            # Date-bounded ticket exports fan out over the per-month date indexes
+            headers, to_row, title = TICKET_HEADERS, None, 'Tickets'
+            records = STORE.date_range(parse_bound(start and start.isoformat()),
+                                       parse_bound(end and end.isoformat(), end=True))[::-1]
+            rows = iter_rows(records, headers, brand=brand, to_row=to_row, view=view)
+        else:
+            headers, to_row, title = TICKET_HEADERS, None, 'Tickets'
+            rows = iter_rows(STORE.snapshot().tickets, headers, brand=brand, to_row=to_row, view=view)
+        filename = f"{source}_export_{start or 'all'}_to_{end or 'all'}.{fmt}"
+        
+        if fmt == 'csv':
+            self.send_chunked(iter_csv_chunks(headers, rows), 'text/csv; charset=utf-8', filename)
+            return
+        
+        # XLSX is a zip, so it is built in a temp file and streamed from disk
+        with tempfile.TemporaryFile() as tmp:
+            try:
+                write_xlsx(headers, rows, tmp, title)
+            except RuntimeError as e:
+                self.send_json({"status": "error", "message": str(e)}, status=501)
+                return
+            tmp.seek(0)
+            self.send_chunked(iter(lambda: tmp.read(64 * 1024), b''),
+                              'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', filename)
+
+    def handle_get_metrics(self, query):
+        """Prometheus text by default, JSON with ?format=json (admin page)"""
+        if query.get('format', [''])[0] == 'json':
+            self.send_json(METRICS.to_json())
+            return
+        body = METRICS.to_prometheus().encode('utf-8')
+        self.send_body(body, 'text/plain; version=0.0.4; charset=utf-8')
 
     def handle_get_settings(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps(SETTINGS).encode('utf-8'))
+        self.send_json(SETTINGS)
 
     def handle_update_settings(self):
         global SETTINGS
@@ -347,135 +745,84 @@ class Handler(http.server.SimpleHTTPRequestHandler):
         for key in data:
             SETTINGS[key] = data[key]
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps({"status": "success"}).encode('utf-8'))
+        # Interval / auto_refresh changes take effect without waiting for the current timer
+        SCHEDULER.settings_changed()
+        
+        self.send_json({"status": "success"})
 
     def handle_backup(self):
-        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_dir = os.path.join(project_root, "backup", timestamp)
-        
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        files_to_backup = [
-            ("database/ticket.json", "tickets.json"),
-            ("database/email_filters.json", "filters.json"),
-            ("database/outlook_emails.json", "emails.json")
-        ]
-        
-        for src, dst in files_to_backup:
-            src_path = os.path.join(project_root, src)
-            if os.path.exists(src_path):
-                shutil.copy2(src_path, os.path.join(backup_dir, dst))
+        # Snapshot under the store lock so no ticket write lands halfway through it;
+        # unchanged files and chunks are shared with earlier snapshots
+        with STORE.lock:
+            with METRICS.time_stage('backup'):
+                snapshot = SNAPSHOTS.create()
+        pruned = SNAPSHOTS.prune()
+        
+        self.send_json({
+            "status": "success",
+            "snapshot": snapshot['id'],
+            "files": len(snapshot['files']),
+            "unchanged_files": snapshot['unchanged_files'],
+            "new_bytes": snapshot['new_bytes'],
+            "pruned": pruned['removed']
+        })
+
+    def handle_whatsapp_import(self, query):
+        """Chat export (.txt or .zip) as the request body; ?overwrite=1, ?month_first=1"""
+        remaining = int(self.headers.get('Content-Length') or 0)
+        if not remaining:
+            self.send_json({"status": "error", "message": "Empty upload"}, status=400)
+            return
+        flag = lambda name: query.get(name, [''])[0] in ('1', 'true')
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps({"status": "success", "backup_dir": backup_dir}).encode('utf-8'))
+        # Spooled to disk and parsed line by line, so a large export never sits in memory
+        fd, path = tempfile.mkstemp(suffix='.whatsapp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while remaining:
+                    chunk = self.rfile.read(min(64 * 1024, remaining))
+                    if not chunk:
+                        break
+                    tmp.write(chunk)
+                    remaining -= len(chunk)
+            with METRICS.time_stage('whatsapp_import'):
+                summary = import_chat(path, STORE, overwrite=flag('overwrite'), day_first=not flag('month_first'))
+        finally:
+            os.remove(path)
+        
+        self.send_json(dict(summary, status="success"))
 
     def handle_clear_tickets(self):
-        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        ticket_path = os.path.join(project_root, "database", "ticket.json")
-        
-        with open(ticket_path, 'w', encoding='utf-8') as f:
-            json.dump([], f, indent=2, ensure_ascii=False)
-        
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps({"status": "success"}).encode('utf-8'))
+        STORE.clear()
+        self.send_json({"status": "success"})
 
     def handle_clear_emails(self):
         project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         emails_path = os.path.join(project_root, "database", "outlook_emails.json")
         
-        with open(emails_path, 'w', encoding='utf-8') as f:
-            json.dump([], f, indent=2, ensure_ascii=False)
+        write_json_atomic(emails_path, [], indent=2)
+        EMAIL_STORE.clear()
+        EMAIL_ARCHIVE.clear()
+        COLD_ARCHIVE.clear()
+        EMAIL_LOG.clear()
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps({"status": "success"}).encode('utf-8'))
-
-    def run_scan(self, script_name="test_quick.py"):
-        print(f"Received request to scan emails using {script_name}...")
-        try:
-            # Get project root directory
-            project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            
-            # 1. Execute script to fetch emails from Outlook -> outlook_emails.json
-            print(f"Running {script_name}...")
-            timeout = 300 if "test_all" in script_name else 180
-            script_path = os.path.join(project_root, script_name)
-            scan_result = subprocess.run(
-                [sys.executable, script_path], 
-                capture_output=True, 
-                timeout=timeout,
-                cwd=project_root  # Run from project root
-            )
-            
-            # Handle output with proper encoding
-            stdout_text = scan_result.stdout.decode('utf-8', errors='replace') if scan_result.stdout else ""
-            stderr_text = scan_result.stderr.decode('utf-8', errors='replace') if scan_result.stderr else ""
-            
-            if stdout_text: print(f"{script_name} Output:", stdout_text)
-            if stderr_text: print(f"{script_name} Errors:", stderr_text)
-
-            if scan_result.returncode != 0:
-                raise Exception(f"{script_name} failed with code {scan_result.returncode}")
-
-            # 2. Execute create_tickets.py to process emails -> ticket.json
-            print("Running create_tickets.py...")
-            create_tickets_path = os.path.join(project_root, "backend", "create_tickets.py")
-            ticket_result = subprocess.run(
-                [sys.executable, create_tickets_path],
-                capture_output=True,
-                cwd=project_root  # Run from project root
-            )
-            
-            # Handle output with proper encoding
-            ticket_stdout = ticket_result.stdout.decode('utf-8', errors='replace') if ticket_result.stdout else ""
-            ticket_stderr = ticket_result.stderr.decode('utf-8', errors='replace') if ticket_result.stderr else ""
-
-            if ticket_stdout: print("create_tickets.py Output:", ticket_stdout)
-            if ticket_stderr: print("create_tickets.py Errors:", ticket_stderr)
-
-            if ticket_result.returncode != 0:
-                raise Exception(f"create_tickets.py failed with code {ticket_result.returncode}")
-
-            SETTINGS['last_scan'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-            # 3. Read and return ticket.json (NOT outlook_emails.json)
-            ticket_path = os.path.join(project_root, "database", "ticket.json")
-            if os.path.exists(ticket_path):
-                with open(ticket_path, "r", encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                response = {
-                    "status": "success", 
-                    "message": f"Scan and ticket creation complete using {script_name}",
-                    "data": data,
-                    "source": "ticket.json"
-                }
-            else:
-                response = {"status": "error", "message": "ticket.json not found after processing."}
+        self.send_json({"status": "success"})
 
-        except Exception as e:
-            print(f"Server Error: {str(e)}")
-            response = {"status": "error", "message": str(e)}
-
-        # Send JSON response back to the frontend
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps(response).encode('utf-8'))
+    def run_scan(self, script_name=QUICK_SCAN_SCRIPT, full=False):
+        # Scans are serialised by the scheduler; a request that arrives while the
+        # same scan is already running gets that scan's result
+        response = SCHEDULER.run_now(script_name)
+        
+        # Legacy clients can still ask for the whole ticket list
+        if full and response.get('status') == 'success':
+            response = dict(response)
+            try:
+                response['data'] = STORE.snapshot().tickets
+                response['source'] = "ticket.json"
+            except (OSError, ValueError) as e:
+                response = {"status": "error", "message": f"Tickets could not be read: {e}"}
+        
+        self.send_json(response)
 
 if __name__ == "__main__":
     # Prevent "Address already in use" errors on restart
@@ -487,7 +834,26 @@ if __name__ == "__main__":
     print(f"3. Quick scanner: scans 50 most recent emails in <30 seconds")
     print(f"4. Full scanner: scans ALL emails (may take several minutes)")
     
-    with socketserver.TCPServer(("", PORT), Handler) as httpd:
+    # Split legacy ticket.json / outlook_emails.json on first run, seal closed months
+    if move_cold_archive(PROJECT_ROOT):
+        print(f"   Moved the cold archive to {COLD_ARCHIVE_DIR}")
+    STORE.seal()
+    with STORE.writing():
+        imported = TICKET_EVENTS.bootstrap(STORE.load)
+    moved = strip_partitions(EMAIL_STORE, EMAIL_ARCHIVE, clean=strip_boilerplate)
+    if not len(EMAIL_LOG):
+        EMAIL_LOG.append(EMAIL_STORE.load()[::-1])
+    EMAIL_STORE.seal()
+    print(f"5. Storage: {len(STORE.partitions.months())} ticket / {len(EMAIL_STORE.months())} email monthly partitions")
+    if moved:
+        print(f"   Moved {moved} inline email bodies into {ARCHIVE_DIR}")
+    if imported:
+        print(f"   Started the ticket event log with {imported} existing tickets")
+    
+    with ThreadingServer(("", PORT), Handler) as httpd:
+        # Only once the migration is done and the port is bound, so a scan never races it
+        SCHEDULER.start()
+        print(f"6. Scheduled scans: {'every %ss' % SETTINGS['refresh_interval'] if SETTINGS['auto_refresh'] else 'off (enable auto-refresh in admin settings)'}")
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
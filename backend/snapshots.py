@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Incremental, deduplicated snapshot backups of database/
+- Files are split into content-defined chunks: a chunk ends after a line whose CRC hits a mask,
+  so an edit in the middle of a partition only changes the chunks around it
+- Chunks are stored once under their BLAKE2b hash in backup/chunks/ (zlib-compressed) and
+  shared by every snapshot that contains them
+- A snapshot is a manifest, backup/snapshots/<id>.json, listing each file's chunk hashes
+- Files whose size and mtime match the previous snapshot reuse its chunk list without being
+  read (sealed month partitions, filters, archived bodies that did not grow)
+- Restore rebuilds a snapshot's files and skips the ones already identical; prune keeps the
+  newest snapshots plus one per day and one per week, then deletes unreferenced chunks
+
+Usage:
+    python backend/snapshots.py create
+    python backend/snapshots.py list
+    python backend/snapshots.py restore 20260301_120000 [--to DIR]   # stop the server first
+    python backend/snapshots.py prune [--last 24] [--daily 7] [--weekly 4]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import zlib
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.partitions import CACHE_DIR
+from backend.atomic_io import write_atomic
+
+BACKUP_DIR = 'backup'
+SOURCE_DIR = 'database'
+CHUNK_DIR = 'chunks'
+SNAPSHOT_DIR = 'snapshots'
+
+CHUNK_MIN = 16 * 1024
+CHUNK_MAX = 256 * 1024
+BOUNDARY_MASK = 0x3FF          # about one line in 1024 ends a chunk (~40 KB of indented JSON)
+
+KEEP_LAST = 24
+KEEP_DAILY = 7
+KEEP_WEEKLY = 4
+
+
+def chunk_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def split_chunks(data):
+    """Content-defined chunks of `data` (bytes), between CHUNK_MIN and CHUNK_MAX where possible"""
+    chunks = []
+    start = pos = 0
+    while pos < len(data):
+        newline = data.find(b'\n', pos, start + CHUNK_MAX)
+        if newline == -1:
+            # No line break before the size limit (binary data, very long lines): cut there
+            pos = min(start + CHUNK_MAX, len(data))
+            chunks.append(data[start:pos])
+            start = pos
+            continue
+        line_start, pos = pos, newline + 1
+        if pos - start >= CHUNK_MIN and zlib.crc32(data[line_start:pos]) & BOUNDARY_MASK == 0:
+            chunks.append(data[start:pos])
+            start = pos
+    if start < len(data):
+        chunks.append(data[start:])
+    return chunks
+
+
+def _backup_order(path):
+    # Index files first: a data file copied after its index always holds what the index points at
+    return (not path.endswith(('.idx', '.ndx')), path)
+
+
+def _id_order(snapshot_id):
+    # <timestamp>, then <timestamp>_2, _3 ... for snapshots taken within the same second
+    stamp, _, n = snapshot_id[:15], snapshot_id[15:16], snapshot_id[16:]
+    return (stamp, int(n) if n.isdigit() else 1)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class SnapshotStore:
+    def __init__(self, directory=BACKUP_DIR, source=SOURCE_DIR):
+        self.directory = directory
+        self.source = source
+        # Chunk garbage collection must not run while a snapshot is adding chunks
+        self.lock = threading.Lock()
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.directory, CHUNK_DIR, digest[:2], digest)
+
+    def _manifest_path(self, snapshot_id):
+        return os.path.join(self.directory, SNAPSHOT_DIR, f"{snapshot_id}.json")
+
+    def ids(self):
+        """Snapshot ids, oldest first"""
+        try:
+            names = os.listdir(os.path.join(self.directory, SNAPSHOT_DIR))
+        except FileNotFoundError:
+            return []
+        return sorted((n[:-5] for n in names if n.endswith('.json')), key=_id_order)
+
+    def load(self, snapshot_id):
+        try:
+            with open(self._manifest_path(snapshot_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise SnapshotError(f"No snapshot {snapshot_id}") from None
+
+    def _source_files(self):
+        files = []
+        for root, dirs, names in os.walk(self.source):
+            # Partition caches are rebuilt from the JSON on first read
+            dirs[:] = [d for d in dirs if d != CACHE_DIR]
+            for name in names:
+                if not name.endswith('.tmp'):
+                    files.append(os.path.relpath(os.path.join(root, name), self.source).replace(os.sep, '/'))
+        return sorted(files, key=_backup_order)
+
+    def _put_chunk(self, data):
+        """Store a chunk unless it already is; returns (hash, stored bytes added)"""
+        digest = chunk_hash(data)
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        stored = zlib.compress(data, 6)
+        write_atomic(path, stored)
+        return digest, len(stored)
+
+    def _read_chunk(self, digest):
+        try:
+            with open(self._chunk_path(digest), 'rb') as f:
+                return zlib.decompress(f.read())
+        except FileNotFoundError:
+            raise SnapshotError(f"Chunk {digest} missing from {self.directory}") from None
+
+    def create(self):
+        """Snapshot every file under the source directory; returns the manifest"""
+        with self.lock:
+            ids = self.ids()
+            previous = self.load(ids[-1])['files'] if ids else {}
+            snapshot_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+            if snapshot_id in ids:
+                snapshot_id += f"_{sum(1 for i in ids if i.startswith(snapshot_id)) + 1}"
+
+            files, new_chunks, new_bytes, reused = {}, 0, 0, 0
+            for rel in self._source_files():
+                path = os.path.join(self.source, rel)
+                try:
+                    st = os.stat(path)
+                    old = previous.get(rel)
+                    if old and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+                        files[rel] = old
+                        reused += 1
+                        continue
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    continue    # removed while the snapshot was running
+                chunks = []
+                for chunk in split_chunks(data):
+                    digest, added = self._put_chunk(chunk)
+                    chunks.append(digest)
+                    new_chunks += 1 if added else 0
+                    new_bytes += added
+                files[rel] = {"size": len(data), "mtime_ns": st.st_mtime_ns,
+                              "hash": chunk_hash(data), "chunks": chunks}
+
+            manifest = {
+                "id": snapshot_id,
+                "created": datetime.now().isoformat(timespec='seconds'),
+                "files": files,
+                "bytes": sum(f['size'] for f in files.values()),
+                "new_chunks": new_chunks,
+                "new_bytes": new_bytes,
+                "unchanged_files": reused
+            }
+            os.makedirs(os.path.dirname(self._manifest_path(snapshot_id)), exist_ok=True)
+            # Chunks are on disk before the manifest that lists them
+            write_atomic(self._manifest_path(snapshot_id),
+                          json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+            return manifest
+
+    def list(self):
+        """Summary of every snapshot, newest first"""
+        summaries = []
+        for snapshot_id in reversed(self.ids()):
+            manifest = self.load(snapshot_id)
+            summary = {k: manifest[k] for k in ('id', 'created', 'bytes', 'new_chunks', 'new_bytes')}
+            summary['files'] = len(manifest['files'])
+            summaries.append(summary)
+        return summaries
+
+    def restore(self, snapshot_id, target=None):
+        """Rebuild the snapshot's files under `target` (default: the source directory, in place).
+
+        Files already identical are left alone. In place, files the snapshot does not
+        have are removed so the directory matches the snapshot exactly.
+        """
+        manifest = self.load(snapshot_id)
+        in_place = target is None
+        target = self.source if in_place else target
+        written = skipped = removed = 0
+        for rel, entry in manifest['files'].items():
+            path = os.path.join(target, *rel.split('/'))
+            try:
+                if os.path.getsize(path) == entry['size']:
+                    with open(path, 'rb') as f:
+                        if chunk_hash(f.read()) == entry['hash']:
+                            skipped += 1
+                            continue
+            except FileNotFoundError:
+                pass
+            data = b''.join(self._read_chunk(digest) for digest in entry['chunks'])
+            if chunk_hash(data) != entry['hash']:
+                raise SnapshotError(f"{rel} does not match snapshot {snapshot_id}")
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            write_atomic(path, data)
+            # Same mtime as when it was backed up, so the next snapshot can reuse its chunks
+            os.utime(path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+            written += 1
+        if in_place:
+            for rel in self._source_files():
+                if rel not in manifest['files']:
+                    os.remove(os.path.join(target, *rel.split('/')))
+                    removed += 1
+        return {"written": written, "unchanged": skipped, "removed": removed}
+
+    def prune(self, last=KEEP_LAST, daily=KEEP_DAILY, weekly=KEEP_WEEKLY):
+        """Keep the newest `last` snapshots and the newest one of each of the latest `daily`
+        days and `weekly` ISO weeks; delete the rest and every chunk no snapshot still uses"""
+        with self.lock:
+            ids = list(reversed(self.ids()))
+            keep = set(ids[:last])
+            for count, period in ((daily, lambda d: d.date()), (weekly, lambda d: d.isocalendar()[:2])):
+                seen = []
+                for snapshot_id in ids:
+                    p = period(datetime.strptime(snapshot_id[:15], "%Y%m%d_%H%M%S"))
+                    if p not in seen:
+                        if len(seen) == count:
+                            break
+                        seen.append(p)
+                        keep.add(snapshot_id)
+
+            removed = [i for i in ids if i not in keep]
+            for snapshot_id in removed:
+                os.remove(self._manifest_path(snapshot_id))
+
+            referenced = set()
+            for snapshot_id in keep:
+                for entry in self.load(snapshot_id)['files'].values():
+                    referenced.update(entry['chunks'])
+            chunks_removed = bytes_freed = 0
+            for root, _, names in os.walk(os.path.join(self.directory, CHUNK_DIR)):
+                for name in names:
+                    if name not in referenced:
+                        path = os.path.join(root, name)
+                        bytes_freed += os.path.getsize(path)
+                        os.remove(path)
+                        chunks_removed += 1
+            return {"removed": removed, "kept": len(keep), "chunks_removed": chunks_removed,
+                    "bytes_freed": bytes_freed}
+
+    def size(self):
+        """Bytes on disk (chunks and manifests)"""
+        total = 0
+        for sub in (CHUNK_DIR, SNAPSHOT_DIR):
+            for root, _, names in os.walk(os.path.join(self.directory, sub)):
+                total += sum(os.path.getsize(os.path.join(root, n)) for n in names)
+        return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deduplicated snapshot backups of the database directory")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('create', help="snapshot database/")
+    sub.add_parser('list', help="list snapshots, newest first")
+    restore = sub.add_parser('restore', help="restore a snapshot (in place unless --to is given)")
+    restore.add_argument('id')
+    restore.add_argument('--to', help="restore into this directory instead of database/")
+    prune = sub.add_parser('prune', help="apply the retention policy")
+    prune.add_argument('--last', type=int, default=KEEP_LAST)
+    prune.add_argument('--daily', type=int, default=KEEP_DAILY)
+    prune.add_argument('--weekly', type=int, default=KEEP_WEEKLY)
+    args = parser.parse_args()
+
+    store = SnapshotStore()
+    try:
+        if args.command == 'create':
+            m = store.create()
+            print(f"Snapshot {m['id']}: {len(m['files'])} files, {m['bytes']:,} bytes "
+                  f"({m['unchanged_files']} unchanged, {m['new_chunks']} new chunks, {m['new_bytes']:,} bytes stored)")
+        elif args.command == 'list':
+            for s in store.list():
+                print(f"{s['id']}  {s['files']:5} files  {s['bytes']:>14,} bytes  +{s['new_bytes']:,} stored")
+            print(f"Backup store: {store.size():,} bytes on disk")
+        elif args.command == 'restore':
+            r = store.restore(args.id, args.to)
+            print(f"Restored {args.id}: {r['written']} written, {r['unchanged']} unchanged, {r['removed']} removed")
+        elif args.command == 'prune':
+            r = store.prune(args.last, args.daily, args.weekly)
+            print(f"Kept {r['kept']} snapshots, removed {len(r['removed'])}; "
+                  f"deleted {r['chunks_removed']} chunks ({r['bytes_freed']:,} bytes)")
+    except SnapshotError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
@@ -13,6 +13,15 @@ from datetime import datetime, timedelta
 import time
 import threading
 import pythoncom
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.boilerplate import strip_emails
+from backend.email_archive import EmailArchive, store_bodies
+from backend.email_log import EmailLog
+from backend.email_threads import outlook_thread_fields
+from backend.atomic_io import write_json_atomic
 
 # === AGGRESSIVE LIMITS ===
 MAX_EMAILS = 50  # Only scan 50 most recent emails
@@ -140,6 +149,7 @@ def main():
         
         
         results = []
+        scanned = 0
         
         i = 0  # Initialize to prevent unbound variable error
         for i in range(total):
@@ -150,6 +160,7 @@ def main():
             
             try:
                 msg = messages[i]
+                scanned += 1
                 
                 # Progress
                 if i % 5 == 0:
@@ -181,6 +192,8 @@ def main():
                 
                 if has_isupport or actions:
                     email_data["filter_actions"] = actions
+                    # ConversationID / Message-ID / In-Reply-To, so follow-ups skip extraction later
+                    email_data.update(outlook_thread_fields(msg))
                     
                     # Extract data
                     if 'extract_cdc' in actions:
@@ -208,9 +221,24 @@ def main():
     
     print("\n[3/3] Saving...")
     try:
-        with open("database/outlook_emails.json", "w", encoding="utf-8") as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
+        # Banners / disclaimers are stripped first (originals go to the cold archive), then
+        # bodies go to the content-addressed archive; outlook_emails.json keeps their hashes
+        boilerplate = strip_emails(results)
+        results = store_bodies(results, EmailArchive())
+        write_json_atomic("database/outlook_emails.json", results, indent=2)
+        # create_tickets.py reads this scan's emails back from the log by position
+        log_records = EmailLog().append(results)
         print(f"[OK] Saved to outlook_emails.json")
+        print(f"  Boilerplate: {boilerplate['bytes_before'] - boilerplate['bytes_after']:,} of {boilerplate['bytes_before']:,} body bytes stripped")
+        
+        # Counters picked up by create_tickets.py for the scan result summary
+        write_json_atomic("database/scan_stats.json", {
+            "emails_scanned": scanned,
+            "emails_kept": len(results),
+            "log_records": log_records,
+            "boilerplate_bytes_saved": boilerplate['bytes_before'] - boilerplate['bytes_after'],
+            "fetch_seconds": round(time.time() - start_time, 2)
+        })
     except Exception as e:
         print(f"[ERROR] {e}")
         return
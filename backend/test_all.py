@@ -4,17 +4,39 @@ FULL EMAIL SCANNER
 - Scans ALL emails (no limit)
 - Shows progress every 10 emails
 - Times out if taking too long
+- Staged: the main thread fetches over COM (only the kept emails' bodies), a bounded queue
+  hands them to a pool of extraction processes, a single writer thread collects the results
+  in scan order. A full queue blocks the fetch, so memory stays bounded
+- Queue depth and per-stage utilization are printed and saved in scan_stats.json ("stages")
 """
 
 import win32com.client
 import json
+import queue
 import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 import time
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.boilerplate import strip_emails
+from backend.email_archive import EmailArchive, store_bodies
+from backend.email_log import EmailLog
+from backend.email_threads import outlook_thread_fields
+from backend.atomic_io import write_json_atomic
 
 # === LIMITS ===
 TIMEOUT_SECONDS = 300  # Stop after 5 minutes
 
+# === PIPELINE ===
+QUEUE_SIZE = 64  # kept emails between the fetch and the writer
+WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))  # extraction processes
+EXTRACT_ACTIONS = ('extract_cdc', 'send_mx_alert')
+_DONE = object()
+
 class QuickEmailScanner:
     def __init__(self):
         self.load_filters()
@@ -104,6 +126,88 @@ class QuickEmailScanner:
             pass
         return data
 
+_worker_scanner = None
+
+def _init_worker():
+    global _worker_scanner
+    _worker_scanner = QuickEmailScanner()
+
+def extract_fields(actions, body):
+    """Runs in a worker process: the regex extraction for one email. Returns (fields, seconds)."""
+    start = time.perf_counter()
+    fields = {}
+    if 'extract_cdc' in actions:
+        fields.update(_worker_scanner.extract_cdc(body))
+    if 'send_mx_alert' in actions:
+        fields.update(_worker_scanner.extract_mx(body))
+    return fields, time.perf_counter() - start
+
+class StageStats:
+    """Busy / waiting seconds per stage and queue depth, to see which stage holds the scan back"""
+    def __init__(self, capacity, workers):
+        self.capacity = capacity
+        self.workers = workers
+        self.seconds = {}
+        self.depth_samples = 0
+        self.depth_total = 0
+        self.depth_max = 0
+        self._lock = threading.Lock()
+    
+    def add(self, name, seconds):
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+    
+    def sample_depth(self, depth):
+        self.depth_samples += 1
+        self.depth_total += depth
+        self.depth_max = max(self.depth_max, depth)
+    
+    def summary(self, wall):
+        wall = max(wall, 1e-9)
+        get = lambda name: self.seconds.get(name, 0.0)
+        stages = {
+            "fetch": {"busy": get('fetch'), "blocked": get('fetch_blocked')},
+            "extract": {"busy": get('extract'), "workers": self.workers},
+            "writer": {"busy": get('writer'), "waiting": get('writer_waiting')}
+        }
+        stages['fetch']['utilization'] = get('fetch') / wall
+        stages['extract']['utilization'] = get('extract') / (wall * self.workers)
+        stages['writer']['utilization'] = get('writer') / wall
+        for stage in stages.values():
+            for key, value in stage.items():
+                if isinstance(value, float):
+                    stage[key] = round(value, 4)
+        return {
+            "wall_seconds": round(wall, 3),
+            **stages,
+            "queue": {"capacity": self.capacity, "max_depth": self.depth_max,
+                      "mean_depth": round(self.depth_total / max(1, self.depth_samples), 2)},
+            "bottleneck": max(('fetch', 'extract', 'writer'), key=lambda s: stages[s]['utilization'])
+        }
+
+def write_results(pending, results, stats):
+    """Writer stage: resolves extraction results in scan order and collects the emails"""
+    while True:
+        start = time.perf_counter()
+        item = pending.get()
+        if item is _DONE:
+            stats.add('writer_waiting', time.perf_counter() - start)
+            return
+        email_data, future = item
+        fields = {}
+        if future is not None:
+            try:
+                fields, seconds = future.result()
+                stats.add('extract', seconds)
+            except Exception as e:
+                print(f"\n  Extraction failed: {str(e)[:40]}")
+        stats.add('writer_waiting', time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        email_data.update(fields)
+        results.append(email_data)
+        stats.add('writer', time.perf_counter() - start)
+
 def main():
     print("="*60)
     print("FULL EMAIL SCANNER")
@@ -132,65 +236,85 @@ def main():
         print(f"Scanning ALL {total} emails...")
         
         results = []
+        scanned = 0
+        
+        # Fetch (this thread - COM objects stay in their apartment) -> bounded queue
+        # -> extraction processes -> writer thread
+        stats = StageStats(QUEUE_SIZE, WORKERS)
+        pending = queue.Queue(maxsize=QUEUE_SIZE)
+        writer = threading.Thread(target=write_results, args=(pending, results, stats), name="scan-writer")
+        pool = ProcessPoolExecutor(max_workers=WORKERS, initializer=_init_worker)
+        writer.start()
         
         i = 0  # Initialize to prevent unbound variable error
-        for i in range(total):
-            # Check timeout
-            if time.time() - start_time > TIMEOUT_SECONDS:
-                print(f"\n[TIMEOUT] Stopped after {TIMEOUT_SECONDS}s")
-                break
-            
-            try:
-                msg = messages[i]
-                
-                # Progress every 10 emails
-                if i % 10 == 0:
-                    elapsed = int(time.time() - start_time)
-                    print(f"  {i+1}/{total} ({elapsed}s)", end='\r')
-                
-                # Get basic data
-                sender = f"{msg.SenderName}"
-                date = str(msg.ReceivedTime)
-                subject = str(msg.Subject)
-                body = str(msg.Body)
-                
-                # Recipients
-                recipients = []
-                for r in msg.Recipients:
-                    recipients.append({"name": r.Name, "email": r.Address, "type": r.Type})
-                
-                email_data = {
-                    "sender": sender,
-                    "date": date,
-                    "subject": subject,
-                    "body": body,
-                    "recipients": recipients
-                }
-                
-                # Check if should keep
-                actions = scanner.apply_filters(email_data)
-                has_isupport = any(r["name"] == "iSupport" for r in recipients)
+        try:
+            for i in range(total):
+                # Check timeout
+                if time.time() - start_time > TIMEOUT_SECONDS:
+                    print(f"\n[TIMEOUT] Stopped after {TIMEOUT_SECONDS}s")
+                    break
                 
-                if has_isupport or actions:
-                    email_data["filter_actions"] = actions
+                try:
+                    fetch_start = time.perf_counter()
+                    msg = messages[i]
+                    scanned += 1
                     
-                    # Extract data
-                    if 'extract_cdc' in actions:
-                        cdc_data = scanner.extract_cdc(body)
-                        email_data.update(cdc_data)
+                    # Progress every 10 emails
+                    if i % 10 == 0:
+                        elapsed = int(time.time() - start_time)
+                        print(f"  {i+1}/{total} ({elapsed}s)", end='\r')
                     
-                    if 'send_mx_alert' in actions:
-                        mx_data = scanner.extract_mx(body)
-                        email_data.update(mx_data)
+                    # Sender and recipients decide whether the email is kept
+                    sender = f"{msg.SenderName}"
+                    recipients = []
+                    for r in msg.Recipients:
+                        recipients.append({"name": r.Name, "email": r.Address, "type": r.Type})
                     
-                    results.append(email_data)
-            
-            except Exception as e:
-                print(f"\n  Error on email {i+1}: {str(e)[:40]}")
-                continue
+                    actions = scanner.apply_filters({"sender": sender, "recipients": recipients})
+                    has_isupport = any(r["name"] == "iSupport" for r in recipients)
+                    if not (has_isupport or actions):
+                        stats.add('fetch', time.perf_counter() - fetch_start)
+                        continue
+                    
+                    # Only kept emails have their date, subject and body read over COM
+                    body = str(msg.Body)
+                    email_data = {
+                        "sender": sender,
+                        "date": str(msg.ReceivedTime),
+                        "subject": str(msg.Subject),
+                        "body": body,
+                        "recipients": recipients,
+                        "filter_actions": actions
+                    }
+                    # ConversationID / Message-ID / In-Reply-To, so follow-ups skip extraction later
+                    email_data.update(outlook_thread_fields(msg))
+                    
+                    future = None
+                    if any(a in EXTRACT_ACTIONS for a in actions):
+                        future = pool.submit(extract_fields, actions, body)
+                    stats.add('fetch', time.perf_counter() - fetch_start)
+                    
+                    # Blocks while the queue is full: the fetch waits for extraction / the writer
+                    put_start = time.perf_counter()
+                    pending.put((email_data, future))
+                    stats.add('fetch_blocked', time.perf_counter() - put_start)
+                    stats.sample_depth(pending.qsize())
+                
+                except Exception as e:
+                    print(f"\n  Error on email {i+1}: {str(e)[:40]}")
+                    continue
+        finally:
+            pending.put(_DONE)
+            writer.join()
+            pool.shutdown()
         
         print(f"\n  Scanned {i+1} emails in {int(time.time()-start_time)}s")
         print(f"  Kept {len(results)} matching emails")
+        stages = stats.summary(time.time() - start_time)
+        print(f"  Stages: fetch {stages['fetch']['utilization']:.0%} busy ({stages['fetch']['blocked']:.1f}s blocked), "
+              f"extract {stages['extract']['utilization']:.0%} of {WORKERS} workers, "
+              f"writer {stages['writer']['utilization']:.0%}; queue mean {stages['queue']['mean_depth']} / "
+              f"max {stages['queue']['max_depth']} of {QUEUE_SIZE} -> bottleneck: {stages['bottleneck']}")
         
     except Exception as e:
         print(f"[ERROR] {e}")
@@ -198,9 +322,25 @@ def main():
     
     print("\n[3/3] Saving...")
     try:
-        with open("database/outlook_emails.json", "w", encoding="utf-8") as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
+        # Banners / disclaimers are stripped first (originals go to the cold archive), then
+        # bodies go to the content-addressed archive; outlook_emails.json keeps their hashes
+        boilerplate = strip_emails(results)
+        results = store_bodies(results, EmailArchive())
+        write_json_atomic("database/outlook_emails.json", results, indent=2)
+        # The scan pipeline (pipeline.py) reads this scan's emails back from the log by position
+        log_records = EmailLog().append(results)
         print(f"[OK] Saved to outlook_emails.json")
+        print(f"  Boilerplate: {boilerplate['bytes_before'] - boilerplate['bytes_after']:,} of {boilerplate['bytes_before']:,} body bytes stripped")
+        
+        # Counters (and the stage metrics) picked up by pipeline.py for the scan result summary
+        write_json_atomic("database/scan_stats.json", {
+            "emails_scanned": scanned,
+            "emails_kept": len(results),
+            "log_records": log_records,
+            "boilerplate_bytes_saved": boilerplate['bytes_before'] - boilerplate['bytes_after'],
+            "fetch_seconds": round(time.time() - start_time, 2),
+            "stages": stages
+        })
     except Exception as e:
         print(f"[ERROR] {e}")
         return
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate ticket detection
+- Each description is reduced to character-bigram shingles and a MinHash signature
+- Signatures are split into LSH bands; bucket keys include the shop, so only tickets
+  from the same shop are ever compared
+- Candidates are kept if they are within the time window and their estimated
+  Jaccard similarity reaches DUPLICATE_THRESHOLD
+- Maintained incrementally by merge_tickets / TicketStore and persisted next to
+  the ticket partitions, validated against their signature
+"""
+
+import json
+import os
+import random
+import re
+import struct
+import unicodedata
+import zlib
+
+from backend.ticket_index import ticket_ts
+from backend.atomic_io import write_json_atomic
+from backend.ticket_rollup import shop_key
+
+DUPLICATES_FILE = os.path.join('database', 'ticket_duplicates.json')
+
+NUM_PERM = 32
+BANDS = 16
+ROWS = NUM_PERM // BANDS          # LSH catches pairs above roughly (1/BANDS) ** (1/ROWS) = 0.25
+DUPLICATE_THRESHOLD = 0.5
+DEFAULT_WINDOW_HOURS = 72
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20260226)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_PACK = struct.Struct(f'>{NUM_PERM}H')
+_NOISE = re.compile(r'[\W_]+')
+
+
+def shingles(text):
+    """Character bigrams of the description with spaces / punctuation removed"""
+    text = _NOISE.sub('', unicodedata.normalize('NFKC', str(text or '')).lower())
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def minhash(text):
+    """16-bit MinHash signature (tuple of NUM_PERM ints) or None for an empty description"""
+    hashes = [zlib.crc32(s.encode('utf-8')) for s in shingles(text)]
+    if not hashes:
+        return None
+    return tuple(min((a * h + b) % _PRIME for h in hashes) & 0xFFFF for a, b in _PERMS)
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity: the fraction of matching signature slots"""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+class DuplicateIndex:
+    def __init__(self):
+        self.entries = {}   # ticket number -> (shop, date_ts, signature)
+        self.buckets = {}   # (shop, band, band slice) -> set of ticket numbers
+        self.source = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _bands(self, shop, signature):
+        return [(shop, band, signature[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+    def _insert(self, key, entry):
+        self.entries[key] = entry
+        for bucket in self._bands(entry[0], entry[2]):
+            self.buckets.setdefault(bucket, set()).add(key)
+
+    def add(self, ticket):
+        """Index a ticket, or re-index it if its shop / date / description changed"""
+        key = ticket.get('ticket_number')
+        signature = minhash(ticket.get('description'))
+        if signature is None:
+            self.remove(key)
+            return
+        entry = (shop_key(ticket.get('shop')), ticket_ts(ticket), signature)
+        if self.entries.get(key) == entry:
+            return
+        self.remove(key)
+        self._insert(key, entry)
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for bucket in self._bands(entry[0], entry[2]):
+            members = self.buckets.get(bucket)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self.buckets[bucket]
+
+    def rebuild(self, tickets):
+        self.entries = {}
+        self.buckets = {}
+        for ticket in tickets:
+            self.add(ticket)
+
+    def _close(self, entry_a, entry_b, window_hours, threshold):
+        if window_hours:
+            if entry_a[1] is None or entry_b[1] is None or abs(entry_a[1] - entry_b[1]) > window_hours * 3600:
+                return None
+        score = similarity(entry_a[2], entry_b[2])
+        return score if score >= threshold else None
+
+    def similar(self, key, window_hours=DEFAULT_WINDOW_HOURS, threshold=DUPLICATE_THRESHOLD):
+        """[(ticket number, similarity)] of possible duplicates of `key`, most similar first"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return []
+        candidates = set()
+        for bucket in self._bands(entry[0], entry[2]):
+            candidates |= self.buckets.get(bucket, set())
+        candidates.discard(key)
+
+        results = []
+        for other in candidates:
+            score = self._close(entry, self.entries[other], window_hours, threshold)
+            if score is not None:
+                results.append((other, round(score, 3)))
+        results.sort(key=lambda r: (-r[1], r[0]))
+        return results
+
+    def groups(self, window_hours=DEFAULT_WINDOW_HOURS, threshold=DUPLICATE_THRESHOLD):
+        """Clusters (sorted lists of ticket numbers) of mutually linked possible duplicates"""
+        parent = {}
+
+        def find(key):
+            root = parent.setdefault(key, key)
+            while parent[root] != root:
+                root = parent[root]
+            while parent[key] != root:
+                parent[key], key = root, parent[key]
+            return root
+
+        for members in self.buckets.values():
+            if len(members) < 2:
+                continue
+            # Only tickets inside the window can match - compare along the time axis
+            ordered = sorted(members, key=lambda k: self.entries[k][1] or 0)
+            for i, key in enumerate(ordered):
+                entry = self.entries[key]
+                for other in ordered[i + 1:]:
+                    other_entry = self.entries[other]
+                    if window_hours and (other_entry[1] or 0) - (entry[1] or 0) > window_hours * 3600:
+                        break
+                    if find(key) != find(other) and self._close(entry, other_entry, window_hours, threshold) is not None:
+                        parent[find(other)] = find(key)
+
+        clusters = {}
+        for key in parent:
+            clusters.setdefault(find(key), set()).add(key)
+        return sorted((sorted(c) for c in clusters.values() if len(c) > 1), key=lambda c: (-len(c), c))
+
+    def save(self, path, source):
+        """`source` is the signature of the ticket data this index was built from"""
+        self.source = source
+        entries = {key: [shop, ts, _PACK.pack(*sig).hex()] for key, (shop, ts, sig) in self.entries.items()}
+        write_json_atomic(path, {"source": source, "entries": entries})
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        index.source = data.get('source')
+        for key, (shop, ts, packed) in data.get('entries', {}).items():
+            index._insert(key, (shop, ts, _PACK.unpack(bytes.fromhex(packed))))
+        return index
+
+
+def load_duplicates(source, path, load_tickets):
+    """Load the saved index if it was built from `source`, otherwise rebuild it from load_tickets()"""
+    try:
+        index = DuplicateIndex.load(path)
+        if index.source and index.source == source:
+            return index
+    except (OSError, ValueError, KeyError, struct.error):
+        pass
+
+    index = DuplicateIndex()
+    index.rebuild(load_tickets())
+    return index
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Append-only ticket event log; ticket state is derived by replaying it
+- Events: "import" (a ticket that existed before the log), "create" (dashboard), "email"
+  (fields extracted from a logged email by create_tickets.py), "edit" (dashboard changes,
+  renames included) and "clear"
+- events.ndjson holds one event per line; events.idx is a fixed-size sidecar index
+  (offset, length, origin, kind, ticket number) read without parsing the log
+- Every event of a ticket carries its origin - the position of its first event - so a
+  ticket's history is O(its events) even across renames
+- A snapshot of the derived state is written every SNAPSHOT_EVERY events; replays start from
+  the newest one. A full replay can fan out over worker processes (tickets are independent)
+- The monthly partitions stay the materialised view the server reads; `rebuild` derives them
+  again from the log (optionally re-running the extractors on the logged emails)
+
+Usage:
+    python backend/ticket_events.py history HK540639
+    python backend/ticket_events.py rebuild [--workers 4] [--reextract] [--write]
+    python backend/ticket_events.py snapshot
+"""
+
+import argparse
+import json
+import marshal
+import mmap
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.ticket_index import stamp, ticket_ts
+from backend.atomic_io import file_signature, write_atomic
+
+EVENTS_DIR = os.path.join('database', 'ticket_events')
+EVENTS_FILE = 'events.ndjson'
+EVENTS_INDEX_FILE = 'events.idx'
+
+EVENTS_INDEX_MAGIC = b'TEX1'
+# offset, length, origin, kind, ticket number after the event
+EVENT_RECORD = struct.Struct('>QIQB24s')
+NUMBER_FIELD = 24
+
+KINDS = {"import": 1, "create": 2, "email": 3, "edit": 4, "clear": 5}
+
+# Fields an email extraction may (re)set; everything else belongs to the dashboard user
+BASE_FIELDS = ('shop', 'description', 'date')
+NEW_TICKET_DEFAULTS = {"problem": '', "resolve_time": '', "ph_rm_os": '', "solution": '',
+                       "fu_action": '', "handled_by": 'USE_MISSING', "status": 'in progress'}
+
+SNAPSHOT_EVERY = 1000
+SNAPSHOTS_KEPT = 3
+
+
+def _number_field(number):
+    return str(number or '').encode('utf-8')[:NUMBER_FIELD]
+
+
+def now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def apply_event(state, event):
+    """Ticket state after `event` (same rules as create_tickets.merge_tickets and TicketStore)"""
+    kind = event['type']
+    if kind in ('import', 'create'):
+        return dict(event['state'])
+    if kind == 'email':
+        fields = event['fields']
+        if state is None:
+            state = dict(NEW_TICKET_DEFAULTS, ticket_number=event['ticket'])
+            state.update(fields)
+            return stamp(state)
+        state = dict(state)
+        old_date = state.get('date')
+        for field in BASE_FIELDS:
+            if fields.get(field) and fields[field] != state.get(field):
+                state[field] = fields[field]
+        if state.get('date') != old_date or 'date_ts' not in state:
+            stamp(state)
+        return state
+    if kind == 'edit':
+        state = dict(state or {"ticket_number": event['ticket']})
+        state.update(event['changes'])
+        return state
+    return state
+
+
+def _fold(items, read, reextract=None):
+    """{origin: state} for [(origin, base state, [index entries])]"""
+    states = {}
+    for origin, state, entries in items:
+        for entry in entries:
+            event = read(entry)
+            if reextract is not None and event['type'] == 'email':
+                event = reextract(event)
+            state = apply_event(state, event)
+        states[origin] = state
+    return states
+
+
+def _fold_chunk(directory, items, reextract):
+    """Worker process: replay one share of the tickets straight from the mapped log"""
+    log = TicketEventLog(directory)
+    return _fold(items, log._read, Reextractor() if reextract else None)
+
+
+class Reextractor:
+    """Re-runs the current extractors on the email behind an "email" event"""
+
+    def __init__(self):
+        from backend.create_tickets import apply_filters, extract_cdc_data, extract_fw_data, extract_mx_data
+        from backend.email_archive import EmailArchive, with_body
+        from backend.email_log import EmailLog
+        self.log, self.archive, self.with_body = EmailLog(), EmailArchive(), with_body
+        self.apply_filters = apply_filters
+        self.extractors = (('extract_cdc', extract_cdc_data), ('send_mx_alert', extract_mx_data),
+                           ('extract_fw', extract_fw_data))
+        try:
+            with open(os.path.join('database', 'email_filters.json'), 'r', encoding='utf-8') as f:
+                self.filters = json.load(f)
+        except (OSError, ValueError):
+            self.filters = []
+
+    def __call__(self, event):
+        position = event.get('email')
+        # Thread follow-ups were linked to their ticket without extraction (email_threads.py)
+        if event.get('followup') or position is None or position >= len(self.log):
+            return event
+        email = self.with_body(self.log.record(position), self.archive)
+        actions = email.get('filter_actions') or self.apply_filters(self.filters, email)
+        for action, extract in self.extractors:
+            if action in actions:
+                extracted = extract(email)
+                fields = dict(event['fields'])
+                fields.update({f: extracted[f] for f in BASE_FIELDS if extracted.get(f)})
+                return dict(event, fields=fields)
+        return event
+
+
+class TicketEventLog:
+    def __init__(self, directory=EVENTS_DIR):
+        self.directory = directory
+        self._map = None
+        self._reset()
+
+    def _reset(self):
+        if self._map is not None:
+            self._map.close()
+        self._entries = []
+        self._indexed = 0           # bytes of events.idx already read
+        self._signature = None
+        self._by_origin = {}
+        self._by_number = {}        # current ticket number -> origin
+        self._number_of = {}        # origin -> current ticket number
+        self._last_clear = -1
+        self._map = None
+        self._map_size = 0
+
+    def _file(self, name):
+        return os.path.join(self.directory, name)
+
+    def entries(self):
+        """Index entries (offset, length, origin, kind, number) in log order.
+
+        Only the part of events.idx appended since the last call is read.
+        """
+        signature = file_signature(self._file(EVENTS_INDEX_FILE))
+        if signature != self._signature:
+            size = signature['size'] if signature else 0
+            if size < self._indexed or size == 0:
+                self._reset()
+            try:
+                with open(self._file(EVENTS_INDEX_FILE), 'rb') as f:
+                    if self._indexed == 0:
+                        if f.read(len(EVENTS_INDEX_MAGIC)) != EVENTS_INDEX_MAGIC:
+                            raise FileNotFoundError
+                        self._indexed = len(EVENTS_INDEX_MAGIC)
+                    f.seek(self._indexed)
+                    data = f.read()
+            except FileNotFoundError:
+                data = b''
+            usable = len(data) - len(data) % EVENT_RECORD.size
+            for offset, length, origin, kind, number in EVENT_RECORD.iter_unpack(data[:usable]):
+                self._index(len(self._entries), (offset, length, origin, kind,
+                                                 number.rstrip(b'\0').decode('utf-8', errors='replace')))
+            self._indexed += usable
+            self._signature = signature
+        return self._entries
+
+    def _index(self, position, entry):
+        _, _, origin, kind, number = entry
+        self._entries.append(entry)
+        if kind == KINDS['clear']:
+            self._last_clear = position
+            self._by_origin, self._by_number, self._number_of = {}, {}, {}
+            return
+        self._by_origin.setdefault(origin, []).append(position)
+        old = self._number_of.get(origin)
+        if old is not None and old != number and self._by_number.get(old) == origin:
+            del self._by_number[old]
+        self._number_of[origin] = number
+        self._by_number[number] = origin
+
+    def __len__(self):
+        return len(self.entries())
+
+    def _mapped(self, end):
+        if self._map is None or self._map_size < end:
+            if self._map is not None:
+                self._map.close()
+            with open(self._file(EVENTS_FILE), 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._map_size = len(self._map)
+        return self._map
+
+    def _read(self, entry):
+        offset, length = entry[0], entry[1]
+        return json.loads(self._mapped(offset + length)[offset:offset + length])
+
+    def append(self, events):
+        """Append events ({"type", "ticket", ...}; edits that rename carry "from"); returns their positions.
+
+        Writers are serialised by the ticket store (TicketStore.writing), the same as the partitions.
+        """
+        entries = self.entries()
+        os.makedirs(self.directory, exist_ok=True)
+        lines, records, positions = [], [], []
+        with open(self._file(EVENTS_FILE), 'ab') as log, open(self._file(EVENTS_INDEX_FILE), 'ab') as idx:
+            offset = log.seek(0, os.SEEK_END)
+            for event in events:
+                event = dict(event, at=event.get('at') or now())
+                kind = KINDS[event['type']]
+                position = len(entries)
+                if kind == KINDS['clear']:
+                    origin = 0
+                else:
+                    origin = self._by_number.get(event.get('from') or event['ticket'])
+                    if origin is None or kind in (KINDS['import'], KINDS['create']):
+                        origin = position
+                line = json.dumps(event, ensure_ascii=False).encode('utf-8')
+                entry = (offset, len(line), origin, kind, _number_field(event.get('ticket')).decode('utf-8', errors='replace'))
+                lines.append(line + b'\n')
+                records.append(EVENT_RECORD.pack(offset, len(line), origin, kind, _number_field(event.get('ticket'))))
+                # Indexed now so later events of this batch resolve their origin
+                self._index(position, entry)
+                positions.append(position)
+                offset += len(line) + 1
+            if records:
+                log.write(b''.join(lines))
+                # Lines reach the disk before the index entries that point at them
+                log.flush()
+                os.fsync(log.fileno())
+                if idx.tell() == 0:
+                    idx.write(EVENTS_INDEX_MAGIC)
+                idx.write(b''.join(records))
+                idx.flush()
+                self._indexed = idx.tell()
+        self._signature = file_signature(self._file(EVENTS_INDEX_FILE))
+        if records and len(entries) - self.snapshot_position() >= SNAPSHOT_EVERY:
+            self.snapshot()
+        return positions
+
+    def origin_of(self, number):
+        self.entries()
+        return self._by_number.get(number)
+
+    def history(self, number):
+        """Every event of the ticket now numbered `number`, oldest first (renames followed)"""
+        entries = self.entries()
+        origin = self._by_number.get(number)
+        if origin is None:
+            return []
+        return [dict(self._read(entries[p]), position=p) for p in self._by_origin[origin]]
+
+    # --- derived state -------------------------------------------------------------------
+
+    def _snapshot_files(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(n for n in names if n.startswith('snapshot-') and n.endswith('.marshal'))
+
+    def snapshot_position(self):
+        """Position the newest snapshot was taken at (0 if there is none)"""
+        files = self._snapshot_files()
+        return int(files[-1][9:-8]) if files else 0
+
+    def _load_snapshot(self):
+        """(position, {origin: state}) of the newest usable snapshot, or (start, {})"""
+        self.entries()
+        start = self._last_clear + 1
+        for name in reversed(self._snapshot_files()):
+            position = int(name[9:-8])
+            if start <= position <= len(self._entries):
+                try:
+                    with open(self._file(name), 'rb') as f:
+                        return position, marshal.loads(f.read())
+                except (OSError, ValueError, EOFError):
+                    continue
+        return start, {}
+
+    def states(self, workers=1, reextract=False, use_snapshot=True):
+        """{origin: ticket state} after every logged event.
+
+        Starts from the newest snapshot unless use_snapshot=False or reextract=True;
+        with workers > 1 the tickets are split across processes.
+        """
+        entries = self.entries()
+        if use_snapshot and not reextract:
+            start, states = self._load_snapshot()
+        else:
+            start, states = self._last_clear + 1, {}
+        pending = {}
+        for position in range(start, len(entries)):
+            pending.setdefault(entries[position][2], []).append(entries[position])
+        items = [(origin, states.get(origin), tail) for origin, tail in pending.items()]
+
+        if workers > 1 and len(items) > workers:
+            chunks = [items[i::workers] for i in range(workers)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for folded in pool.map(_fold_chunk, [self.directory] * workers, chunks, [reextract] * workers):
+                    states.update(folded)
+        else:
+            states.update(_fold(items, self._read, Reextractor() if reextract else None))
+        return states
+
+    def tickets(self, **kwargs):
+        """Derived ticket list, newest first"""
+        tickets = [t for t in self.states(**kwargs).values() if t is not None]
+        tickets.sort(key=lambda t: ticket_ts(t) or 0, reverse=True)
+        return tickets
+
+    def snapshot(self):
+        """Write the derived state at the current position; keeps the newest SNAPSHOTS_KEPT"""
+        position = len(self.entries())
+        states = self.states()
+        os.makedirs(self.directory, exist_ok=True)
+        write_atomic(self._file(f"snapshot-{position:012d}.marshal"), marshal.dumps(states))
+        for name in self._snapshot_files()[:-SNAPSHOTS_KEPT]:
+            os.remove(self._file(name))
+        return position
+
+    def bootstrap(self, load_tickets):
+        """Log an "import" event for every existing ticket if the log is empty; returns how many"""
+        if len(self):
+            return 0
+        tickets = load_tickets()
+        self.append([{"type": "import", "ticket": t.get('ticket_number'), "state": t} for t in tickets])
+        return len(tickets)
+
+    def size(self):
+        try:
+            return sum(os.path.getsize(self._file(n)) for n in os.listdir(self.directory))
+        except FileNotFoundError:
+            return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ticket event log: history and replays")
+    sub = parser.add_subparsers(dest='command', required=True)
+    history = sub.add_parser('history', help="every event of one ticket")
+    history.add_argument('number')
+    rebuild = sub.add_parser('rebuild', help="derive the tickets from the log and compare with the partitions")
+    rebuild.add_argument('--workers', type=int, default=1)
+    rebuild.add_argument('--reextract', action='store_true', help="re-run the extractors on logged emails")
+    rebuild.add_argument('--write', action='store_true', help="replace the ticket partitions with the result")
+    sub.add_parser('snapshot', help="write a snapshot of the derived state now")
+    args = parser.parse_args()
+
+    log = TicketEventLog()
+    if args.command == 'history':
+        for event in log.history(args.number):
+            detail = event.get('changes') or event.get('fields') or event.get('state')
+            if event.get('followup'):
+                detail = f"follow-up email #{event['email']}, linked without extraction"
+            print(f"#{event['position']} {event['at']} {event['type']:6} {json.dumps(detail, ensure_ascii=False)[:120]}")
+    elif args.command == 'snapshot':
+        print(f"Snapshot at event {log.snapshot()}")
+    else:
+        from backend.ticket_store import ticket_key, ticket_partitions
+        store = ticket_partitions()
+        derived = log.tickets(workers=args.workers, reextract=args.reextract, use_snapshot=not args.reextract)
+        current = {ticket_key(t): t for t in store.load()}
+        changed = [t for t in derived if current.get(ticket_key(t)) != t]
+        missing = set(current) - {ticket_key(t) for t in derived}
+        print(f"Derived {len(derived)} tickets from {len(log)} events: "
+              f"{len(changed)} differ from the partitions, {len(missing)} only in the partitions")
+        if args.write:
+            from backend.partitions import month_of
+            months = {m for m in set(store.months()) | {month_of(t) for t in derived} if not store.is_sealed(m)}
+            store.write([t for t in derived if month_of(t) in months], months)
+            print(f"Rewrote {len(months)} ticket partitions (sealed months kept) - restart the server "
+                  f"to refresh its rollup / indexes")
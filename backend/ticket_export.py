@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Server-side ticket / email export for /api/export
+- Rows are produced one at a time from the stored records
+- CSV is yielded in small chunks (sent with chunked transfer encoding)
+- XLSX uses openpyxl's write-only workbook so cells are never held in memory
+- brand= is the BarChart brand (shop prefix); view= is the dashboard's CDC / MX filter
+  (ticket number prefix too), so an export matches the rows on screen
+"""
+
+import csv
+import io
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+from backend.ticket_index import parse_bound, ticket_ts
+from backend.ticket_rollup import brand_of
+
+TICKET_HEADERS = ['ticket_number', 'shop', 'description', 'date', 'problem', 'resolve_time',
+                  'ph_rm_os', 'solution', 'fu_action', 'handled_by', 'status']
+EMAIL_HEADERS = ['date', 'sender', 'subject', 'to', 'cc', 'filter_actions',
+                 'ticket_number', 'shop', 'description']
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+EXPORT_VIEWS = ('cdc', 'mx')
+CSV_CHUNK_ROWS = 200
+
+
+def email_row(email):
+    recipients = email.get('recipients', [])
+    row = dict(email)
+    row['to'] = '; '.join(r.get('name', '') for r in recipients if r.get('type') == 1)
+    row['cc'] = '; '.join(r.get('name', '') for r in recipients if r.get('type') == 2)
+    row['filter_actions'] = ', '.join(email.get('filter_actions', []))
+    return row
+
+
+def in_view(record, view):
+    """Same predicate as the dashboard's CDC / MX filter (dashboard.html filteredEmails)"""
+    extracted = record.get('extracted_data') or {}
+    ticket = record.get('ticket_number') or extracted.get('ticket_number') or ''
+    shop = record.get('shop') or extracted.get('shop') or ''
+    if view == 'mx':
+        return ticket.startswith('BZ')
+    if view == 'cdc':
+        return ticket.startswith(('HK', 'CDC', 'IN')) or shop.lower().startswith('cdc')
+    return True
+
+
+def iter_rows(records, headers, start=None, end=None, brand=None, to_row=None, view=None):
+    """Yield one list of cell values per record inside the date range / brand / dashboard view"""
+    brand = brand.upper() if brand else None
+    # The day bounds become epoch seconds once; each record is an integer comparison
+    lo = parse_bound(start and start.isoformat())
+    hi = parse_bound(end and end.isoformat(), end=True)
+    for record in records:
+        if start or end:
+            ts = ticket_ts(record)
+            if ts is None or (lo is not None and ts < lo) or (hi is not None and ts > hi):
+                continue
+        if brand and brand_of(record.get('shop')) != brand:
+            continue
+        if view and not in_view(record, view):
+            continue
+        row = to_row(record) if to_row else record
+        yield [str(row.get(h, '') or '') for h in headers]
+
+
+def iter_csv_chunks(headers, rows, chunk_rows=CSV_CHUNK_ROWS):
+    """Yield UTF-8 encoded CSV in chunks of `chunk_rows` rows (BOM first, for Excel)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    pending = 1
+    yield '\ufeff'.encode('utf-8')
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def write_xlsx(headers, rows, fileobj, title='Tickets'):
+    """Write rows to `fileobj` with a write-only (streaming) workbook"""
+    if Workbook is None:
+        raise RuntimeError("openpyxl is not installed - XLSX export unavailable")
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    ws.append(headers)
+    count = 0
+    for row in rows:
+        ws.append(row)
+        count += 1
+    wb.save(fileobj)
+    return count
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Date-range index over tickets
+- Ticket dates are normalised once to UTC epoch seconds (the `date_ts` field, set at
+  ingestion by stamp(), see timestamps.py)
+- Tickets are held sorted by date_ts; a range query is two bisects plus a slice
+- One index per monthly partition in TicketStore; also used by the date filter CLIs
+"""
+
+from bisect import bisect_left, bisect_right
+
+from backend.timestamps import DAY_SECONDS, day_of, normalize, parse, to_epoch
+
+
+def parse_bound(value, end=False):
+    """Range bound from a query / CLI argument. A date-only `end` covers the whole day.
+
+    Returns None for an empty value, raises ValueError for one that cannot be parsed.
+    """
+    if not value:
+        return None
+    ts, has_time = parse(value)
+    if ts is None:
+        raise ValueError(f"Invalid date '{value}' (use YYYY-MM-DD, YYYY-MM-DD HH:MM or DD-MM-YYYY)")
+    if end and not has_time:
+        ts += DAY_SECONDS - 1
+    return ts
+
+
+def stamp(ticket):
+    """Set ticket['date_ts'] from ticket['date'], and normalise the date to the display form"""
+    ts, text = normalize(ticket.get('date'))
+    ticket['date_ts'] = ts
+    if ts is not None:
+        ticket['date'] = text
+    return ticket
+
+
+def ticket_ts(ticket):
+    ts = ticket.get('date_ts')
+    if isinstance(ts, int):
+        return ts
+    # Tickets written before date_ts existed
+    return to_epoch(ticket.get('date'))
+
+
+class DateIndex:
+    def __init__(self, tickets=()):
+        entries = []
+        self.undated = 0
+        for ticket in tickets:
+            ts = ticket_ts(ticket)
+            if ts is None:
+                self.undated += 1
+            else:
+                entries.append((ts, ticket))
+        # Partitions are stored newest first, so this is close to linear
+        entries.sort(key=lambda e: e[0])
+        self.keys = [ts for ts, _ in entries]
+        self.tickets = [ticket for _, ticket in entries]
+        self.source = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, ticket):
+        ts = ticket_ts(ticket)
+        if ts is None:
+            self.undated += 1
+            return
+        pos = bisect_right(self.keys, ts)
+        self.keys.insert(pos, ts)
+        self.tickets.insert(pos, ticket)
+
+    def range(self, start=None, end=None):
+        """Tickets with start <= date_ts <= end (epoch seconds, either bound optional), oldest first"""
+        lo = bisect_left(self.keys, start) if start is not None else 0
+        hi = bisect_right(self.keys, end) if end is not None else len(self.keys)
+        return self.tickets[lo:hi]
+
+    def first_last(self):
+        if not self.tickets:
+            return None, None
+        return self.tickets[0].get('date'), self.tickets[-1].get('date')
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Ticket rollup tables for BarChart.html
+- Counts per day / ISO week / month x brand x shop x status
+- Kept up to date incrementally by merge_tickets and the server edit routes
+- Persisted next to the ticket partitions and validated against their size/mtime signature
+"""
+
+import json
+import os
+from datetime import date, timedelta
+
+from backend.atomic_io import write_json_atomic
+from backend.ticket_index import day_of, ticket_ts
+
+GRANULARITIES = ('day', 'week', 'month')
+DIMENSIONS = ('brand', 'shop', 'status')
+
+ROLLUP_FILE = os.path.join('database', 'ticket_rollup.json')
+
+
+def brand_of(shop):
+    """Same prefix rules as BarChart.html (CDC / MX / FW / OTHER)"""
+    shop = (shop or '').lower().strip()
+    if shop.startswith('cdc'):
+        return 'CDC'
+    if shop.startswith('mx'):
+        return 'MX'
+    if shop.startswith('fw'):
+        return 'FW'
+    return 'OTHER'
+
+
+def shop_key(shop):
+    """BarChart.html groups shops lower-cased, with unknown shops as ss999"""
+    shop = (shop or '').lower().strip()
+    if not shop or shop in ('unknown', 'n/a'):
+        return 'ss999'
+    return shop
+
+
+def parse_day(value):
+    """Return a date from 'YYYY-MM-DD...' or None"""
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except (TypeError, ValueError):
+        return None
+
+
+def period_of(day, granularity):
+    if granularity == 'day':
+        return day.isoformat()
+    if granularity == 'week':
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    return f"{day.year}-{day.month:02d}"
+
+
+def period_bounds(day, granularity):
+    """First and last day of the period containing `day`"""
+    if granularity == 'day':
+        return day, day
+    if granularity == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    start = day.replace(day=1)
+    next_month = (start + timedelta(days=32)).replace(day=1)
+    return start, next_month - timedelta(days=1)
+
+
+class TicketRollup:
+    def __init__(self):
+        # tables[granularity][period]["BRAND|shop|status"] = count
+        self.tables = {g: {} for g in GRANULARITIES}
+        self.source = None
+
+    @staticmethod
+    def key_of(ticket):
+        day = day_of(ticket_ts(ticket))
+        if day is None:
+            return None
+        cell = f"{brand_of(ticket.get('shop'))}|{shop_key(ticket.get('shop'))}|{ticket.get('status') or 'in progress'}"
+        return day, cell
+
+    def _apply(self, key, delta):
+        if key is None:
+            return
+        day, cell = key
+        for g in GRANULARITIES:
+            bucket = self.tables[g].setdefault(period_of(day, g), {})
+            count = bucket.get(cell, 0) + delta
+            if count > 0:
+                bucket[cell] = count
+            else:
+                bucket.pop(cell, None)
+                if not bucket:
+                    del self.tables[g][period_of(day, g)]
+
+    def add(self, ticket):
+        self._apply(self.key_of(ticket), 1)
+
+    def remove(self, ticket):
+        self._apply(self.key_of(ticket), -1)
+
+    def update(self, old_key, ticket):
+        """Move a ticket from the cell it was counted in (`old_key`) to its current one"""
+        new_key = self.key_of(ticket)
+        if old_key != new_key:
+            self._apply(old_key, -1)
+            self._apply(new_key, 1)
+
+    def rebuild(self, tickets):
+        self.tables = {g: {} for g in GRANULARITIES}
+        for ticket in tickets:
+            self.add(ticket)
+
+    def _cells_between(self, start, end):
+        """Yield (period_day, cell, count) for whole days start..end using the coarsest tables"""
+        day = start
+        while day <= end:
+            for g in ('month', 'week', 'day'):
+                p_start, p_end = period_bounds(day, g)
+                if p_start == day and p_end <= end:
+                    for cell, count in self.tables[g].get(period_of(day, g), {}).items():
+                        yield day, cell, count
+                    day = p_end + timedelta(days=1)
+                    break
+
+    def query(self, granularity='day', start=None, end=None, brand=None, shop=None, group_by=DIMENSIONS):
+        """Counts grouped by period and the requested dimensions for start..end (inclusive)"""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+        group_by = [d for d in DIMENSIONS if d in group_by]
+
+        days = [parse_day(p) for p in self.tables['day']]
+        if not days:
+            return []
+        start = start or min(days)
+        end = end or max(days)
+
+        totals = {}
+        day = start
+        while day <= end:
+            # Each output period is summed from whole-period tables where it is
+            # fully inside the range and from day tables at the edges
+            p_start, p_end = period_bounds(day, granularity)
+            chunk_end = min(p_end, end)
+            period = period_of(day, granularity)
+            for _, cell, count in self._cells_between(day, chunk_end):
+                cell_brand, cell_shop, cell_status = cell.split('|', 2)
+                if brand and cell_brand != brand.upper():
+                    continue
+                if shop and cell_shop != shop_key(shop):
+                    continue
+                values = {"brand": cell_brand, "shop": cell_shop, "status": cell_status}
+                group = (period,) + tuple(values[d] for d in group_by)
+                totals[group] = totals.get(group, 0) + count
+            day = chunk_end + timedelta(days=1)
+
+        buckets = []
+        for group, count in sorted(totals.items()):
+            row = {"period": group[0]}
+            row.update(zip(group_by, group[1:]))
+            row["count"] = count
+            buckets.append(row)
+        return buckets
+
+    def save(self, path, source):
+        """`source` is the signature of the ticket data these tables were built from"""
+        self.source = source
+        write_json_atomic(path, {"source": self.source, "tables": self.tables})
+
+    @classmethod
+    def load(cls, path):
+        rollup = cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        rollup.source = data.get('source')
+        for g in GRANULARITIES:
+            rollup.tables[g] = data.get('tables', {}).get(g, {})
+        return rollup
+
+
+def load_rollup(source, rollup_path, load_tickets):
+    """Load the saved rollup if it was built from `source`, otherwise rebuild it from load_tickets()"""
+    try:
+        rollup = TicketRollup.load(rollup_path)
+        if rollup.source and rollup.source == source:
+            return rollup
+    except (OSError, ValueError):
+        pass
+
+    rollup = TicketRollup()
+    rollup.rebuild(load_tickets())
+    return rollup
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Full-text search over tickets for /api/tickets/search
+- Text is NFKC-normalised and lower-cased (full-width ３ -> 3, MON -> mon)
+- CJK runs are indexed as single characters plus overlapping bigrams, Latin / digit runs as words
+- A query matches tickets containing every query token (bigrams for CJK, word prefixes for Latin)
+- Results are ranked with BM25; ticket number and shop hits weigh more than description hits
+- The index is synced per monthly partition and only re-indexes tickets whose text changed
+"""
+
+import math
+import re
+import unicodedata
+from bisect import bisect_left
+
+# Kana, CJK ideographs (incl. extension A and compatibility) and Hangul
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_RUN = re.compile(f'[{_CJK}]+|[0-9a-z]+')
+_IS_CJK = re.compile(f'[{_CJK}]')
+
+# field -> weight (term frequency multiplier)
+FIELDS = {
+    'ticket_number': 3,
+    'shop': 3,
+    'description': 1,
+    'problem': 1,
+    'solution': 1,
+    'fu_action': 1,
+}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def _runs(text):
+    return _RUN.findall(unicodedata.normalize('NFKC', str(text or '')).lower())
+
+
+def tokenize(text):
+    """Index tokens: CJK characters and bigrams, Latin / digit words"""
+    tokens = []
+    for run in _runs(text):
+        if _IS_CJK.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def query_terms(text):
+    """Query tokens: CJK bigrams (a lone character as itself) and Latin words, in order"""
+    terms = []
+    for run in _runs(text):
+        if _IS_CJK.match(run):
+            terms.extend([run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)])
+        else:
+            terms.append(run)
+    return list(dict.fromkeys(terms))
+
+
+def _doc_terms(ticket):
+    counts = {}
+    for field, weight in FIELDS.items():
+        for token in tokenize(ticket.get(field)):
+            counts[token] = counts.get(token, 0) + weight
+    return counts
+
+
+class SearchIndex:
+    def __init__(self, key):
+        self.key = key
+        self.postings = {}      # token -> {doc key: weighted tf}
+        self.docs = {}          # doc key -> ticket
+        self.doc_terms = {}     # doc key -> {token: tf}
+        self.doc_len = {}       # doc key -> total weighted tf
+        self.total_len = 0
+        self.month_docs = {}    # month -> set of doc keys
+        self.month_source = {}  # month -> partition signature the month was indexed from
+        self._latin_vocab = None
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, ticket):
+        key = self.key(ticket)
+        terms = _doc_terms(ticket)
+        if self.doc_terms.get(key) == terms:
+            self.docs[key] = ticket
+            return
+        self.remove(key)
+        self.docs[key] = ticket
+        self.doc_terms[key] = terms
+        length = sum(terms.values())
+        self.doc_len[key] = length
+        self.total_len += length
+        for token, tf in terms.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                self._latin_vocab = None
+            posting[key] = tf
+
+    def remove(self, key):
+        terms = self.doc_terms.pop(key, None)
+        self.docs.pop(key, None)
+        if terms is None:
+            return
+        self.total_len -= self.doc_len.pop(key)
+        for token in terms:
+            posting = self.postings[token]
+            del posting[key]
+            if not posting:
+                del self.postings[token]
+                self._latin_vocab = None
+
+    def sync_month(self, month, tickets, source):
+        """Bring one month in line with its partition; unchanged tickets are not re-indexed"""
+        keys = {self.key(t) for t in tickets}
+        for key in self.month_docs.get(month, set()) - keys:
+            self.remove(key)
+        for ticket in tickets:
+            self.add(ticket)
+        self.month_docs[month] = keys
+        self.month_source[month] = source
+
+    def drop_month(self, month):
+        for key in self.month_docs.pop(month, set()):
+            self.remove(key)
+        self.month_source.pop(month, None)
+
+    def _expand(self, term):
+        """A Latin query word matches every indexed word it is a prefix of"""
+        if _IS_CJK.match(term):
+            return [term] if term in self.postings else []
+        if self._latin_vocab is None:
+            self._latin_vocab = sorted(t for t in self.postings if not _IS_CJK.match(t))
+        vocab = self._latin_vocab
+        i = bisect_left(vocab, term)
+        matches = []
+        while i < len(vocab) and vocab[i].startswith(term):
+            matches.append(vocab[i])
+            i += 1
+        return matches
+
+    def search(self, text, limit=50):
+        """(match count, [(score, ticket)]) for tickets containing every query term, best first"""
+        terms = query_terms(text)
+        if not terms or not self.docs:
+            return 0, []
+
+        expanded = []
+        for term in terms:
+            tokens = self._expand(term)
+            if not tokens:
+                return 0, []
+            expanded.append(tokens)
+
+        # Intersect starting from the rarest term
+        expanded.sort(key=lambda tokens: sum(len(self.postings[t]) for t in tokens))
+        candidates = None
+        for tokens in expanded:
+            docs = set()
+            for token in tokens:
+                docs.update(self.postings[token])
+            candidates = docs if candidates is None else candidates & docs
+            if not candidates:
+                return 0, []
+
+        n = len(self.docs)
+        avg_len = self.total_len / n
+        scores = dict.fromkeys(candidates, 0.0)
+        for tokens in expanded:
+            for token in tokens:
+                posting = self.postings[token]
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for key in candidates:
+                    tf = posting.get(key)
+                    if tf:
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[key] / avg_len)
+                        scores[key] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        # Best score first; equal scores keep the newest ticket first (sort is stable)
+        ranked = sorted(scores.items(), key=lambda kv: self.docs[kv[0]].get('date', ''), reverse=True)
+        ranked.sort(key=lambda kv: kv[1], reverse=True)
+        if limit:
+            ranked = ranked[:limit]
+        return len(scores), [(round(score, 4), self.docs[key]) for key, score in ranked]
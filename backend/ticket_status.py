@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Automatic ticket status transitions from scanned notification emails
+- Rules recognise transition events in an email's subject: assigned, resolved, closed,
+  reopened (MX "Incident ... has been resolved", bracketed [Resolved] / 【已完成】 tags, ...)
+- A rule may be limited to some brands (brand of the ticket's shop, see ticket_rollup.brand_of)
+  and to a sender; the first matching rule wins
+- TRANSITIONS is the state machine: an event only moves a ticket from the states it lists
+  (a late "assigned" never reopens a completed ticket, "reopened" only acts on closed ones)
+- OpenTickets indexes the status of every ticket in the writable months (sealed months only
+  hold closed tickets and are read-only), so each event is one dict lookup
+- The scan's emails stream through the machine oldest first; the changes are applied through
+  TicketStore.batch, batch_size tickets per persist, and logged as "edit" events
+- Configurable through database/status_rules.json (any key of DEFAULT_CONFIG)
+
+Usage:
+    python backend/ticket_status.py replay [--write]    # run every logged email through the rules
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.email_threads import subject_tickets
+from backend.ticket_rollup import brand_of
+
+CONFIG_FILE = os.path.join('database', 'status_rules.json')
+
+OPEN = 'in progress'
+CLOSED = 'completed'
+
+# event -> {status before: status after}
+TRANSITIONS = {
+    "assigned": {OPEN: OPEN},
+    "resolved": {OPEN: CLOSED},
+    "closed": {OPEN: CLOSED},
+    "reopened": {CLOSED: OPEN},
+}
+
+DEFAULT_CONFIG = {
+    "enabled": True,
+    "batch_size": 200,
+    "rules": [
+        {"event": "reopened", "brands": ["MX"], "subject": r"^Incident \S+ has been re-?opened"},
+        {"event": "resolved", "brands": ["MX"], "subject": r"^Incident \S+ has been resolved"},
+        {"event": "closed", "brands": ["MX"], "subject": r"^Incident \S+ has been (closed|cancelled)"},
+        {"event": "assigned", "brands": ["MX"], "subject": r"^Incident \S+ has been assigned to"},
+        {"event": "reopened", "subject": r"[\[【]\s*(re-?opened|重開|重新開啟)\s*[\]】]"},
+        {"event": "resolved", "subject": r"[\[【]\s*(resolved|已解決|已完成)\s*[\]】]"},
+        {"event": "closed", "subject": r"[\[【]\s*(closed|已結案|已關閉)\s*[\]】]"},
+    ],
+}
+
+
+def load_config(path=CONFIG_FILE):
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    return config
+
+
+class OpenTickets:
+    """Status and brand of every ticket in the writable months, by ticket number"""
+
+    def __init__(self, partitions):
+        self.tickets = {}
+        for month in partitions.months():
+            if partitions.is_sealed(month):
+                continue
+            for ticket in partitions.read(month):
+                self.tickets[ticket.get('ticket_number')] = [ticket.get('status') or OPEN, brand_of(ticket.get('shop'))]
+
+    def __contains__(self, number):
+        return number in self.tickets
+
+    def status(self, number):
+        entry = self.tickets.get(number)
+        return entry[0] if entry else None
+
+    def brand(self, number):
+        entry = self.tickets.get(number)
+        return entry[1] if entry else None
+
+    def set_status(self, number, status):
+        self.tickets[number][0] = status
+
+    def open_count(self):
+        return sum(1 for status, _ in self.tickets.values() if status == OPEN)
+
+
+class StatusMachine:
+    def __init__(self, tickets, config=None):
+        self.tickets = tickets
+        self.config = config or load_config()
+        self._rules = [(rule['event'], set(rule.get('brands') or ()),
+                        re.compile(rule['sender'], re.IGNORECASE) if rule.get('sender') else None,
+                        re.compile(rule['subject'], re.IGNORECASE))
+                       for rule in self.config['rules']]
+
+    def event_of(self, email, brand):
+        subject = str(email.get('subject') or '')
+        sender = str(email.get('sender') or '')
+        for event, brands, sender_rule, subject_rule in self._rules:
+            if brands and brand not in brands:
+                continue
+            if sender_rule is not None and not sender_rule.search(sender):
+                continue
+            if subject_rule.search(subject):
+                return event
+        return None
+
+    def ticket_of(self, email, linked=None):
+        """The ticket an email is about: its link from create_tickets.py, or a ticket named in its subject"""
+        if linked:
+            return linked if linked in self.tickets else None
+        return next((t for t in subject_tickets(email) if t in self.tickets), None)
+
+    def transitions(self, emails):
+        """Status changes for a stream of (email, linked ticket number or None), in stream order"""
+        for email, linked in emails:
+            number = self.ticket_of(email, linked)
+            if number is None:
+                continue
+            event = self.event_of(email, self.tickets.brand(number))
+            if event is None:
+                continue
+            before = self.tickets.status(number)
+            after = TRANSITIONS[event].get(before)
+            if after is None or after == before:
+                continue
+            self.tickets.set_status(number, after)
+            yield {"ticket_number": number, "event": event, "from": before, "to": after,
+                   "date": email.get('date'), "subject": str(email.get('subject') or '')[:120]}
+
+    def run(self, emails, apply):
+        """Feed the stream through the machine; apply(changes) gets {ticket number: status} batches.
+
+        Returns the transitions that were applied.
+        """
+        applied, pending, batch = [], {}, []
+        size = max(1, int(self.config['batch_size']))
+        for transition in self.transitions(emails):
+            pending[transition['ticket_number']] = transition['to']
+            batch.append(transition)
+            if len(pending) >= size:
+                applied.extend(self._flush(apply, pending, batch))
+                pending, batch = {}, []
+        if pending:
+            applied.extend(self._flush(apply, pending, batch))
+        return applied
+
+    @staticmethod
+    def _flush(apply, pending, batch):
+        failed = apply(pending)
+        return [t for t in batch if t['ticket_number'] not in failed]
+
+
+def store_applier(store):
+    """apply() for StatusMachine.run writing through a TicketStore; returns the tickets that failed"""
+    def apply(changes):
+        _, results = store.batch([{"op": "update", "ticket": {"ticket_number": number, "status": status}}
+                                  for number, status in changes.items()])
+        numbers = list(changes)
+        failed = {numbers[r['index']] for r in results if r['status'] != 'success'}
+        for result in results:
+            if result['status'] != 'success':
+                print(f"  Status change failed: {numbers[result['index']]} - {result['message']}")
+        return failed
+    return apply
+
+
+def apply_status_transitions(store, emails, config=None):
+    """Run (email, linked ticket number) pairs, oldest first, through the rules and apply the changes"""
+    config = config or load_config()
+    if not config['enabled']:
+        return []
+    machine = StatusMachine(OpenTickets(store.partitions), config)
+    return machine.run(emails, store_applier(store))
+
+
+if __name__ == "__main__":
+    from backend.email_log import EmailLog
+    from backend.ticket_duplicates import DUPLICATES_FILE
+    from backend.ticket_events import TicketEventLog
+    from backend.ticket_rollup import ROLLUP_FILE
+    from backend.ticket_store import TicketStore, ticket_partitions
+
+    parser = argparse.ArgumentParser(description="Ticket status transitions from notification emails")
+    sub = parser.add_subparsers(dest='command', required=True)
+    replay = sub.add_parser('replay', help="run every logged email through the rules (oldest first)")
+    replay.add_argument('--write', action='store_true', help="apply the changes (default: only list them)")
+    args = parser.parse_args()
+
+    log = EmailLog()
+    entries = sorted(log.entries(), key=lambda e: (e.received is None, e.received or 0))
+    stream = ((log.record(e.position), e.ticket or None) for e in entries)
+    store = TicketStore(ticket_partitions(), ROLLUP_FILE, DUPLICATES_FILE, TicketEventLog())
+    tickets = OpenTickets(store.partitions)
+    machine = StatusMachine(tickets)
+    print(f"{len(tickets.tickets)} tickets in writable months, {tickets.open_count()} open")
+    if args.write:
+        transitions = machine.run(stream, store_applier(store))
+    else:
+        transitions = list(machine.transitions(stream))
+    for t in transitions:
+        print(f"  {t['ticket_number']:16} {t['event']:9} {t['from']} -> {t['to']}   {t['subject'][:60]}")
+    print(f"{len(transitions)} status changes{'' if args.write else ' (not applied, use --write)'}")
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Ticket store used by server.py and create_tickets.py
+- Tickets are kept in monthly partitions (database/tickets/YYYY-MM.json, see partitions.py)
+- One lock around every read-modify-write; an edit loads and rewrites only its ticket's month
+- Single-ticket and batch updates / creates with one persist per call
+- Keeps the rollup tables, the per-month date-range indexes, the search index and the
+  duplicate index in step with every change
+- Readers of the full list (ticket.json, exports) get an immutable TicketSnapshot by version
+  without taking the lock, so they never wait for a write or a create_tickets.py merge
+- With an event log (ticket_events.py) every create / edit / clear is logged before it is written
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from backend.partitions import PartitionedStore, SealedPartitionError, month_of
+from backend.ticket_duplicates import DuplicateIndex, load_duplicates
+from backend.ticket_index import DateIndex, day_of, stamp
+from backend.ticket_rollup import TicketRollup, load_rollup
+from backend.ticket_search import SearchIndex
+
+TICKET_DIR = os.path.join('database', 'tickets')
+LEGACY_TICKET_FILE = os.path.join('database', 'ticket.json')
+
+SNAPSHOT_RETRIES = 5
+SNAPSHOT_WAIT = 0.05    # seconds between retries while a write is in progress (first read only)
+
+# Fields the dashboard is allowed to edit on an existing ticket
+EDITABLE_FIELDS = ('solution', 'resolve_time', 'ph_rm_os', 'fu_action', 'problem',
+                   'handled_by', 'status', 'ticket_number')
+
+TICKET_FIELDS = ('shop', 'description', 'date', 'problem', 'resolve_time', 'ph_rm_os',
+                 'solution', 'fu_action', 'handled_by', 'status')
+
+
+class TicketStoreError(Exception):
+    pass
+
+
+def ticket_key(ticket):
+    return ticket.get('id') or ticket.get('ticket_number')
+
+
+def month_closed(tickets):
+    """A month may be sealed once none of its tickets is still open"""
+    return all((t.get('status') or 'in progress') != 'in progress' for t in tickets)
+
+
+def ticket_partitions(root=''):
+    """Partitioned ticket storage under `root` (the project root; '' for the working directory)"""
+    return PartitionedStore(os.path.join(root, TICKET_DIR), ticket_key,
+                            legacy_path=os.path.join(root, LEGACY_TICKET_FILE), retire_legacy=True)
+
+
+class TicketSnapshot:
+    """One version of the full ticket list. Shared by every reader - never mutate it."""
+
+    def __init__(self, version, signature, tickets):
+        self.version = version
+        self.signature = signature      # partitions.signature() the tickets were read at
+        self.tickets = tickets
+        self._body = None
+        self._body_lock = threading.Lock()
+
+    def body(self):
+        """The list as ticket.json bytes, serialised once per version"""
+        with self._body_lock:
+            if self._body is None:
+                self._body = json.dumps(self.tickets, indent=2, ensure_ascii=False).encode('utf-8')
+            return self._body
+
+
+class TicketStore:
+    def __init__(self, partitions, rollup_path, duplicates_path, events=None):
+        self.partitions = partitions
+        self.rollup_path = rollup_path
+        self.duplicates_path = duplicates_path
+        self.events = events
+        self.lock = threading.RLock()
+        self._rollup = None
+        self._duplicates = None
+        self._month_indexes = {}
+        self._search = None
+        self._snapshot = None
+        self._snapshot_build = threading.Lock()
+        self._write_seq = 0
+        self._write_depth = 0
+
+    def load(self):
+        """Every ticket, newest month first"""
+        with self.lock:
+            return self.partitions.load()
+
+    def count(self):
+        with self.lock:
+            return self.partitions.count()
+
+    @contextmanager
+    def writing(self):
+        """Hold the lock for a write (also one made by another process, e.g. create_tickets.py).
+
+        The write sequence is odd while it runs, so snapshot readers know to keep the
+        previous version instead of reading partitions that are half rewritten.
+        """
+        with self.lock:
+            self._write_depth += 1
+            if self._write_depth == 1:
+                self._write_seq += 1
+            try:
+                yield
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._write_seq += 1
+
+    def snapshot(self):
+        """The current TicketSnapshot, without taking the store lock.
+
+        Partition files are read optimistically and kept only if no write started or
+        finished meanwhile (write sequence and partition signature unchanged). During a
+        write, or while another thread rebuilds, readers get the previous version.
+        """
+        current = self._snapshot
+        if current is not None and (self._write_seq % 2 or current.signature == self.partitions.signature()):
+            return current
+        if not self._snapshot_build.acquire(blocking=current is None):
+            return current
+        try:
+            current = self._snapshot
+            for _ in range(SNAPSHOT_RETRIES):
+                seq = self._write_seq
+                before = self.partitions.signature()
+                if current is not None and (seq % 2 or current.signature == before):
+                    return current
+                if seq % 2:
+                    time.sleep(SNAPSHOT_WAIT)
+                    continue
+                try:
+                    tickets = self.partitions.load()
+                except (OSError, ValueError):
+                    continue    # a partition was sealed / removed between listing and reading it
+                if self._write_seq == seq and self.partitions.signature() == before:
+                    version = current.version + 1 if current is not None else 1
+                    self._snapshot = current = TicketSnapshot(version, before, tickets)
+                    return current
+            if current is not None:
+                return current
+            # No earlier version to fall back on - take one read under the lock
+            with self.lock:
+                self._snapshot = TicketSnapshot(1, self.partitions.signature(), self.partitions.load())
+                return self._snapshot
+        finally:
+            self._snapshot_build.release()
+
+    def _save(self, tickets, months, rollup, duplicates, events=()):
+        with self.writing():
+            if events and self.events is not None:
+                self.events.append(events)
+            try:
+                self.partitions.write(tickets, months)
+            except SealedPartitionError as e:
+                self._rollup = None
+                self._duplicates = None
+                raise TicketStoreError(f"Month {e}")
+            signature = self.partitions.signature()
+            rollup.save(self.rollup_path, signature)
+            duplicates.save(self.duplicates_path, signature)
+        if self._search is not None:
+            # Re-index the written months from memory instead of re-reading them
+            by_month = {month: [] for month in months}
+            for ticket in tickets:
+                by_month[month_of(ticket)].append(ticket)
+            for month, rows in by_month.items():
+                self._search.sync_month(month, rows, self.partitions.partition_signature(month))
+
+    def rollup(self):
+        """Rollup tables matching the current partitions (reloaded if they changed underneath us)"""
+        with self.lock:
+            signature = self.partitions.signature()
+            if self._rollup is None or self._rollup.source != signature:
+                self._rollup = load_rollup(signature, self.rollup_path, self.partitions.load)
+                if self._rollup.source != signature:
+                    self._rollup.save(self.rollup_path, signature)
+            return self._rollup
+
+    def duplicates(self):
+        """Duplicate index matching the current partitions (reloaded if they changed underneath us)"""
+        with self.lock:
+            signature = self.partitions.signature()
+            if self._duplicates is None or self._duplicates.source != signature:
+                self._duplicates = load_duplicates(signature, self.duplicates_path, self.partitions.load)
+                if self._duplicates.source != signature:
+                    self._duplicates.save(self.duplicates_path, signature)
+            return self._duplicates
+
+    def get(self, keys):
+        """{key: ticket} for the given ids / ticket numbers, reading only their months"""
+        with self.lock:
+            manifest = self.partitions.manifest()
+            wanted = set(keys)
+            found = {}
+            for month in {manifest[k] for k in wanted if k in manifest}:
+                for ticket in self.partitions.read(month):
+                    if ticket_key(ticket) in wanted:
+                        found[ticket_key(ticket)] = ticket
+            return found
+
+    def _month_index(self, month):
+        signature = self.partitions.partition_signature(month)
+        index = self._month_indexes.get(month)
+        if index is None or index.source != signature:
+            index = DateIndex(self.partitions.read(month))
+            index.source = signature
+            self._month_indexes[month] = index
+        return index
+
+    def date_range(self, start=None, end=None):
+        """Tickets with start <= date_ts <= end (epoch seconds), oldest first.
+
+        Fans out over the monthly partitions overlapping the range; a month's
+        index is rebuilt only when that partition changes.
+        """
+        with self.lock:
+            months = self.partitions.months_between(day_of(start), day_of(end))
+            tickets = []
+            for month in months:
+                tickets.extend(self._month_index(month).range(start, end))
+            return tickets
+
+    def search(self, text, limit=50):
+        """(match count, [(score, ticket)]) - see ticket_search.SearchIndex.search"""
+        with self.lock:
+            if self._search is None:
+                self._search = SearchIndex(ticket_key)
+            # Months changed underneath us (create_tickets.py merges) are re-synced;
+            # within a month only tickets whose text changed are re-indexed
+            months = self.partitions.months()
+            for month in set(self._search.month_source) - set(months):
+                self._search.drop_month(month)
+            for month in months:
+                signature = self.partitions.partition_signature(month)
+                if self._search.month_source.get(month) != signature:
+                    self._search.sync_month(month, self.partitions.read(month), signature)
+            return self._search.search(text, limit)
+
+    def _apply_update(self, ticket, changes, rollup, duplicates):
+        """Apply the editable fields of `changes`; returns the "edit" event (None if nothing changed)"""
+        old_key = rollup.key_of(ticket)
+        old_number = ticket.get('ticket_number')
+        previous = {}
+        for field in EDITABLE_FIELDS:
+            if field in changes and changes[field] != ticket.get(field):
+                previous[field] = ticket.get(field)
+                ticket[field] = changes[field]
+        rollup.update(old_key, ticket)
+        if ticket.get('ticket_number') != old_number:
+            duplicates.remove(old_number)
+            duplicates.add(ticket)
+        if not previous:
+            return None
+        event = {"type": "edit", "ticket": ticket.get('ticket_number'),
+                 "changes": {f: ticket[f] for f in previous}, "previous": previous}
+        if ticket.get('ticket_number') != old_number:
+            event['from'] = old_number
+        return event
+
+    def _build_ticket(self, data, index):
+        """New ticket with defaults; raises TicketStoreError if its number is taken"""
+        ticket_number = (data.get('ticket_number') or '').strip()
+        # Ticket number is optional - generate a unique temporary one
+        if not ticket_number:
+            ticket_number = "TEMP-" + datetime.now().strftime("%Y%m%d%H%M%S")
+            base, n = ticket_number, 1
+            while ticket_number in index:
+                ticket_number = f"{base}-{n}"
+                n += 1
+        if ticket_number in index:
+            raise TicketStoreError(f"Ticket {ticket_number} already exists")
+
+        now = datetime.now().strftime("%Y-%m-%d %H:%M")
+        created = {"ticket_number": ticket_number}
+        for field in TICKET_FIELDS:
+            created[field] = (data.get(field) or '').strip()
+        created['date'] = created['date'] or now
+        created['status'] = created['status'] or 'in progress'
+        return stamp(created)
+
+    def _check_writable(self, month):
+        if self.partitions.is_sealed(month):
+            raise TicketStoreError(f"Month {month} is sealed (read-only)")
+
+    def update_ticket(self, changes):
+        """Update one ticket by id / ticket_number. Unknown tickets are ignored."""
+        with self.lock:
+            wanted = ticket_key(changes)
+            month = self.partitions.manifest().get(wanted)
+            if month is None:
+                return
+            self._check_writable(month)
+            tickets = self.partitions.read(month)
+            rollup = self.rollup()
+            duplicates = self.duplicates()
+            events = []
+            for ticket in tickets:
+                if ticket_key(ticket) == wanted:
+                    events.append(self._apply_update(ticket, changes, rollup, duplicates))
+                    break
+            self._save(tickets, [month], rollup, duplicates, [e for e in events if e])
+
+    def add_ticket(self, data):
+        with self.lock:
+            created = self._build_ticket(data, self.partitions.manifest())
+            month = month_of(created)
+            self._check_writable(month)
+            tickets = self.partitions.read(month)
+            rollup = self.rollup()
+            duplicates = self.duplicates()
+            tickets.append(created)
+            rollup.add(created)
+            duplicates.add(created)
+            self._save(tickets, [month], rollup, duplicates,
+                       [{"type": "create", "ticket": created['ticket_number'], "state": dict(created)}])
+            return created
+
+    def batch(self, items, atomic=False):
+        """Apply a list of {"op": "update"|"create", "ticket": {...}} under one lock with one save.
+
+        Only the months the items touch are loaded and rewritten.
+        Returns (persisted, results). With atomic=True nothing is saved if any item fails.
+        """
+        with self.lock:
+            manifest = self.partitions.manifest()
+            rollup = self.rollup()
+            duplicates = self.duplicates()
+            loaded = {}   # month -> tickets of that partition
+            by_key = {}
+            numbers = set(manifest)
+            results = []
+            events = []
+            failed = False
+
+            def month_tickets(month):
+                if month not in loaded:
+                    self._check_writable(month)
+                    loaded[month] = self.partitions.read(month)
+                    by_key.update((ticket_key(t), t) for t in loaded[month])
+                return loaded[month]
+
+            for i, item in enumerate(items):
+                try:
+                    if not isinstance(item, dict):
+                        raise TicketStoreError("Item must be an object with 'op' and 'ticket'")
+                    op = item.get('op', 'update')
+                    data = item.get('ticket') or {}
+                    if not isinstance(data, dict):
+                        raise TicketStoreError("'ticket' must be an object")
+                    if op == 'update':
+                        month = manifest.get(ticket_key(data))
+                        if month is not None:
+                            month_tickets(month)
+                        ticket = by_key.get(ticket_key(data))
+                        if ticket is None:
+                            raise TicketStoreError(f"Ticket {ticket_key(data)} not found")
+                        event = self._apply_update(ticket, data, rollup, duplicates)
+                        if event:
+                            events.append(event)
+                        by_key[ticket_key(ticket)] = ticket
+                        numbers.add(ticket.get('ticket_number'))
+                    elif op == 'create':
+                        ticket = self._build_ticket(data, numbers)
+                        month_tickets(month_of(ticket)).append(ticket)
+                        rollup.add(ticket)
+                        duplicates.add(ticket)
+                        events.append({"type": "create", "ticket": ticket['ticket_number'], "state": dict(ticket)})
+                        by_key[ticket_key(ticket)] = ticket
+                        numbers.add(ticket['ticket_number'])
+                    else:
+                        raise TicketStoreError(f"Unknown op '{op}'")
+                    results.append({"index": i, "status": "success", "ticket_number": ticket['ticket_number']})
+                except TicketStoreError as e:
+                    failed = True
+                    results.append({"index": i, "status": "error", "message": str(e)})
+                    if atomic:
+                        break
+
+            if failed and atomic:
+                # The in-memory rollup / duplicate index already saw part of the batch - reload them from disk
+                self._rollup = None
+                self._duplicates = None
+                return False, results
+
+            if any(r['status'] == 'success' for r in results):
+                self._save([t for tickets in loaded.values() for t in tickets], loaded, rollup, duplicates, events)
+            return True, results
+
+    def seal(self):
+        """Seal closed months past the retention window (see partitions.SEAL_AFTER_MONTHS)"""
+        with self.writing():
+            return self.partitions.seal(closed=month_closed)
+
+    def clear(self):
+        with self.writing():
+            if self.events is not None:
+                self.events.append([{"type": "clear", "ticket": ''}])
+            self.partitions.clear()
+            self._search = None
+            self._rollup = TicketRollup()
+            self._duplicates = DuplicateIndex()
+            signature = self.partitions.signature()
+            self._rollup.save(self.rollup_path, signature)
+            self._duplicates.save(self.duplicates_path, signature)
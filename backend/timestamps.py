@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Timestamp normalisation, done once when a record enters the system
+- parse() turns any date we receive into UTC epoch seconds: Outlook ReceivedTime
+  ("2026-02-26 10:35:56.388000+00:00"), ISO with T / Z, dashboard and ticket dates
+  ("2026-02-26 10:35", "2026-02-26T10:35"), and the day-first forms typed into the
+  filter CLIs ("26-02-2026", "26/02/2026 10:35")
+- A value with a UTC offset is converted to UTC; a value without one is taken as UTC
+  already (tickets have always stored the email's wall-clock time, so their epochs
+  don't move)
+- The fast path is one regex match and integer arithmetic, no strptime; results are
+  LRU-cached, so the same few thousand date strings are parsed once per process
+- display() is the "YYYY-MM-DD HH:MM" string tickets store; date_ts (ticket_index.stamp)
+  is what sorts, range filters and rollups compare
+
+Usage:
+    python backend/timestamps.py "2026-02-26 10:35:56.388000+08:00" 26/02/2026
+"""
+
+import calendar
+import re
+import sys
+from datetime import datetime, timezone
+from functools import lru_cache
+
+PARSE_CACHE_SIZE = 65536
+DAY_SECONDS = 24 * 60 * 60
+DISPLAY_FORMAT = '%Y-%m-%d %H:%M'
+
+ISO = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})'
+                 r'(?:[ T](\d{1,2}):(\d{2})(?::(\d{2})(?:\.\d+)?)?)?'
+                 r'\s*(Z|[+-]\d{2}:?\d{2})?$', re.IGNORECASE)
+DAY_FIRST = re.compile(r'(\d{1,2})[-/](\d{1,2})[-/](\d{4})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?$')
+
+
+def _offset(text):
+    if not text or text in 'Zz':
+        return 0
+    sign = -1 if text[0] == '-' else 1
+    digits = text[1:].replace(':', '')
+    return sign * (int(digits[:2]) * 3600 + int(digits[2:]) * 60)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse(value):
+    match = ISO.match(value)
+    if match:
+        year, month, day, hour, minute, second, offset = match.groups()
+    else:
+        match = DAY_FIRST.match(value)
+        if not match:
+            return None, False
+        day, month, year, hour, minute, second = match.groups()
+        offset = None
+    try:
+        # Validates the fields (month 13, 30 February ...) before the arithmetic
+        dt = datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0))
+    except ValueError:
+        return None, False
+    return calendar.timegm(dt.timetuple()) - _offset(offset), hour is not None
+
+
+def parse(value):
+    """(UTC epoch seconds, has a time of day) for a date string; (None, False) if it isn't one"""
+    if value is None:
+        return None, False
+    return _parse(str(value).strip())
+
+
+def to_epoch(value):
+    return parse(value)[0]
+
+
+def display(ts):
+    """Ticket date string of an epoch-seconds value"""
+    return datetime.fromtimestamp(ts, timezone.utc).strftime(DISPLAY_FORMAT)
+
+
+def normalize(value):
+    """(epoch seconds, display string) for an incoming date; unparseable values keep their text"""
+    ts = to_epoch(value)
+    if ts is None:
+        return None, str(value or '')
+    return ts, display(ts)
+
+
+def day_of(ts):
+    """Calendar date (UTC) of an epoch-seconds value (None stays None)"""
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts, timezone.utc).date()
+
+
+def cache_info():
+    return _parse.cache_info()
+
+
+if __name__ == "__main__":
+    for arg in sys.argv[1:]:
+        ts, text = normalize(arg)
+        print(f"{arg!r:45} -> {ts}  {text}")
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+WhatsApp chat export import: fills resolve_time, ph_rm_os, solution and fu_action
+- Reads the .txt export or the .zip WhatsApp makes (with media), line by line - a multi-MB
+  chat is never loaded whole
+- Android ("26/02/2026, 10:35 - Alex: ...") and iOS ("[26/02/2026, 10:35:12] Alex: ...")
+  headers; a message runs until the next header line
+- TicketMatcher indexes the tickets of the writable months by ticket number and by shop code
+  (SS09, MX2224, cdc310 / IH328.2 ...): every word of a message is one dict lookup. A shop
+  resolves to its newest open ticket raised before the message
+- A message that reports a fix fills solution and resolve_time (its send time); one that asks
+  for a follow-up fills fu_action; phone / remote / onsite wording fills ph_rm_os (PH / RM / OS)
+- Only empty fields are filled unless overwrite=True (hand-typed values are kept); the changes
+  go through TicketStore.batch, BATCH_SIZE tickets per persist
+
+Usage:
+    python backend/whatsapp_import.py "WhatsApp Chat with IT Support.zip" [--dry-run] [--overwrite] [--month-first]
+"""
+
+import argparse
+import calendar
+import io
+import os
+import re
+import sys
+import zipfile
+from bisect import bisect_right
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.ticket_index import ticket_ts
+
+RESOLUTION_FIELDS = ('resolve_time', 'ph_rm_os', 'solution', 'fu_action')
+BATCH_SIZE = 500
+MAX_TEXT = 500
+
+_TIME = r'(?:(上午|下午)\s*)?(\d{1,2}:\d{2}(?::\d{2})?)\s*([AaPp]\.?\s?[Mm]\.?|上午|下午)?'
+ANDROID_HEADER = re.compile(r'^(\d{1,4}[/.\-]\d{1,2}[/.\-]\d{2,4}),?\s+' + _TIME + r'\s+-\s+(.*)$')
+IOS_HEADER = re.compile(r'^\[(\d{1,4}[/.\-]\d{1,2}[/.\-]\d{2,4}),?\s+' + _TIME + r'\]\s*(.*)$')
+# Words with a digit: ticket numbers (HK542726, ITD-SUP-000217) and shop codes (SS09, IH328.2)
+WORD = re.compile(r'[A-Za-z0-9](?:[A-Za-z0-9.\-]*[A-Za-z0-9])?')
+# Invisible marks WhatsApp puts around names, times and attachments
+INVISIBLE = dict.fromkeys(map(ord, '\u200e\u200f\u202a\u202c\ufeff'), None)
+
+RESOLVED = re.compile(r'已處理|已完成|已解決|已修復|搞掂|處理好|已正常|回復正常|恢復正常|'
+                      r'\b(fixed|resolved|solved|done|completed)\b', re.IGNORECASE)
+FOLLOW_UP = re.compile(r'跟進|待跟|需要再|再上門|換機|訂貨|\b(follow[\s-]?up|f/u|pending)\b', re.IGNORECASE)
+METHODS = (
+    ('OS', re.compile(r'上門|到店|現場|\b(onsite|on-site|OS)\b', re.IGNORECASE)),
+    ('RM', re.compile(r'遙距|遠程|遙控|\b(remote|teamviewer|anydesk|RM)\b', re.IGNORECASE)),
+    ('PH', re.compile(r'電話|致電|\b(phone|call(ed)?|PH)\b', re.IGNORECASE)),
+)
+
+
+def open_lines(path):
+    """Lines of a chat export (.txt, or every .txt inside a .zip), read incrementally"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if name.lower().endswith('.txt'):
+                    with archive.open(name) as raw:
+                        yield from io.TextIOWrapper(raw, encoding='utf-8-sig', errors='replace')
+    else:
+        with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+            yield from f
+
+
+def parse_time(date_text, time_text, before=None, after=None, day_first=True):
+    fields = re.split(r'[/.\-]', date_text)
+    parts = [int(p) for p in fields]
+    if len(fields[0]) == 4:
+        year, month, day = parts
+    elif parts[0] > 12 or (day_first and parts[1] <= 12):
+        day, month, year = parts
+    else:
+        month, day, year = parts
+    if year < 100:
+        year += 2000
+    pieces = [int(p) for p in time_text.split(':')]
+    hour, minute = pieces[0], pieces[1]
+    second = pieces[2] if len(pieces) > 2 else 0
+    marker = (before or after or '').replace('.', '').replace(' ', '').lower()
+    if marker in ('pm', '下午') and hour < 12:
+        hour += 12
+    elif marker in ('am', '上午') and hour == 12:
+        hour = 0
+    return datetime(year, month, day, hour, minute, second)
+
+
+def iter_messages(lines, day_first=True):
+    """{"time", "sender", "text"} for every chat message; system notices (no sender) are skipped"""
+    current = None
+    for line in lines:
+        line = line.translate(INVISIBLE).replace('\u202f', ' ').rstrip('\r\n')
+        match = ANDROID_HEADER.match(line) or IOS_HEADER.match(line)
+        if match is None:
+            if current is not None:
+                current['text'] += '\n' + line
+            continue
+        if current is not None:
+            yield current
+        current = None
+        date_text, before, time_text, after, rest = match.groups()
+        sender, sep, text = rest.partition(': ')
+        if not sep:
+            continue
+        try:
+            sent = parse_time(date_text, time_text, before, after, day_first)
+        except ValueError:
+            continue
+        current = {"time": sent, "sender": sender.strip(), "text": text}
+    if current is not None:
+        yield current
+
+
+def shop_keys(shop):
+    key = (shop or '').strip().lower()
+    if not key:
+        return []
+    keys = [key]
+    # CDC shops are written without their prefix in the chat ("IH328.2" for cdcIH328.2)
+    if key.startswith('cdc') and key[3:4].isalpha():
+        keys.append(key[3:])
+    return keys
+
+
+class TicketMatcher:
+    def __init__(self, partitions):
+        self.tickets = {}       # upper-case ticket number -> (ticket number, fields already filled)
+        self.shops = {}         # shop key -> ([date_ts], [ticket number]) of open tickets, oldest first
+        for month in partitions.months():
+            if partitions.is_sealed(month):
+                continue
+            for ticket in partitions.read(month):
+                number = ticket.get('ticket_number')
+                if not number:
+                    continue
+                filled = {f for f in RESOLUTION_FIELDS if ticket.get(f)}
+                self.tickets[number.upper()] = (number, filled)
+                # Tickets migrated from ticket.json only have the date string
+                ts = ticket_ts(ticket)
+                if ts is not None and (ticket.get('status') or 'in progress') == 'in progress':
+                    for key in shop_keys(ticket.get('shop')):
+                        self.shops.setdefault(key, []).append((ts, number))
+        for key, entries in self.shops.items():
+            entries.sort()
+            self.shops[key] = ([ts for ts, _ in entries], [number for _, number in entries])
+
+    def match(self, text, sent):
+        """(ticket number, matched words) for a message - a ticket number wins over a shop code"""
+        words = [w for w in WORD.findall(text) if any(c.isdigit() for c in w)]
+        for word in words:
+            entry = self.tickets.get(word.upper())
+            if entry:
+                return entry[0], [word]
+        sent_ts = calendar.timegm(sent.timetuple())
+        for word in words:
+            times, numbers = self.shops.get(word.lower(), ((), ()))
+            # Newest ticket raised at or before the message
+            i = bisect_right(times, sent_ts)
+            if i:
+                return numbers[i - 1], [word]
+        return None, []
+
+    def filled(self, number):
+        return self.tickets[number.upper()][1]
+
+
+def extract(message, words):
+    """Resolution fields reported by one message ({} for chatter)"""
+    text = message['text']
+    for word in words:
+        text = text.replace(word, ' ')
+    text = ' '.join(text.split()).strip(' ,.:;，。：-')[:MAX_TEXT]
+    changes = {}
+    if FOLLOW_UP.search(message['text']):
+        changes['fu_action'] = text
+    elif RESOLVED.search(message['text']):
+        changes['solution'] = text
+        changes['resolve_time'] = message['time'].strftime('%Y-%m-%dT%H:%M')
+    if changes:
+        for code, pattern in METHODS:
+            if pattern.search(message['text']):
+                changes['ph_rm_os'] = code
+                break
+    return changes
+
+
+def collect_changes(lines, matcher, overwrite=False, day_first=True):
+    """({ticket number: changes}, counters) - later messages win over earlier ones"""
+    changes = {}
+    counters = {"messages": 0, "matched": 0, "resolution_messages": 0}
+    for message in iter_messages(lines, day_first):
+        counters['messages'] += 1
+        number, words = matcher.match(message['text'], message['time'])
+        if number is None:
+            continue
+        counters['matched'] += 1
+        found = extract(message, words)
+        if not found:
+            continue
+        counters['resolution_messages'] += 1
+        filled = matcher.filled(number)
+        found = {f: v for f, v in found.items() if v and (overwrite or f not in filled)}
+        if found:
+            changes.setdefault(number, {}).update(found)
+    return changes, counters
+
+
+def import_chat(path, store, overwrite=False, day_first=True, dry_run=False):
+    """Import a chat export into the ticket store; returns a summary"""
+    matcher = TicketMatcher(store.partitions)
+    changes, summary = collect_changes(open_lines(path), matcher, overwrite, day_first)
+    summary['tickets'] = len(changes)
+    summary['changes'] = [dict(fields, ticket_number=number) for number, fields in changes.items()]
+    summary['updated'] = summary['failed'] = 0
+    if dry_run:
+        return summary
+    items = [{"op": "update", "ticket": dict(fields, ticket_number=number)} for number, fields in changes.items()]
+    for start in range(0, len(items), BATCH_SIZE):
+        _, results = store.batch(items[start:start + BATCH_SIZE])
+        summary['updated'] += sum(1 for r in results if r['status'] == 'success')
+        summary['failed'] += sum(1 for r in results if r['status'] != 'success')
+    return summary
+
+
+if __name__ == "__main__":
+    from backend.ticket_duplicates import DUPLICATES_FILE
+    from backend.ticket_events import TicketEventLog
+    from backend.ticket_rollup import ROLLUP_FILE
+    from backend.ticket_store import TicketStore, ticket_partitions
+
+    parser = argparse.ArgumentParser(description="Fill ticket resolution fields from a WhatsApp chat export")
+    parser.add_argument('path', help="exported chat (.txt or .zip)")
+    parser.add_argument('--dry-run', action='store_true', help="only list what would change")
+    parser.add_argument('--overwrite', action='store_true', help="replace fields that already have a value")
+    parser.add_argument('--month-first', action='store_true', help="dates in the export are MM/DD/YYYY")
+    args = parser.parse_args()
+
+    store = TicketStore(ticket_partitions(), ROLLUP_FILE, DUPLICATES_FILE, TicketEventLog())
+    summary = import_chat(args.path, store, args.overwrite, not args.month_first, args.dry_run)
+    for change in summary['changes']:
+        fields = ', '.join(f"{f}={change[f]!r}"[:70] for f in RESOLUTION_FIELDS if f in change)
+        print(f"  {change['ticket_number']:16} {fields}")
+    print(f"{summary['messages']} messages, {summary['matched']} about a ticket, "
+          f"{summary['resolution_messages']} with resolution data -> {summary['tickets']} tickets"
+          + (" (dry run)" if args.dry_run else f", {summary['updated']} updated, {summary['failed']} failed"))
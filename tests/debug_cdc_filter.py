@@ -6,11 +6,14 @@ import os
 
 # Add the current directory to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from test import EmailFilterManager
+from backend.email_archive import EmailArchive, with_body
+from backend.email_log import EmailLog
 
-def test_cdc_filter():
-    """Test CDC filter with sample email data"""
+def test_cdc_filter(ticket_number=None):
+    """Test CDC filter with sample email data, or the logged email of `ticket_number`"""
     
     # Load the email filter manager
     filter_manager = EmailFilterManager()
@@ -94,6 +97,14 @@ ITD Call Center""",
         ]
     }
     
+    if ticket_number:
+        # Only that email's line is read out of the email log
+        logged = EmailLog().find_ticket(ticket_number)
+        if not logged:
+            print(f"No logged email for ticket {ticket_number}")
+            return
+        sample_email = with_body(logged[-1], EmailArchive())
+    
     print("Testing CDC filter with sample email...")
     print(f"Sender: {sample_email['sender']}")
     print(f"Subject: {sample_email['subject'][:50]}...")
@@ -162,4 +173,4 @@ ITD Call Center""",
         traceback.print_exc()
 
 if __name__ == "__main__":
-    test_cdc_filter()
+    test_cdc_filter(sys.argv[1] if len(sys.argv) > 1 else None)
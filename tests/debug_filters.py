@@ -1,7 +1,13 @@
 #!/usr/bin/env python3
 import json
+import os
 import sys
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.email_archive import EmailArchive, with_body
+from backend.email_log import EmailLog
+from backend.ticket_index import parse_bound
+
 # Set UTF-8 encoding for output
 if sys.platform == "win32":
     import codecs
@@ -16,12 +22,21 @@ def safe_str(text):
     except:
         return "[UNICODE_ERROR]"
 
-def debug_filtering():
-    # Load data
-    with open('outlook_emails.json', 'r', encoding='utf-8') as f:
-        emails = json.load(f)
-    
-    with open('email_filters.json', 'r', encoding='utf-8') as f:
+def load_emails(args):
+    """Emails to debug, read from the email log without loading all of it:
+    a ticket number, a FROM TO date range, or (default) the 5 most recently logged"""
+    log = EmailLog()
+    if len(args) == 1:
+        emails = log.find_ticket(args[0])
+    elif len(args) == 2:
+        emails = log.time_range(parse_bound(args[0]), parse_bound(args[1], end=True))
+    else:
+        emails = log.records(range(max(0, len(log) - 5), len(log)))
+    archive = EmailArchive()
+    return [with_body(email, archive) for email in emails]
+
+def debug_filtering(emails):
+    with open('database/email_filters.json', 'r', encoding='utf-8') as f:
         filters = json.load(f)
     
     print("="*80)
@@ -31,7 +46,7 @@ def debug_filtering():
     cdc_count = 0
     mx_count = 0
     
-    for i, email in enumerate(emails[:5]):  # Just check first 5 emails
+    for i, email in enumerate(emails):
         print(f"\n[Email {i+1}]")
         sender = safe_str(email.get('sender', 'N/A'))
         subject = safe_str(email.get('subject', 'N/A'))
@@ -110,7 +125,8 @@ def debug_filtering():
     print("="*80)
     print(f"CDC emails matched: {cdc_count}")
     print(f"MX emails matched: {mx_count}")
-    print(f"Total emails processed: {min(5, len(emails))}")
+    print(f"Total emails processed: {len(emails)}")
 
 if __name__ == "__main__":
-    debug_filtering()
+    # python tests/debug_filters.py [TICKET_NUMBER | FROM TO]
+    debug_filtering(load_emails(sys.argv[1:]))
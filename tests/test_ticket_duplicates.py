@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Test that the LSH banding finds near-duplicate tickets at DUPLICATE_THRESHOLD
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.ticket_duplicates import BANDS, DUPLICATE_THRESHOLD, ROWS, DuplicateIndex, minhash, similarity
+
+ALPHABET = '電子餐牌不能開機分店畫面重啟無法調整回去請師傅盡快處理打印機網絡收銀系統'
+
+
+def test_banding_threshold_below_duplicate_threshold():
+    # Probability that a pair at exactly the threshold shares at least one band
+    assert 1 - (1 - DUPLICATE_THRESHOLD ** ROWS) ** BANDS >= 0.95
+
+
+def test_recall_at_threshold():
+    rng = random.Random(7)
+    index = DuplicateIndex()
+    pairs = []
+    while len(pairs) < 300:
+        n = len(pairs)
+        text = ''.join(rng.choice(ALPHABET) for _ in range(30))
+        # Replace about a quarter of the characters: true Jaccard ends up around 0.5
+        edited = ''.join(rng.choice(ALPHABET) if rng.random() < 0.25 else c for c in text)
+        a, b = minhash(text), minhash(edited)
+        score = similarity(a, b)
+        if not DUPLICATE_THRESHOLD <= score < DUPLICATE_THRESHOLD + 0.15:
+            continue
+        shop = f'SS{n}'
+        index.add({"ticket_number": f"A{n}", "shop": shop, "description": text, "date": "2026-02-26 10:00"})
+        index.add({"ticket_number": f"B{n}", "shop": shop, "description": edited, "date": "2026-02-26 11:00"})
+        pairs.append(n)
+
+    found = sum(1 for n in pairs if f"B{n}" in dict(index.similar(f"A{n}")))
+    assert found / len(pairs) >= 0.95, f"recall {found}/{len(pairs)}"
+
+
+if __name__ == "__main__":
+    test_banding_threshold_below_duplicate_threshold()
+    test_recall_at_threshold()
+    print("ok")
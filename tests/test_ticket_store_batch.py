@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Test that TicketStore.batch reports malformed items per item instead of raising
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.ticket_store import TicketStore, ticket_partitions
+
+
+def test_batch_rejects_non_dict_items():
+    with tempfile.TemporaryDirectory() as root:
+        store = TicketStore(ticket_partitions(root), os.path.join(root, 'rollup.json'),
+                            os.path.join(root, 'duplicates.json'))
+        items = [
+            1,
+            "x",
+            {"op": "update", "ticket": ["HK1"]},
+            {"op": "create", "ticket": {"ticket_number": "HK542726", "shop": "SS96",
+                                        "date": "2026-02-26 10:35", "description": "POS down"}},
+        ]
+        persisted, results = store.batch(items)
+
+        assert persisted
+        assert [r['status'] for r in results] == ['error', 'error', 'error', 'success']
+        assert [r['index'] for r in results] == [0, 1, 2, 3]
+        assert 'must be an object' in results[0]['message']
+        assert [t['ticket_number'] for t in store.load()] == ['HK542726']
+
+        # atomic=True stops at the first bad item and saves nothing
+        persisted, results = store.batch([{"op": "create", "ticket": {"ticket_number": "HK1"}}, None], atomic=True)
+        assert not persisted
+        assert results[-1]['status'] == 'error'
+        assert [t['ticket_number'] for t in store.load()] == ['HK542726']
+
+
+if __name__ == "__main__":
+    test_batch_rejects_non_dict_items()
+    print("ok")
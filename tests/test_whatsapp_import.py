@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Test WhatsApp shop-code matching against tickets that only have a date string
+(tickets migrated from ticket.json carry no date_ts)
+"""
+
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.whatsapp_import import TicketMatcher
+
+
+class Partitions:
+    """The three PartitionedStore methods TicketMatcher reads"""
+
+    def __init__(self, tickets):
+        self.tickets = tickets
+
+    def months(self):
+        return ['2026-02']
+
+    def is_sealed(self, month):
+        return False
+
+    def read(self, month):
+        return self.tickets
+
+
+def test_shop_matches_newest_ticket_raised_before_message():
+    matcher = TicketMatcher(Partitions([
+        {"ticket_number": "HK542330", "shop": "cdc1F", "date": "2026-02-19 09:00", "status": "in progress"},
+        {"ticket_number": "HK100001", "shop": "cdc1F", "date": "2025-12-30 10:00", "status": "in progress"},
+        {"ticket_number": "HK200002", "shop": "cdc1F", "date": "2026-01-15 10:00", "status": "in progress"},
+        {"ticket_number": "HK999999", "shop": "cdc1F", "date": "not a date", "status": "in progress"},
+    ]))
+
+    assert matcher.match("cdc1F printer fixed", datetime(2026, 1, 1, 12, 0)) == ("HK100001", ["cdc1F"])
+    assert matcher.match("cdc1F printer fixed", datetime(2026, 1, 20, 12, 0)) == ("HK200002", ["cdc1F"])
+    assert matcher.match("cdc1F printer fixed", datetime(2026, 2, 20, 12, 0)) == ("HK542330", ["cdc1F"])
+    # Before the oldest ticket: nothing to attach the message to
+    assert matcher.match("cdc1F printer fixed", datetime(2025, 12, 1)) == (None, [])
+
+
+if __name__ == "__main__":
+    test_shop_matches_newest_ticket_raised_before_message()
+    print("ok")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark: email corpus as dict-of-dicts vs compact EmailRecords
+- Builds a synthetic corpus shaped like outlook_emails.json (a few dozen senders, the
+  iSupport recipient on most emails, recurring CC lists, bodies referenced by hash)
+- Each mode runs in a fresh process and reports the RSS growth of loading it
+  (traced allocations where RSS can't be read, e.g. on Windows)
+
+Usage:
+    python utils/bench_email_memory.py [--emails 300000]
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.email_records import EmailCorpus
+
+SENDERS = [f"Sender {i}" for i in range(40)] + ["CDC ITD CallCenter", "MX-helpdesk", "Fairwood Workflow"]
+CC = [{"name": f"ops{i}@example.com", "email": f"ops{i}@example.com", "type": 2} for i in range(30)]
+ISUPPORT = {"name": "iSupport", "email": "/o=ExchangeLabs/ou=Exchange Administrative Group/cn=Recipients/cn=isupport", "type": 1}
+ACTIONS = [[], ["extract_cdc"], ["send_mx_alert"], ["extract_fw"]]
+
+
+def synthetic_lines(count, seed=1):
+    """NDJSON lines (as the email log stores them) so every parsed email owns its strings"""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        recipients = [ISUPPORT] if rng.random() < 0.9 else []
+        recipients += rng.sample(CC, rng.randint(0, 3))
+        email = {
+            "sender": rng.choice(SENDERS),
+            "date": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00+00:00",
+            "subject": f"[HK{540000 + i}] Ticket subject {rng.randint(0, 10 ** 6)}",
+            "recipients": recipients,
+            "filter_actions": rng.choice(ACTIONS),
+            "body_hash": f"{rng.getrandbits(128):032x}",
+        }
+        if email["filter_actions"]:
+            email["ticket_number"] = f"HK{540000 + i}"
+            email["shop"] = f"cdc{rng.randint(1, 500)}"
+        lines.append(json.dumps(email, ensure_ascii=False))
+    return lines
+
+
+def rss_bytes():
+    """Current resident set size (Linux /proc), or None where unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def measure(mode, count):
+    lines = synthetic_lines(count)
+    gc.collect()
+    rss_before = rss_bytes()
+    if rss_before is None:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if mode == 'dicts':
+        corpus = [json.loads(line) for line in lines]
+    else:
+        corpus = EmailCorpus()
+        for line in lines:
+            corpus.add(json.loads(line))
+    seconds = time.perf_counter() - start
+    gc.collect()
+    if rss_before is None:
+        used, method = tracemalloc.get_traced_memory()[0], "traced"
+        tracemalloc.stop()
+    else:
+        used, method = rss_bytes() - rss_before, "RSS"
+    assert len(corpus) == count
+    return {"mode": mode, "seconds": round(seconds, 2), "bytes": used, "method": method}
+
+
+def run_isolated(mode, count):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--emails', str(count), '--mode', mode],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def mb(n):
+    return f"{n / 1024 / 1024:.1f} MB"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare email corpus memory: dicts vs compact records")
+    parser.add_argument('--emails', type=int, default=300000)
+    parser.add_argument('--mode', choices=('dicts', 'compact'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(measure(args.mode, args.emails)))
+        sys.exit(0)
+
+    print(f"Loading {args.emails:,} synthetic emails (each mode in its own process)...")
+    results = {mode: run_isolated(mode, args.emails) for mode in ('dicts', 'compact')}
+    for r in results.values():
+        print(f"  {r['mode']:8} {r['method']} +{mb(r['bytes']):>10}   load {r['seconds']}s")
+    saved = results['dicts']['bytes'] - results['compact']['bytes']
+    print(f"Saved {mb(saved)} ({saved / results['dicts']['bytes']:.0%} of the dict-of-dicts corpus)")
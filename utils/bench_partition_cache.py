@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Load-time benchmark: JSON partitions vs their binary (marshal) cache
+- Writes a synthetic ticket history (shaped like database/tickets/) into a temp directory
+- Times a full load with the cache off (JSON parse), the first cached load (JSON parse + cache
+  write) and warm cached loads, for active and sealed (gzip) partitions
+- Checks that every mode returns the same tickets
+
+Usage:
+    python utils/bench_partition_cache.py [--tickets 100000] [--months 12] [--rounds 5]
+"""
+
+import argparse
+import gc
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.partitions import CACHE_DIR, PartitionedStore
+from backend.ticket_index import stamp
+from backend.ticket_store import ticket_key
+
+SHOPS = [f"cdc{i}" for i in range(300)] + [f"mx{i}" for i in range(200)] + [f"fw{i}" for i in range(100)]
+PROBLEMS = ["電子餐牌不能開機", "POS machine hang, please arrange onsite", "門口嘅電視mon黑屏",
+            "Printer cannot print receipt", "分店電子餐倉第二倉畫面橫向咗,重啟無法調整回去,請師傅盡快處理,謝謝"]
+HANDLERS = ["USE_MISSING", "Alex", "Sam", "Jo", "Kit"]
+
+
+def synthetic_tickets(count, months, seed=1):
+    rng = random.Random(seed)
+    today = date.today()
+    tickets = []
+    for i in range(count):
+        back = rng.randrange(months)
+        year, month = divmod(today.year * 12 + today.month - 1 - back, 12)
+        tickets.append(stamp({
+            "ticket_number": f"HK{540000 + i}",
+            "shop": rng.choice(SHOPS),
+            "description": rng.choice(PROBLEMS) + f" #{rng.randint(1, 999)}",
+            "date": f"{year}-{month + 1:02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}",
+            "problem": "", "resolve_time": "", "ph_rm_os": "", "solution": "", "fu_action": "",
+            "handled_by": rng.choice(HANDLERS),
+            "status": "in progress" if back == 0 else rng.choice(["completed", "completed", "cancelled"])
+        }))
+    return tickets
+
+
+def timed_load(store, rounds):
+    best = None
+    for _ in range(rounds):
+        gc.collect()
+        start = time.perf_counter()
+        tickets = store.load()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, tickets
+
+
+def ms(seconds):
+    return f"{seconds * 1000:8.1f} ms"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare partition load time: JSON vs marshal cache")
+    parser.add_argument('--tickets', type=int, default=100000)
+    parser.add_argument('--months', type=int, default=12)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='partition-bench-')
+    try:
+        print(f"Writing {args.tickets:,} synthetic tickets over {args.months} months...")
+        writer = PartitionedStore(directory, ticket_key, cache=False)
+        tickets = synthetic_tickets(args.tickets, args.months)
+        writer.write(tickets, {t['date'][:7] for t in tickets})
+        writer.seal(closed=lambda records: True)
+        json_bytes = sum(os.path.getsize(os.path.join(directory, n)) for n in os.listdir(directory)
+                         if n.endswith(('.json', '.json.gz')) and n != 'manifest.json')
+
+        json_time, expected = timed_load(PartitionedStore(directory, ticket_key, cache=False), args.rounds)
+        cached = PartitionedStore(directory, ticket_key)
+        first_time, _ = timed_load(cached, 1)
+        warm_time, loaded = timed_load(cached, args.rounds)
+        cache_dir = os.path.join(directory, CACHE_DIR)
+        cache_bytes = sum(os.path.getsize(os.path.join(cache_dir, n)) for n in os.listdir(cache_dir))
+        assert loaded == expected, "cached load differs from the JSON"
+
+        print(f"  {len(writer.months())} partitions ({len([m for m in writer.months() if writer.is_sealed(m)])} sealed), "
+              f"{json_bytes:,} bytes on disk, cache {cache_bytes:,} bytes")
+        print(f"  JSON parse          {ms(json_time)}")
+        print(f"  first cached load   {ms(first_time)}  (parse + cache write)")
+        print(f"  warm cached load    {ms(warm_time)}  ({json_time / warm_time:.1f}x faster)")
+    finally:
+        shutil.rmtree(directory)